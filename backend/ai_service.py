@@ -1,16 +1,37 @@
-from typing import Dict, List, Any, Optional
-from openai import OpenAI
+from typing import Dict, Iterator, List, Any, Optional, Tuple, TYPE_CHECKING
 import os
+import time
 from pathlib import Path
 from datetime import datetime
+import importlib.util
 import logging
 import json
-import torch
+import threading
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image
 import numpy as np
 from io import BytesIO
 import base64
-from transformers import CLIPProcessor, CLIPModel
+from llm_cache import CachedOpenAI, LazyOpenAI
+from embedding_cache import TextEmbeddingCache, get_text_embedding_cache
+from model_registry import CLIP_MODEL_ID, clip_key, get_clip, registry
+from clip_preprocess import ClipPreprocessor
+from batching import MicroBatcher
+from sd_runtime import CPUProfile
+from blob_store import BlobStore, content_key
+from image_store import ImageStore
+from image_proxy import ImageProxy
+from embedding_index import EmbeddingIndex
+from semantic_cache import SemanticImageCache
+from local_analyzer import LocalFeatureAnalyzer
+from json_stream import JSONObjectStream
+from metrics import STAGE_SECONDS, timed
+from resilience import CircuitOpenError, ResilientOpenAI
+
+if TYPE_CHECKING:
+    import torch
+    from openai import OpenAI
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -21,26 +42,119 @@ if not logger.handlers:
     handler.setFormatter(formatter)
     logger.addHandler(handler)
 
+SD_NEGATIVE_PROMPT = "blurry, low quality, distorted, ugly, bad anatomy, bad hands, bad proportions, poorly drawn, deformed, mutated, extra limbs, missing limbs, watermark, signature, text"
+SD_INFERENCE_STEPS = 20
+SD_GUIDANCE_SCALE = 7.5
+# CLIP 图像预处理走 ClipPreprocessor（JPEG 降采样解码）；设为 0 时使用 CLIPProcessor
+CLIP_FAST_PREPROCESS = os.getenv('CLIP_FAST_PREPROCESS', '1') == '1'
+# 生成的图片是否也写入向量索引（需要额外下载并编码一次）
+INDEX_GENERATED_IMAGES = os.getenv('EMBEDDING_INDEX_GENERATED', '1') == '1'
+# 特征分析要求严格的 JSON Schema 输出；模型或代理不支持时设为 0，改用提示词约束格式
+ANALYSIS_JSON_SCHEMA = os.getenv('ANALYSIS_JSON_SCHEMA', '1') == '1'
+# 特征分析引擎：gpt，或 local（只用 CLIP 和内置描述词表，不调用 GPT）；请求可单独指定
+ANALYSIS_ENGINES = ('gpt', 'local')
+ANALYSIS_ENGINE = os.getenv('ANALYSIS_ENGINE', 'gpt')
+# GPT 分析失败或没有结果时改用本地分析
+ANALYSIS_LOCAL_FALLBACK = os.getenv('ANALYSIS_LOCAL_FALLBACK', '1') == '1'
+
+# 分析的类别及说明；JSON Schema 模式下模型按这个顺序输出
+ANALYSIS_CATEGORIES = {
+    'color': 'Color palette and tones',
+    'style': 'Artistic style and technique',
+    'composition': 'Layout and arrangement',
+    'lighting': 'Light and shadow effects',
+    'mood': 'Emotional atmosphere',
+    'object': 'Any subject or entity in the scene: cars, people, animals, etc.',
+    'perspective': 'Viewpoint and depth',
+    'detail': 'Level of detail and complexity',
+    'texture': 'Surface qualities',
+}
+
+_ANALYSIS_TERMS_SCHEMA = {
+    'type': 'array',
+    'items': {
+        'type': 'object',
+        'properties': {'term': {'type': 'string'}, 'score': {'type': 'number'}},
+        'required': ['term', 'score'],
+        'additionalProperties': False
+    }
+}
+ANALYSIS_RESPONSE_FORMAT = {
+    'type': 'json_schema',
+    'json_schema': {
+        'name': 'feature_analysis',
+        'strict': True,
+        'schema': {
+            'type': 'object',
+            'properties': {category: _ANALYSIS_TERMS_SCHEMA for category in ANALYSIS_CATEGORIES},
+            'required': list(ANALYSIS_CATEGORIES),
+            'additionalProperties': False
+        }
+    }
+}
+
 class AIService:
-    def __init__(self, client: OpenAI = None):
+    def __init__(self, client: "OpenAI" = None):
 
-        self.client = client or OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.client = client or CachedOpenAI(
+            ResilientOpenAI(LazyOpenAI(api_key=os.getenv('OPENAI_API_KEY'), max_retries=0))
+        )
+        self._device = None
 
 
-        try:
-            self.clip_model = CLIPModel.from_pretrained("openai/clip-vit-base-patch32")
-            self.clip_processor = CLIPProcessor.from_pretrained("openai/clip-vit-base-patch32")
-            self.clip_model.to(self.device)
-            logger.info(f"CLIP model loaded on {self.device}")
-        except Exception as e:
-            logger.warning(f"Failed to load CLIP model: {e}")
-            self.clip_model = None
-            self.clip_processor = None
+        # CLIP 在首次使用或后台预热时加载，不阻塞服务启动
+        self._clip = None
+        self._clip_preprocessor = None
+        self._warmup_thread = None
+        # 启动预热会加载的组件；其余组件在首次使用时才加载
+        self.warmup_components: Tuple[str, ...] = ()
+
+        # 描述词模板的向量缓存（可持久化）；用户提示大多只出现一次，单独放在一个不落盘的小缓存里，
+        # 只为同一请求内的重复编码（如语义缓存查询后再写入索引），不会挤掉描述词
+        self.text_embedding_cache = get_text_embedding_cache(CLIP_MODEL_ID)
+        self.prompt_embedding_cache = TextEmbeddingCache(capacity=int(os.getenv('CLIP_PROMPT_CACHE_SIZE', '256')))
 
 
         self.sd_pipeline = None
         self.sd_available = self._check_sd_availability()
+        self.sd_cpu_profile = CPUProfile.from_env()
+        self.sd_model_id = os.getenv('SD_MODEL_ID', 'runwayml/stable-diffusion-v1-5')
+
+        # 固定种子的生成结果按内容寻址缓存到磁盘（设置 SD_CACHE_DIR 开启）
+        self.sd_result_cache = BlobStore.from_env('SD_CACHE_DIR', 'SD_CACHE_MAX_MB', suffix='.png')
+
+        # 本地生成的图片落盘后通过 /api/images/<id> 返回，JSON 里只放短链接
+        self.image_store = ImageStore.from_env()
+
+        # 远程图片（DALL-E 返回的链接）经由连接池下载并缓存到磁盘
+        self.image_proxy = ImageProxy.from_env()
+
+        # 相同尺寸和步数的并发请求在短时间窗口内合并成一批
+        self.sd_batcher = MicroBatcher(
+            self._run_stable_diffusion_batch,
+            max_batch_size=int(os.getenv('SD_BATCH_MAX_SIZE', '4')),
+            max_wait_ms=float(os.getenv('SD_BATCH_MAX_WAIT_MS', '50')),
+            name='sd-batcher'
+        )
+
+        # CLIP 图像编码由单个工作线程执行，并发请求的图片在等待窗口内拼成一个批次
+        self.clip_batcher = MicroBatcher(
+            self._run_clip_image_batch,
+            max_batch_size=int(os.getenv('CLIP_BATCH_MAX_SIZE', '16')),
+            max_wait_ms=float(os.getenv('CLIP_BATCH_MAX_WAIT_MS', '10')),
+            name='clip-batcher'
+        )
+
+        # 分析和生成过的图像、提示的 CLIP 向量追加到磁盘索引，供 /api/similar 检索；
+        # 写入在单独的后台线程里进行，不占用请求时间
+        self.embedding_index = EmbeddingIndex.from_env()
+        self._index_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='embedding-index')
+
+        # 措辞不同但语义相近的提示直接复用最近的生成结果（设置 SEMANTIC_CACHE_SIZE 开启）
+        self.semantic_cache = SemanticImageCache.from_env()
+
+        # 不依赖 GPT 的本地特征分析（CLIP 文本向量 + 描述词表），描述词向量在预热时计算
+        self.local_analyzer = LocalFeatureAnalyzer.from_env()
 
 
         self.feature_types = {
@@ -55,105 +169,215 @@ class AIService:
             'texture': {'name': 'Texture', 'descriptors': []}
         }
 
+    @property
+    def device(self) -> str:
+        if self._device is None:
+            import torch
+            self._device = "cuda" if torch.cuda.is_available() else "cpu"
+        return self._device
+
+    @property
+    def clip_model(self):
+        clip = self._load_clip()
+        return clip[0] if clip else None
+
+    @property
+    def clip_processor(self):
+        clip = self._load_clip()
+        return clip[1] if clip else None
+
+    @property
+    def clip_preprocessor(self) -> Optional[ClipPreprocessor]:
+        self._load_clip()
+        return self._clip_preprocessor
+
+    def _load_clip(self):
+        """加载共享 CLIP 模型；失败后由 registry 按退避间隔重试，期间直接返回 None"""
+        if self._clip is None:
+            try:
+                clip = get_clip(self.device)
+            except Exception:
+                # registry 已记录失败并安排了重试时间
+                return None
+            if CLIP_FAST_PREPROCESS and self._clip_preprocessor is None:
+                self._clip_preprocessor = ClipPreprocessor.from_processor(clip[1])
+            self._clip = clip
+        return self._clip
+
+    def start_warmup(self, preload_sd: bool = False) -> threading.Thread:
+        """在后台线程中预热 OpenAI 客户端、CLIP 以及（可选）Stable Diffusion"""
+        if self._warmup_thread is None:
+            self.warmup_components = ('openai', 'clip') + (
+                ('stable_diffusion',) if preload_sd and self.sd_available else ()
+            )
+            self._warmup_thread = threading.Thread(
+                target=self._warmup,
+                args=(preload_sd,),
+                name="model-warmup",
+                daemon=True
+            )
+            self._warmup_thread.start()
+        return self._warmup_thread
+
+    def _warmup(self, preload_sd: bool):
+        started = datetime.now()
+        load_client = getattr(self.client, 'load', None)
+        if callable(load_client):
+            try:
+                load_client()
+            except Exception as e:
+                logger.warning(f"OpenAI client warm-up failed: {e}")
+
+        self._load_clip()
+
+        if self.clip_model is not None and (ANALYSIS_ENGINE == 'local' or ANALYSIS_LOCAL_FALLBACK):
+            try:
+                self.local_analyzer.prepare(self._encode_texts)
+            except Exception as e:
+                logger.warning(f"Local analyzer warm-up failed: {e}")
+
+        if preload_sd and self.sd_available:
+            try:
+                self._init_stable_diffusion_local()
+            except Exception:
+                pass
+
+        logger.info(f"Warm-up finished in {(datetime.now() - started).total_seconds():.1f}s")
+
+    def get_component_status(self) -> Dict[str, str]:
+        """各组件就绪状态：pending / loading / ready / failed / unavailable / on_demand
+
+        不在预热范围内、也还没被请求过的组件报告 on_demand（首次使用时才加载），而不是 pending。
+        CLIP 加载失败且退避时间已过时，在后台重试一次，就绪探针不必等到有请求用到 CLIP
+        """
+        # 还没有解析过 device 时 CLIP 不可能开始加载，避免为健康检查导入 torch
+        clip_status = registry.status(clip_key(self._device)) if self._device else 'pending'
+        if clip_status == 'failed' and registry.retry_due(clip_key(self._device)):
+            threading.Thread(target=self._load_clip, name='clip-retry', daemon=True).start()
+        components = {
+            'openai': 'ready' if getattr(self.client, 'is_loaded', True) else 'pending',
+            'clip': clip_status,
+            'stable_diffusion': registry.status(f"sd:{self.sd_model_id}") if self.sd_available else 'unavailable'
+        }
+        return {
+            name: 'on_demand' if state == 'pending' and name not in self.warmup_components else state
+            for name, state in components.items()
+        }
+
     def _check_sd_availability(self) -> bool:
-        """检查 Stable Diffusion 本地可用性"""
-        try:
-            from diffusers import StableDiffusionPipeline
+        """检查 Stable Diffusion 本地可用性（只查找包，不导入）"""
+        if importlib.util.find_spec('diffusers') is not None:
             logger.info("diffusers library available, Stable Diffusion can be loaded locally")
             return True
-        except ImportError:
-            logger.warning("diffusers library not installed. Install with: pip install diffusers transformers accelerate")
-            return False
+        logger.warning("diffusers library not installed. Install with: pip install diffusers transformers accelerate")
+        return False
 
     def _init_stable_diffusion_local(self):
-        """初始化本地 Stable Diffusion 管道"""
+        """初始化本地 Stable Diffusion 管道（进程内共享）"""
         if self.sd_pipeline is None:
+            model_id = self.sd_model_id
             try:
-                from diffusers import StableDiffusionPipeline
-                logger.info("Loading Stable Diffusion pipeline locally...")
-
-
-                model_id = os.getenv('SD_MODEL_ID', 'runwayml/stable-diffusion-v1-5')
-                logger.info(f"Loading model: {model_id}")
-
-                self.sd_pipeline = StableDiffusionPipeline.from_pretrained(
-                    model_id,
-                    torch_dtype=torch.float16 if torch.cuda.is_available() else torch.float32,
-                    safety_checker=None,
-                    requires_safety_checker=False,
-                    use_safetensors=True
+                self.sd_pipeline = registry.get(
+                    f"sd:{model_id}",
+                    lambda: self._load_stable_diffusion(model_id)
                 )
+            except Exception as e:
+                logger.error(f"Failed to load Stable Diffusion pipeline: {e}")
+                raise
 
-                if torch.cuda.is_available():
-                    self.sd_pipeline = self.sd_pipeline.to("cuda")
+    def _load_stable_diffusion(self, model_id: str):
+        """加载 Stable Diffusion 管道并应用优化"""
+        import torch
+        from diffusers import StableDiffusionPipeline
+        logger.info("Loading Stable Diffusion pipeline locally...")
+        logger.info(f"Loading model: {model_id}")
 
+        pipeline = StableDiffusionPipeline.from_pretrained(
+            model_id,
+            torch_dtype=torch.float16 if torch.cuda.is_available() else torch.float32,
+            safety_checker=None,
+            requires_safety_checker=False,
+            use_safetensors=True
+        )
 
-                    try:
-                        self.sd_pipeline.enable_attention_slicing()
-                        logger.info("Attention slicing enabled")
-                    except AttributeError:
-                        logger.info("Attention slicing not available in this version")
+        if torch.cuda.is_available():
+            pipeline = pipeline.to("cuda")
 
-                    try:
-                        self.sd_pipeline.enable_model_cpu_offload()
-                        logger.info("Model CPU offload enabled")
-                    except AttributeError:
-                        logger.info("Model CPU offload not available in this version")
 
+            try:
+                pipeline.enable_attention_slicing()
+                logger.info("Attention slicing enabled")
+            except AttributeError:
+                logger.info("Attention slicing not available in this version")
+
+            try:
+                pipeline.enable_model_cpu_offload()
+                logger.info("Model CPU offload enabled")
+            except AttributeError:
+                logger.info("Model CPU offload not available in this version")
 
-                    try:
-                        self.sd_pipeline.enable_xformers_memory_efficient_attention()
-                        logger.info("xformers memory optimization enabled")
-                    except Exception as e:
-                        logger.info(f"xformers not available: {e}")
 
-                logger.info("Stable Diffusion pipeline loaded successfully")
+            try:
+                pipeline.enable_xformers_memory_efficient_attention()
+                logger.info("xformers memory optimization enabled")
             except Exception as e:
-                logger.error(f"Failed to load Stable Diffusion pipeline: {e}")
-                raise
+                logger.info(f"xformers not available: {e}")
 
-    def _generate_with_stable_diffusion_local(self, prompt: str, size: str = "512x512") -> str:
-        """使用本地 Stable Diffusion 生成图像"""
-        try:
-            self._init_stable_diffusion_local()
+        else:
+            pipeline = self.sd_cpu_profile.apply(pipeline)
 
+        logger.info("Stable Diffusion pipeline loaded successfully")
+        return pipeline
 
+    def _generate_with_stable_diffusion_local(self, prompt: str, size: str = "512x512", seed: Optional[int] = None) -> str:
+        """使用本地 Stable Diffusion 生成图像；相同参数和种子直接返回缓存结果"""
+        try:
             width, height = map(int, size.split('x'))
 
 
             width = (width // 8) * 8
             height = (height // 8) * 8
 
-            logger.info(f"Generating image locally with Stable Diffusion: {prompt}")
-            logger.info(f"Size: {width}x{height}")
-
-
-            negative_prompt = "blurry, low quality, distorted, ugly, bad anatomy, bad hands, bad proportions, poorly drawn, deformed, mutated, extra limbs, missing limbs, watermark, signature, text"
+            if seed is None:
+                seed = int.from_bytes(os.urandom(4), 'little')
 
+            cache_key = content_key({
+                'prompt': prompt,
+                'negative_prompt': SD_NEGATIVE_PROMPT,
+                'seed': seed,
+                'width': width,
+                'height': height,
+                'steps': SD_INFERENCE_STEPS,
+                'guidance_scale': SD_GUIDANCE_SCALE,
+                'model_id': self.sd_model_id
+            })
+
+            png = self.sd_result_cache.get(cache_key) if self.sd_result_cache else None
+            if png is not None:
+                logger.info(f"Stable Diffusion cache hit for seed {seed}: {prompt}")
+            else:
+                self._init_stable_diffusion_local()
 
-            generator = torch.Generator(device=self.device).manual_seed(
-                torch.randint(0, 2**32 - 1, (1,)).item()
-            )
+                logger.info(f"Generating image locally with Stable Diffusion: {prompt}")
+                logger.info(f"Size: {width}x{height}, seed: {seed}")
 
 
-            with torch.autocast("cuda" if torch.cuda.is_available() else "cpu"):
-                result = self.sd_pipeline(
-                    prompt=prompt,
-                    negative_prompt=negative_prompt,
-                    width=width,
-                    height=height,
-                    num_inference_steps=20,
-                    guidance_scale=7.5,
-                    generator=generator,
-                    num_images_per_prompt=1
+                image = self.sd_batcher.run(
+                    {'prompt': prompt, 'seed': seed},
+                    key=(width, height, SD_INFERENCE_STEPS, SD_GUIDANCE_SCALE)
                 )
 
-                image = result.images[0]
 
+                buffer = BytesIO()
+                image.save(buffer, format='PNG', quality=95)
+                png = buffer.getvalue()
+                if self.sd_result_cache:
+                    self.sd_result_cache.put(cache_key, png)
+
+            if self.image_store:
+                return self.image_store.url_for(self.image_store.put_png(png))
 
-            buffer = BytesIO()
-            image.save(buffer, format='PNG', quality=95)
-            image_b64 = base64.b64encode(buffer.getvalue()).decode()
+            image_b64 = base64.b64encode(png).decode()
 
             return f"data:image/png;base64,{image_b64}"
 
@@ -161,8 +385,39 @@ class AIService:
             logger.error(f"Local Stable Diffusion generation failed: {e}")
             raise
 
-    def analyze_features(self, prompt: str, image_data: Optional[bytes] = None) -> Dict[str, Any]:
-        """分析文本提示和可选图像的特征"""
+    @timed('sd_batch')
+    def _run_stable_diffusion_batch(self, key, items: List[Dict[str, Any]]) -> List[Image.Image]:
+        """一次管道调用生成一批图像，每张图使用各自的随机种子"""
+        import torch
+
+        width, height, steps, guidance_scale = key
+        prompts = [item['prompt'] for item in items]
+        generators = [
+            torch.Generator(device=self.device).manual_seed(item['seed'])
+            for item in items
+        ]
+
+        logger.info(f"Running Stable Diffusion batch of {len(items)} at {width}x{height}")
+
+
+        autocast = torch.autocast("cuda") if torch.cuda.is_available() else self.sd_cpu_profile.autocast()
+        with autocast:
+            result = self.sd_pipeline(
+                prompt=prompts,
+                negative_prompt=[SD_NEGATIVE_PROMPT] * len(items),
+                width=width,
+                height=height,
+                num_inference_steps=steps,
+                guidance_scale=guidance_scale,
+                generator=generators,
+                num_images_per_prompt=1
+            )
+
+        return result.images
+
+    def analyze_features(self, prompt: str, image_data: Optional[bytes] = None,
+                         engine: Optional[str] = None) -> Dict[str, Any]:
+        """分析文本提示和可选图像的特征；engine 为 gpt 或 local，默认取 ANALYSIS_ENGINE"""
         try:
             if not isinstance(prompt, str) or not prompt.strip():
                 raise ValueError("Invalid prompt: must be a non-empty string.")
@@ -171,46 +426,32 @@ class AIService:
                 raise ValueError("Invalid image_data: must be base64-encoded string or bytes.")
 
 
-            logger.info(f"Starting GPT analysis for prompt: {prompt}")
-            prompt_features = self.analyze_prompt_with_gpt(prompt)
-            logger.info(f"GPT analysis result: {json.dumps(prompt_features, indent=2)}")
+            logger.info(f"Starting prompt analysis for prompt: {prompt}")
+            requested = engine or ANALYSIS_ENGINE
+            prompt_features, engine = self.analyze_prompt(prompt, requested)
+            logger.info(f"Prompt analysis result ({engine}): {json.dumps(prompt_features, indent=2)}")
 
 
             if not prompt_features or not isinstance(prompt_features, dict):
-                logger.error("Invalid or empty GPT analysis result")
-                raise ValueError("Failed to get valid features from GPT analysis")
+                logger.error("Invalid or empty prompt analysis result")
+                raise ValueError(self.analysis_failure(engine))
 
 
             combined_features = dict(prompt_features)
+            self.index_prompts([prompt], 'analyze')
 
 
             if image_data and self.clip_model is not None:
                 try:
                     logger.info("Starting CLIP image analysis")
-                    clip_features = self.analyze_image_with_clip(image_data, prompt_features)
-
-
-                    for category, features in clip_features.items():
-                        if category in combined_features:
-                            combined_features[category].update(features)
-                        else:
-                            combined_features[category] = features
-
+                    clip_features = self.analyze_image_with_clip(image_data, prompt_features, prompt=prompt)
+                    self.merge_features(combined_features, clip_features)
                     logger.info(f"CLIP analysis completed and merged")
                 except Exception as e:
                     logger.warning(f"CLIP analysis failed, continuing with GPT results: {e}")
 
 
-            if not combined_features:
-                logger.warning("No features found in analysis")
-                return {'success': False, 'error': 'No features found'}
-
-
-            return {
-                'success': True,
-                'analysis': combined_features,
-                'active_categories': [cat for cat, feat in combined_features.items() if feat]
-            }
+            return self.analysis_result(combined_features, engine, requested)
 
         except Exception as e:
             logger.error(f"Feature analysis failed: {str(e)}", exc_info=True)
@@ -219,10 +460,154 @@ class AIService:
                 'error': str(e)
             }
 
-    def analyze_prompt_with_gpt(self, prompt: str) -> Dict:
-        """使用 GPT 分析文本提示中的视觉特征"""
+    def analyze_features_stream(self, prompt: str, image_data: Optional[bytes] = None,
+                                engine: Optional[str] = None) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """analyze_features 的流式版本：每个类别一完成就产出 ('category', 结果)，最后是 ('done', 结果) 或 ('error', 结果)"""
         try:
-            system_prompt = """
+            if not isinstance(prompt, str) or not prompt.strip():
+                raise ValueError("Invalid prompt: must be a non-empty string.")
+            requested = engine or ANALYSIS_ENGINE
+            if requested not in ANALYSIS_ENGINES:
+                raise ValueError(f"Unknown analysis engine: {requested}")
+
+            # 图像编码与 GPT 流同时进行，之后每个类别只需编码它自己的词
+            image_bytes, image_future, image_features = None, None, None
+            if image_data and self.clip_model is not None:
+                try:
+                    image_bytes = self._decode_image_bytes(image_data)
+                    image_future = self.clip_batcher.submit(self._prepare_image(image_bytes))
+                except Exception as e:
+                    logger.warning(f"CLIP analysis failed, continuing with GPT results: {e}")
+
+            combined_features = {}
+
+            def scored(category: str, terms: Dict[str, float]) -> Dict[str, Any]:
+                nonlocal image_future, image_features
+                features = {category: dict(terms)}
+                if image_future is not None:
+                    try:
+                        if image_features is None:
+                            image_features = image_future.result()
+                            self._index_async(self._index_images, [(image_bytes, image_features)],
+                                              {'source': 'analyze', 'prompt': prompt})
+                        self.merge_features(features, self._score_image(image_features, {category: terms}))
+                    except Exception as e:
+                        logger.warning(f"CLIP analysis failed, continuing with GPT results: {e}")
+                        image_future = None
+                combined_features.update(features)
+                return {'category': category, 'terms': features[category]}
+
+            engine = requested
+            if requested == 'gpt':
+                try:
+                    for category, terms in self.stream_prompt_analysis(prompt):
+                        yield 'category', scored(category, terms)
+                except Exception as e:
+                    # 已经推送过类别时不能再换成另一套结果
+                    if combined_features or not ANALYSIS_LOCAL_FALLBACK:
+                        raise
+                    logger.warning(f"GPT analysis failed ({e}), falling back to the local analyzer")
+                if not combined_features and ANALYSIS_LOCAL_FALLBACK:
+                    engine = 'local'
+            if engine == 'local':
+                for category, terms in self.analyze_prompt_locally(prompt).items():
+                    yield 'category', scored(category, terms)
+
+            if not combined_features:
+                raise ValueError(self.analysis_failure(engine))
+            self.index_prompts([prompt], 'analyze')
+
+            result = self.analysis_result(combined_features, engine, requested)
+            yield ('done' if result['success'] else 'error'), result
+
+        except Exception as e:
+            logger.error(f"Streaming feature analysis failed: {str(e)}", exc_info=True)
+            yield 'error', {'success': False, 'error': str(e)}
+
+    def analyze_prompt(self, prompt: str, engine: Optional[str] = None) -> Tuple[Dict, str]:
+        """用所选引擎分析文本提示，返回 (特征, 实际使用的引擎)；GPT 没有结果时可改用本地分析"""
+        engine = engine or ANALYSIS_ENGINE
+        if engine not in ANALYSIS_ENGINES:
+            raise ValueError(f"Unknown analysis engine: {engine}")
+        if engine == 'local':
+            return self.analyze_prompt_locally(prompt), 'local'
+
+        prompt_features = self.analyze_prompt_with_gpt(prompt)
+        if not prompt_features and ANALYSIS_LOCAL_FALLBACK:
+            logger.warning("GPT analysis returned no features, falling back to the local analyzer")
+            local_features = self.analyze_prompt_locally(prompt)
+            if local_features:
+                return local_features, 'local'
+        return prompt_features, 'gpt'
+
+    def analyze_prompt_locally(self, prompt: str) -> Dict:
+        """不调用 GPT：用提示的 CLIP 文本向量对内置描述词表打分"""
+        if not self.clip_model:
+            logger.warning("CLIP model not available, local analysis skipped")
+            return {}
+
+        try:
+            with timed('local_analysis'):
+                if not self.local_analyzer.ready:
+                    self.local_analyzer.prepare(self._encode_texts)
+                embedding = self._get_prompt_features([prompt])[0]
+                return self.local_analyzer.analyze(prompt, embedding)
+        except Exception as e:
+            logger.error(f"Local analysis failed: {str(e)}", exc_info=True)
+            return {}
+
+    @staticmethod
+    def analysis_failure(engine: str) -> str:
+        """引擎没有给出任何特征时的错误信息"""
+        return "Failed to get valid features from " + ("GPT analysis" if engine == 'gpt' else "local analysis")
+
+    @staticmethod
+    def merge_features(combined: Dict[str, Dict[str, float]], clip_features: Dict[str, Dict[str, float]]):
+        """把 CLIP 得分并入 GPT 的分析结果"""
+        for category, features in clip_features.items():
+            if category in combined:
+                combined[category].update(features)
+            else:
+                combined[category] = features
+
+    @staticmethod
+    def analysis_result(combined_features: Dict[str, Dict[str, float]], engine: Optional[str] = None,
+                         requested: Optional[str] = None) -> Dict[str, Any]:
+        """/api/analyze 单条结果的统一格式；engine 与请求的不同时说明是降级结果"""
+        if not combined_features:
+            logger.warning("No features found in analysis")
+            return {'success': False, 'error': 'No features found'}
+
+        result = {
+            'success': True,
+            'analysis': combined_features,
+            'active_categories': [cat for cat, feat in combined_features.items() if feat]
+        }
+        if engine is not None:
+            result['engine'] = engine
+            if requested and requested != engine:
+                result['fallback_from'] = requested
+        return result
+
+    def analysis_request(self, prompt: str, stream: bool = False) -> Dict[str, Any]:
+        """构造特征分析的 GPT 请求参数"""
+        categories = '\n'.join(f"- {category} ({description})" for category, description in ANALYSIS_CATEGORIES.items())
+        if ANALYSIS_JSON_SCHEMA:
+            system_prompt = f"""
+Analyze the visual elements in the following prompt.
+
+For every category, list the terms that describe it, each with a confidence score between 0.0 and 1.0.
+Leave a category as an empty list when the prompt says nothing about it.
+
+Categories to analyze:
+{categories}
+
+Rules:
+1. Be specific and precise in terminology
+2. Focus on visual and artistic aspects
+"""
+        else:
+            system_prompt = f"""
 Analyze the visual elements in the following prompt.
 
 Output Format Requirements:
@@ -232,26 +617,18 @@ Output Format Requirements:
 4. Do NOT use lists or complex objects for scores
 
 Example of CORRECT format:
-{
-    "color": {
+{{
+    "color": {{
         "deep blue": 0.9,
         "golden": 0.7
-    },
-    "style": {
+    }},
+    "style": {{
         "impressionist": 0.8
-    }
-}
+    }}
+}}
 
 Categories to analyze:
-- color (Color palette and tones)
-- style (Artistic style and technique)
-- composition (Layout and arrangement)
-- lighting (Light and shadow effects)
-- mood (Emotional atmosphere)
-- object (Any subject or entity in the scene: cars, people, animals, etc.)
-- perspective (Viewpoint and depth)
-- detail (Level of detail and complexity)
-- texture (Surface qualities)
+{categories}
 
 Rules:
 1. Include ONLY categories where features are clearly present
@@ -261,87 +638,195 @@ Rules:
 5. Return valid JSON only
 """
 
-            completion = self.client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.3,
-                max_tokens=1000
-            )
+        request = dict(
+            model="gpt-4o-mini",
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": prompt}
+            ],
+            temperature=0.3,
+            max_tokens=1000
+        )
+        if ANALYSIS_JSON_SCHEMA:
+            request['response_format'] = ANALYSIS_RESPONSE_FORMAT
+        if stream:
+            request['stream'] = True
+            request['stream_options'] = {"include_usage": True}
+        return request
+
+    def analyze_prompt_with_gpt(self, prompt: str) -> Dict:
+        """使用 GPT 分析文本提示中的视觉特征
+
+        没有逐类别的消费者，所以发普通请求而不是流式请求：流式调用不做对冲，
+        截止时间也只覆盖到首个响应头；需要逐类别结果时用 stream_prompt_analysis。
+        """
+        try:
+            with timed('gpt_analysis'):
+                completion = self.client.chat.completions.create(**self.analysis_request(prompt))
 
             response_text = completion.choices[0].message.content.strip()
             logger.info(f"GPT raw response: {response_text}")
 
+            return self.parse_analysis_response(response_text)
 
+        except Exception as e:
+            logger.error(f"GPT analysis failed: {str(e)}", exc_info=True)
+            return {}
+
+    def stream_prompt_analysis(self, prompt: str) -> Iterator[Tuple[str, Dict[str, float]]]:
+        """流式分析文本提示：每个类别的 JSON 一闭合就产出 (类别, 词 -> 分数)，空类别不产出
+
+        流被截断（finish_reason 不是 stop，或连接中途断开）时，已产出的类别保留，只记录警告；
+        一个类别都还没产出时才抛出异常，调用方可以改用其他引擎。
+        """
+        started = time.perf_counter()
+        with timed('gpt_analysis'):
+            stream = self.client.chat.completions.create(**self.analysis_request(prompt, stream=True))
+
+        parser = JSONObjectStream()
+        finish_reason, error, produced = None, None, 0
+        try:
+            for chunk in stream:
+                if not chunk.choices:
+                    continue
+                choice = chunk.choices[0]
+                finish_reason = choice.finish_reason or finish_reason
+                for category, terms in parser.feed(choice.delta.content or ''):
+                    cleaned_terms = self._clean_terms(category, terms)
+                    if cleaned_terms:
+                        produced += 1
+                        yield category, cleaned_terms
+        except Exception as e:
+            if not produced:
+                raise
+            error = e
+        finally:
+            close = getattr(stream, 'close', None)
+            if close is not None:
+                close()
+
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage='gpt_analysis_stream')
+        try:
+            result = parser.close()
+        except ValueError as e:
+            error = error or e
+        if error is not None or finish_reason != 'stop':
+            detail = f": {error}" if error is not None else ''
+            logger.warning(f"GPT streamed analysis truncated (finish_reason={finish_reason}{detail}), "
+                           f"keeping {produced} categories")
+            return
+        summary = json.dumps(result)
+        logger.info(f"GPT streamed analysis: {summary}")
+
+    def parse_analysis_response(self, response_text: str) -> Dict:
+        """解析 GPT 返回的 JSON 并清洗；JSON Schema 模式下输出保证是合法 JSON，无需重试"""
+        if ANALYSIS_JSON_SCHEMA:
             try:
                 raw_result = json.loads(response_text)
             except json.JSONDecodeError as e:
                 logger.error(f"Failed to parse GPT response as JSON: {e}")
+                return {}
+        else:
+            raw_result = self._load_json_response(response_text)
+        if raw_result is None:
+            return {}
 
-                cleaned_text = response_text.strip()
-                if cleaned_text.startswith('```json'):
-                    cleaned_text = cleaned_text[7:]
-                if cleaned_text.endswith('```'):
-                    cleaned_text = cleaned_text[:-3]
-                cleaned_text = cleaned_text.strip()
+        return self._clean_analysis(raw_result)
 
-                try:
-                    raw_result = json.loads(cleaned_text)
-                except json.JSONDecodeError:
-                    logger.error(f"Failed to parse cleaned GPT response: {cleaned_text}")
-                    return {}
+    def parse_fused_response(self, response_text: str):
+        """解析合并模式的 {"prompt", "analysis"} 结果；分析无效时 analysis 为 None"""
+        raw_result = self._load_json_response(response_text)
+        if not isinstance(raw_result, dict):
+            raise ValueError("Fused response is not a JSON object")
 
+        prompt = raw_result.get('prompt')
+        if not isinstance(prompt, str) or not prompt.strip():
+            raise ValueError("Fused response has no prompt")
 
-            cleaned_result = {}
-            for category, terms in raw_result.items():
-                if not isinstance(terms, dict):
-                    logger.warning(f"Skipping category {category}: not a dict")
-                    continue
+        analysis = self._clean_analysis(raw_result.get('analysis'))
+        return prompt.strip(), analysis or None
 
-                cleaned_terms = {}
-                for term, score in terms.items():
-                    try:
+    def _load_json_response(self, response_text: str) -> Any:
+        """解析 JSON，失败时去掉 ```json 代码块标记再试一次"""
+        try:
+            return json.loads(response_text)
+        except json.JSONDecodeError as e:
+            logger.error(f"Failed to parse GPT response as JSON: {e}")
 
-                        if not isinstance(score, (int, float)):
-                            logger.warning(f"Skipping {term}: score is {type(score)}, not a number")
-                            continue
+            cleaned_text = response_text.strip()
+            if cleaned_text.startswith('```json'):
+                cleaned_text = cleaned_text[7:]
+            if cleaned_text.endswith('```'):
+                cleaned_text = cleaned_text[:-3]
+            cleaned_text = cleaned_text.strip()
 
+            try:
+                return json.loads(cleaned_text)
+            except json.JSONDecodeError:
+                logger.error(f"Failed to parse cleaned GPT response: {cleaned_text}")
+                return None
+
+    def _clean_analysis(self, raw_result: Any) -> Dict:
+        """只保留 类别 -> 词 -> [0, 1] 分数 的有效结构"""
+        if not isinstance(raw_result, dict):
+            logger.warning("Analysis result is not a JSON object")
+            return {}
 
-                        score_float = float(score)
+        cleaned_result = {}
+        for category, terms in raw_result.items():
+            cleaned_terms = self._clean_terms(category, terms)
+            if cleaned_terms:
+                cleaned_result[category] = cleaned_terms
 
 
-                        if not 0 <= score_float <= 1:
-                            logger.warning(f"Skipping {term}: score {score_float} out of range [0,1]")
-                            continue
+        logger.info(f"Cleaned analysis result: {json.dumps(cleaned_result, indent=2)}")
 
 
-                        cleaned_terms[str(term)] = score_float
+        if not cleaned_result:
+            logger.warning("No valid features found in the analysis")
+            return {}
 
-                    except (TypeError, ValueError) as e:
-                        logger.warning(f"Error processing score for {term}: {e}")
-                        continue
+        return cleaned_result
 
+    @staticmethod
+    def _clean_terms(category: str, terms: Any) -> Dict[str, float]:
+        """清洗单个类别：词 -> 分数 对象，或 JSON Schema 模式下的 [{"term", "score"}] 列表"""
+        if isinstance(terms, list):
+            if not terms:
+                return {}
+            terms = {item.get('term'): item.get('score') for item in terms
+                     if isinstance(item, dict) and isinstance(item.get('term'), str)}
+        if not isinstance(terms, dict):
+            logger.warning(f"Skipping category {category}: not a dict")
+            return {}
 
-                if cleaned_terms:
-                    cleaned_result[category] = cleaned_terms
-                else:
-                    logger.info(f"No valid terms found for category: {category}")
+        cleaned_terms = {}
+        for term, score in terms.items():
+            try:
 
+                if not isinstance(score, (int, float)):
+                    logger.warning(f"Skipping {term}: score is {type(score)}, not a number")
+                    continue
 
-            logger.info(f"Cleaned analysis result: {json.dumps(cleaned_result, indent=2)}")
 
+                score_float = float(score)
 
-            if not cleaned_result:
-                logger.warning("No valid features found in the analysis")
-                return {}
 
-            return cleaned_result
+                if not 0 <= score_float <= 1:
+                    logger.warning(f"Skipping {term}: score {score_float} out of range [0,1]")
+                    continue
+
+
+                cleaned_terms[str(term)] = score_float
+
+            except (TypeError, ValueError) as e:
+                logger.warning(f"Error processing score for {term}: {e}")
+                continue
 
-        except Exception as e:
-            logger.error(f"GPT analysis failed: {str(e)}", exc_info=True)
-            return {}
+
+        if not cleaned_terms:
+            logger.info(f"No valid terms found for category: {category}")
+        return cleaned_terms
 
     def generate_image(
         self,
@@ -349,21 +834,44 @@ Rules:
         model: str = "dall-e-2",
         size: str = "1024x1024",
         quality: str = "standard",
+        seed: Optional[int] = None,
     ) -> Dict[str, Any]:
-        """生成图像 - 支持 DALL-E 和本地 Stable Diffusion"""
+        """生成图像 - 支持 DALL-E 和本地 Stable Diffusion（seed 只对 Stable Diffusion 生效）"""
         try:
             logger.info(f"Generating image with model: {model}, prompt: {prompt}")
 
+            prompt_embedding = None
             if model in ["dall-e-2", "dall-e-3"]:
 
-                response = self.client.images.generate(
-                    model=model,
-                    prompt=prompt,
-                    size=size,
-                    quality=quality,
-                    n=1
-                )
+                # 指定了种子的请求要求确定的结果，不走语义缓存（DALL-E 本身不用种子）
+                if seed is None:
+                    cached, prompt_embedding = self._semantic_lookup(prompt, model, size, quality)
+                    if cached:
+                        return cached
+
+                try:
+                    with timed(f"generate_image:{model}"):
+                        response = self.client.images.generate(
+                            model=model,
+                            prompt=prompt,
+                            size=size,
+                            quality=quality,
+                            n=1
+                        )
+                except CircuitOpenError as e:
+                    # DALL-E 持续失败时熔断，改用本地 Stable Diffusion
+                    if not self.sd_available:
+                        raise
+                    logger.warning(f"{e}; falling back to Stable Diffusion")
+                    result = self.generate_image(prompt, "stable-diffusion", size, quality, seed)
+                    if result.get('success'):
+                        result['metadata']['fallback_from'] = model
+                    return result
                 image_url = response.data[0].url
+                seed = None
+
+                # 前端随后会通过 /api/proxy-image 读取这张图，提前下载好
+                self.image_proxy.prefetch(image_url)
 
             elif model == "stable-diffusion":
 
@@ -375,22 +883,27 @@ Rules:
                     logger.info(f"Adjusting size from {size} to 512x512 for Stable Diffusion")
                     size = "512x512"
 
-                image_url = self._generate_with_stable_diffusion_local(prompt, size)
+                # 指定了种子的请求要求确定的结果，不走语义缓存
+                if seed is None:
+                    cached, prompt_embedding = self._semantic_lookup(prompt, model, size, quality)
+                    if cached:
+                        return cached
+                    seed = int.from_bytes(os.urandom(4), 'little')
+
+                with timed(f"generate_image:{model}"):
+                    image_url = self._generate_with_stable_diffusion_local(prompt, size, seed)
 
             else:
                 raise ValueError(f"Unsupported model: {model}. Supported models: dall-e-2, dall-e-3, stable-diffusion")
 
-            return {
-                'success': True,
-                'url': image_url,
-                'prompt': prompt,
-                'metadata': {
-                    'model': model,
-                    'size': size,
-                    'quality': quality,
-                    'timestamp': datetime.now().isoformat()
-                }
-            }
+            if INDEX_GENERATED_IMAGES:
+                self._index_async(self._index_generated, image_url, prompt, model, size, seed)
+            result = self._image_result(image_url, prompt, model, size, quality, seed)
+            if prompt_embedding is not None:
+                self.semantic_cache.put(prompt_embedding, model, size, quality, image_url, prompt, seed)
+                result['metadata']['cache_hit'] = False
+                result['metadata']['semantic_cache'] = self._semantic_cache_info(hit=False)
+            return result
 
         except Exception as e:
             logger.error(f"Image generation failed: {str(e)}")
@@ -399,6 +912,65 @@ Rules:
                 'error': str(e)
             }
 
+    def _semantic_lookup(self, prompt: str, model: str, size: str,
+                         quality: str) -> Tuple[Optional[Dict[str, Any]], Optional[np.ndarray]]:
+        """语义缓存查询，返回 (命中时的生成结果, 提示的 CLIP 向量)
+
+        命中的图片是按另一个提示生成的：结果不带 seed（它不能复现当前提示），
+        改为标明 cache_hit 和 matched_prompt；该图片自己的种子放在 semantic_cache.matched_seed
+        """
+        if self.semantic_cache is None or not self.clip_model:
+            return None, None
+        try:
+            embedding = self._get_prompt_features([prompt])[0]
+        except Exception as e:
+            logger.warning(f"Semantic cache lookup skipped: {e}")
+            return None, None
+
+        match = self.semantic_cache.lookup(embedding, model, size, quality)
+        if match is None:
+            return None, embedding
+
+        entry, similarity = match
+        logger.info(f"Semantic cache hit ({similarity:.3f}) for prompt: {prompt}")
+        result = self._image_result(entry['url'], prompt, model, size, quality)
+        result['metadata']['cache_hit'] = True
+        result['metadata']['matched_prompt'] = entry['prompt']
+        match_info = {'similarity': round(similarity, 4), 'matched_prompt': entry['prompt']}
+        if entry['seed'] is not None:
+            match_info['matched_seed'] = entry['seed']
+        result['metadata']['semantic_cache'] = self._semantic_cache_info(hit=True, **match_info)
+        return result, embedding
+
+    def _semantic_cache_info(self, hit: bool, **match) -> Dict[str, Any]:
+        """响应 metadata 中的缓存命中信息和累计命中率"""
+        stats = self.semantic_cache.stats()
+        return {
+            'hit': hit,
+            **match,
+            'hits': stats['hits'],
+            'misses': stats['misses'],
+            'hit_rate': round(stats['hit_rate'], 4)
+        }
+
+    def _image_result(self, image_url: str, prompt: str, model: str, size: str, quality: str,
+                      seed: Optional[int] = None) -> Dict[str, Any]:
+        """统一的生成结果结构"""
+        result = {
+            'success': True,
+            'url': image_url,
+            'prompt': prompt,
+            'metadata': {
+                'model': model,
+                'size': size,
+                'quality': quality,
+                'timestamp': datetime.now().isoformat()
+            }
+        }
+        if seed is not None:
+            result['metadata']['seed'] = seed
+        return result
+
     def interpolate_features(self, features: Dict[str, Any], weights: Dict[str, float], model: str = "dall-e-3", size: str = "1024x1024", quality: str = "standard") -> Dict[str, Any]:
         """特征插值 - 支持所有模型"""
         try:
@@ -489,69 +1061,245 @@ Rules:
                 'error': str(e)
             }
 
-    def analyze_image_with_clip(self, image_data: bytes, existing_features: Dict[str, Dict[str, float]]) -> Dict:
+    @timed('clip_image_analysis')
+    def analyze_image_with_clip(self, image_data: bytes, existing_features: Dict[str, Dict[str, float]],
+                                prompt: Optional[str] = None) -> Dict:
         """使用 CLIP 分析图像特征"""
         if not self.clip_model:
             logger.warning("CLIP model not available")
             return {}
 
         try:
-            image = self._prepare_image(image_data)
-            image_features = self._get_image_features(image)
+            image_bytes = self._decode_image_bytes(image_data)
+            image = self._prepare_image(image_bytes)
+            image_features = self.clip_batcher.run(image)
+            self._index_async(self._index_images, [(image_bytes, image_features)], {'source': 'analyze', 'prompt': prompt})
+            return self._score_image(image_features, existing_features)
 
-            final_result = {}
+        except Exception as e:
+            logger.error(f"CLIP analysis failed: {str(e)}")
+            return {}
 
-            for category, terms in existing_features.items():
-                if not isinstance(terms, dict):
-                    continue
+    @timed('clip_image_encode')
+    def encode_images(self, images: List[bytes]) -> List[Optional["torch.Tensor"]]:
+        """批量计算图像特征；相同内容只算一次，无法解码的图像返回 None"""
+        if not images or not self.clip_model:
+            return [None] * len(images)
 
-                term_list = list(terms.keys())
-                if not term_list:
-                    continue
+        unique: Dict[bytes, Optional[Image.Image]] = {}
+        for image_data in images:
+            if image_data in unique:
+                continue
+            try:
+                unique[image_data] = self._prepare_image(image_data)
+            except Exception as e:
+                logger.warning(f"Skipping undecodable image: {e}")
+                unique[image_data] = None
 
+        # 全部交给 CLIP 批处理线程，由它按 CLIP_BATCH_MAX_SIZE 切分前向
+        futures = {data: self.clip_batcher.submit(image) for data, image in unique.items() if image is not None}
+        features: Dict[bytes, "torch.Tensor"] = {}
+        for data, future in futures.items():
+            try:
+                features[data] = future.result()
+            except Exception as e:
+                logger.error(f"CLIP image encoding failed: {str(e)}")
+
+        self._index_async(self._index_images, list(features.items()), {'source': 'analyze_batch'})
+        return [features.get(image_data) for image_data in images]
+
+    def find_similar(self, text: Optional[str] = None, image_data: Optional[bytes] = None,
+                     item_id: Optional[str] = None, k: int = 10, kind: Optional[str] = None) -> Dict[str, Any]:
+        """按文本、图像或已索引条目的 id 检索最相似的 k 条记录"""
+        if self.embedding_index is None:
+            return {'success': False, 'error': 'Embedding index is disabled', 'error_type': 'unavailable'}
+
+        if item_id is not None:
+            query = self.embedding_index.vector(item_id)
+            if query is None:
+                return {'success': False, 'error': f'Unknown id: {item_id}', 'error_type': 'not_found'}
+        else:
+            if not self.clip_model:
+                return {'success': False, 'error': 'CLIP model not available', 'error_type': 'unavailable'}
+            if text is not None:
+                query = self._get_prompt_features([text])[0]
+            else:
+                try:
+                    image = self._prepare_image(image_data)
+                except Exception:
+                    return {'success': False, 'error': 'Could not decode image', 'error_type': 'invalid_image'}
+                query = self.clip_batcher.run(image)[0].cpu().numpy()
 
-                text_prompts = [f"This image shows {t} {category}" for t in term_list]
-                text_inputs = self.clip_processor(
-                    text=text_prompts,
-                    return_tensors="pt",
-                    padding=True
-                ).to(self.device)
+        return {
+            'success': True,
+            'results': self.embedding_index.search(query, k=k, kind=kind, exclude=item_id),
+            'count': self.embedding_index.count
+        }
 
-                with torch.no_grad():
-                    text_features = self.clip_model.get_text_features(**text_inputs)
-                    text_features = text_features / text_features.norm(dim=-1, keepdim=True)
+    def _index_async(self, task, *args):
+        """在后台线程写入向量索引"""
+        if self.embedding_index is None:
+            return
 
+        def run():
+            try:
+                task(*args)
+            except Exception as e:
+                logger.warning(f"Embedding indexing failed: {e}")
+
+        self._index_executor.submit(run)
+
+    @staticmethod
+    def embedding_id(kind: str, data: bytes) -> str:
+        """索引条目 id；图像的摘要部分与 ImageStore 的 id 相同"""
+        return f"{kind}:{hashlib.sha256(data).hexdigest()[:32]}"
+
+    def _index_images(self, items: List[Tuple[bytes, "torch.Tensor"]], metadata: Dict[str, Any]):
+        ids, vectors = [], []
+        for image_bytes, features in items:
+            item_id = self.embedding_id('image', image_bytes)
+            if item_id not in self.embedding_index:
+                ids.append(item_id)
+                vectors.append(features[0].float().cpu().numpy())
+        if ids:
+            metadata = {key: value for key, value in metadata.items() if value is not None}
+            self.embedding_index.add_many(ids, np.stack(vectors), 'image', [metadata] * len(ids))
+
+    def index_prompts(self, prompts: List[str], source: str):
+        """在后台把提示的 CLIP 文本向量写入索引（已索引的跳过）"""
+        self._index_async(self._index_prompts, prompts, source)
+
+    def _index_prompts(self, prompts: List[str], source: str):
+        if not self.clip_model:
+            return
+        prompts = [p for p in dict.fromkeys(prompts)
+                   if self.embedding_id('prompt', p.encode('utf-8')) not in self.embedding_index]
+        if not prompts:
+            return
+        vectors = self._get_prompt_features(prompts)
+        self.embedding_index.add_many(
+            [self.embedding_id('prompt', p.encode('utf-8')) for p in prompts],
+            vectors,
+            'prompt',
+            [{'source': source, 'prompt': p} for p in prompts]
+        )
+
+    def _index_generated(self, image_url: str, prompt: str, model: str, size: str, seed: Optional[int]):
+        """读取生成结果（本地图片库、data URL 或经代理下载）并写入索引"""
+        if not self.clip_model:
+            return
+        if image_url.startswith('/api/images/') and self.image_store is not None:
+            stored = self.image_store.get(image_url.rsplit('/', 1)[-1])
+            if stored is None:
+                return
+            image_bytes = stored[0]
+        elif image_url.startswith('data:image'):
+            image_bytes = self._decode_image_bytes(image_url)
+        else:
+            image_bytes = self.image_proxy.fetch(image_url)[0]
+
+        features = self.clip_batcher.run(self._prepare_image(image_bytes))
+        self._index_images([(image_bytes, features)], {
+            'source': 'generate', 'prompt': prompt, 'model': model, 'size': size, 'seed': seed, 'url': image_url
+        })
+        self._index_prompts([prompt], 'generate')
+
+    @timed('clip_batch')
+    def _run_clip_image_batch(self, key, images: List[Image.Image]) -> List["torch.Tensor"]:
+        """CLIP 批处理线程的回调：一次前向编码整批图像，每张图返回 (1, D) 特征"""
+        features = self._get_image_features(images)
+        return [features[i:i + 1] for i in range(len(images))]
+
+    def score_images(self, pairs: List[Tuple["torch.Tensor", Dict]]) -> List[Dict]:
+        """对 (图像特征, 已有特征) 逐条打分；所有文本提示先合并成一次编码"""
+        text_prompts = list(dict.fromkeys(
+            prompt for _, features in pairs for prompt in self._clip_text_prompts(features)[2]
+        ))
+        if text_prompts:
+            self._get_text_features(text_prompts)
+
+        results = []
+        for image_features, existing_features in pairs:
+            try:
+                results.append(self._score_image(image_features, existing_features))
+            except Exception as e:
+                logger.error(f"CLIP analysis failed: {str(e)}")
+                results.append({})
+        return results
+
+    @staticmethod
+    def _clip_text_prompts(existing_features: Dict[str, Dict[str, float]]):
+        """(类别, 每个类别的词, 展开后的文本提示)"""
+        categories = []
+        term_lists = []
+        text_prompts = []
+        for category, terms in existing_features.items():
+            if not isinstance(terms, dict):
+                continue
+
+            term_list = list(terms.keys())
+            if not term_list:
+                continue
+
+            categories.append(category)
+            term_lists.append(term_list)
+            text_prompts.extend(f"This image shows {t} {category}" for t in term_list)
+        return categories, term_lists, text_prompts
+
+    def _score_image(self, image_features: "torch.Tensor", existing_features: Dict[str, Dict[str, float]]) -> Dict:
+        """按类别对已有特征词做 CLIP 打分"""
+        categories, term_lists, text_prompts = self._clip_text_prompts(existing_features)
+        if not text_prompts:
+            return {}
 
-                similarity = (100.0 * image_features @ text_features.T).softmax(dim=-1)
-                scores = similarity[0].cpu().numpy()
 
+        text_features = self._get_text_features(text_prompts)
+        logits = (100.0 * image_features @ text_features.T)[0].cpu().numpy()
+        scores = self._segment_softmax(logits, [len(t) for t in term_lists])
 
-                category_result = {}
-                for i, term in enumerate(term_list):
-                    score = float(scores[i])
-                    if score > 0.2:
-                        category_result[term] = score
 
-                if category_result:
-                    final_result[category] = category_result
+        final_result = {}
+        offset = 0
+        for category, term_list in zip(categories, term_lists):
+            category_result = {}
+            for i, term in enumerate(term_list):
+                score = float(scores[offset + i])
+                if score > 0.2:
+                    category_result[term] = score
+            offset += len(term_list)
 
-            return final_result
+            if category_result:
+                final_result[category] = category_result
 
-        except Exception as e:
-            logger.error(f"CLIP analysis failed: {str(e)}")
-            return {}
+        return final_result
 
+    @staticmethod
+    def _segment_softmax(logits: np.ndarray, lengths: List[int]) -> np.ndarray:
+        """对连续分段分别做 softmax（每个类别一段）"""
+        starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        segment_ids = np.repeat(np.arange(len(lengths)), lengths)
+
+        shifted = logits - np.maximum.reduceat(logits, starts)[segment_ids]
+        exp = np.exp(shifted)
+        return exp / np.add.reduceat(exp, starts)[segment_ids]
+
+    @staticmethod
+    def _decode_image_bytes(image_data) -> bytes:
+        """base64 字符串、data URL 或原始字节统一为字节"""
+        if isinstance(image_data, str) and image_data.startswith('data:image'):
+            return base64.b64decode(image_data.split(',')[1])
+        if isinstance(image_data, str):
+            return base64.b64decode(image_data)
+        return image_data
+
+    @timed('image_decode')
     def _prepare_image(self, image_data):
-        """准备图像数据"""
+        """解码图像；启用快速预处理时直接得到 CLIP 输入尺寸的 RGB 图"""
         try:
-            if isinstance(image_data, str) and image_data.startswith('data:image'):
-                image_data = image_data.split(',')[1]
-                image_bytes = base64.b64decode(image_data)
-            elif isinstance(image_data, str):
-                image_bytes = base64.b64decode(image_data)
-            else:
-                image_bytes = image_data
+            image_bytes = self._decode_image_bytes(image_data)
 
+            if self.clip_preprocessor is not None:
+                return self.clip_preprocessor.load(image_bytes)
             return Image.open(BytesIO(image_bytes)).convert('RGB')
 
         except Exception as e:
@@ -560,11 +1308,44 @@ Rules:
 
     def _get_image_features(self, image):
         """获取图像特征"""
-        inputs = self.clip_processor(images=image, return_tensors="pt").to(self.device)
+        import torch
+
+        if self.clip_preprocessor is not None:
+            images = image if isinstance(image, list) else [image]
+            inputs = {'pixel_values': self.clip_preprocessor.to_tensor(images).to(self.device)}
+        else:
+            inputs = self.clip_processor(images=image, return_tensors="pt").to(self.device)
         with torch.no_grad():
             features = self.clip_model.get_image_features(**inputs)
             return features / features.norm(dim=-1, keepdim=True)
 
+    def _get_text_features(self, text_prompts: List[str]) -> "torch.Tensor":
+        """获取文本特征（经缓存，只编码未见过的提示）"""
+        import torch
+
+        cached = self.text_embedding_cache.get_or_encode(text_prompts, self._encode_texts)
+        return torch.from_numpy(cached).to(self.device)
+
+    def _get_prompt_features(self, prompts: List[str]) -> np.ndarray:
+        """用户提示的文本向量（numpy）；走不落盘的小缓存，不占用描述词缓存"""
+        return self.prompt_embedding_cache.get_or_encode(prompts, self._encode_texts)
+
+    def _encode_texts(self, text_prompts: List[str]) -> np.ndarray:
+        """CLIP 文本编码器前向计算"""
+        import torch
+
+        text_inputs = self.clip_processor(
+            text=text_prompts,
+            return_tensors="pt",
+            padding=True,
+            truncation=True
+        ).to(self.device)
+
+        with torch.no_grad():
+            text_features = self.clip_model.get_text_features(**text_inputs)
+            text_features = text_features / text_features.norm(dim=-1, keepdim=True)
+        return text_features.cpu().numpy()
+
     def get_feature_types(self) -> Dict[str, Dict[str, Any]]:
         """获取特征类型定义"""
         return {
@@ -582,21 +1363,6 @@ Rules:
             models.append("stable-diffusion")
         return models
 
-    def _get_from_cache(self, key: str) -> Optional[Dict]:
-        """从缓存获取数据"""
-        if hasattr(self, '_cache') and key in self._cache:
-            result, timestamp = self._cache[key]
-            if datetime.now().timestamp() - timestamp < 300:
-                return result
-            del self._cache[key]
-        return None
-
-    def _add_to_cache(self, key: str, value: Dict):
-        """添加到缓存"""
-        if not hasattr(self, '_cache'):
-            self._cache = {}
-        self._cache[key] = (value, datetime.now().timestamp())
-
     def _handle_error(self, error: Exception, context: str) -> Dict[str, Any]:
         """错误处理"""
         error_message = str(error)
@@ -1,16 +1,31 @@
-from flask import Flask, request, jsonify, render_template, make_response
+from flask import Flask, Request, request, jsonify, render_template, make_response, Response, g
 from flask_cors import CORS
-from openai import OpenAI
 import os
 from dotenv import load_dotenv
-from ai_service import AIService
+from ai_service import AIService, ANALYSIS_ENGINES
+from llm_cache import CachedOpenAI, CachedAsyncOpenAI, LazyOpenAI
+from async_pipeline import AsyncPipeline
+from image_store import IMAGE_FORMATS, DEFAULT_QUALITY
+from image_proxy import ProxyError
+from metrics import metrics, timed, register_cache_stats, HTTP_REQUEST_SECONDS
+from resilience import ResilientOpenAI, AsyncResilientOpenAI
+from prompts import (
+    summarize_interpolation_features,
+    compose_interpolation_request,
+    refine_interpolation_request,
+    refine_generation_request,
+    fused_interpolation_request,
+    fused_generation_request
+)
 import logging
 from datetime import datetime
+from werkzeug.exceptions import RequestEntityTooLarge
 from werkzeug.middleware.proxy_fix import ProxyFix
-from typing import Dict, Any, Optional
-import requests
+from typing import Dict, Any, Optional, Tuple
 import base64
 import json
+import queue
+import time
 
 logging.basicConfig(
     level=logging.INFO,
@@ -20,12 +35,30 @@ logger = logging.getLogger(__name__)
 
 load_dotenv()
 
+# 上传接口的请求体上限（MB）；werkzeug 在读取请求体时按此截断并返回 413
+ANALYZE_MAX_UPLOAD = int(float(os.getenv('ANALYZE_MAX_UPLOAD_MB', '32')) * 1024 * 1024)
+UPLOAD_LIMITS = {
+    'analyze': ANALYZE_MAX_UPLOAD,
+    'analyze_stream': ANALYZE_MAX_UPLOAD,
+}
+
+
+class UploadLimitedRequest(Request):
+    """Request whose body limit depends on the matched endpoint."""
+
+    @property
+    def max_content_length(self):
+        limit = UPLOAD_LIMITS.get(self.endpoint)
+        return limit if limit is not None else super().max_content_length
+
+
 app = Flask(__name__,
     template_folder='templates',
     static_folder='../frontend',
     static_url_path='/frontend'
 )
 
+app.request_class = UploadLimitedRequest
 app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1)
 CORS(app)
 
@@ -33,9 +66,103 @@ api_key = os.getenv('OPENAI_API_KEY')
 if not api_key:
     raise ValueError("No OpenAI API key found. Please set OPENAI_API_KEY environment variable.")
 
-client = OpenAI(api_key=api_key)
+# 超时、带抖动的重试、对冲请求和熔断由 ResilientOpenAI 负责，SDK 自身不再重试；
+# 每个模型的 RPM/TPM 额度由其中的 RateLimitScheduler 排队分配，交互请求优先于批量任务
+resilient_client = ResilientOpenAI(LazyOpenAI(api_key=api_key, max_retries=0))
+client = CachedOpenAI(resilient_client)
 ai_service = AIService(client)
 
+# asyncio 执行路径：GPT 调用走 AsyncOpenAI，最终分析与图像生成并行。
+# 流式接口始终使用它；ASYNC_PIPELINE=0 时普通接口回到串行流程
+async_client = CachedAsyncOpenAI(
+    AsyncResilientOpenAI(
+        LazyOpenAI(asynchronous=True, api_key=api_key, max_retries=0),
+        breakers=resilient_client.breakers,
+        latency=resilient_client.latency,
+        scheduler=resilient_client.scheduler
+    ),
+    cache=client.cache
+)
+async_pipeline = AsyncPipeline(
+    ai_service,
+    async_client,
+    max_workers=int(os.getenv('ASYNC_PIPELINE_WORKERS', '8'))
+)
+USE_ASYNC_PIPELINE = os.getenv('ASYNC_PIPELINE', '1') == '1'
+SSE_KEEPALIVE_SECONDS = 15
+
+# 合并模式：一次 GPT 调用同时得到最终 prompt 和特征分析（请求可用 "fused": false 关闭）
+FUSED_PROMPTS = os.getenv('FUSED_PROMPTS', '1') == '1'
+
+# /api/analyze/batch：单次最多条目数，以及同时进行的 GPT 调用数
+ANALYZE_BATCH_MAX_ITEMS = int(os.getenv('ANALYZE_BATCH_MAX_ITEMS', '256'))
+ANALYZE_BATCH_CONCURRENCY = int(os.getenv('ANALYZE_BATCH_CONCURRENCY', '8'))
+
+# /api/similar 单次最多返回条数
+SIMILAR_MAX_K = 100
+SIMILAR_KINDS = ('image', 'prompt')
+
+SEED_ERROR = 'seed must be an integer between 0 and 4294967295'
+
+
+def _valid_seed(seed) -> bool:
+    """可选的 seed：不传，或 32 位无符号整数"""
+    if seed is None:
+        return True
+    return isinstance(seed, int) and not isinstance(seed, bool) and 0 <= seed < 2**32
+
+# 模型在后台预热，/api/health 和静态页面无需等待
+if os.getenv('WARMUP_ON_START', '1') == '1':
+    ai_service.start_warmup(preload_sd=os.getenv('SD_PRELOAD', '0') == '1')
+
+# /api/metrics 中导出的缓存命中率
+_cache_stats = {
+    'llm': client.cache.stats,
+    'clip_text': ai_service.text_embedding_cache.stats,
+    'clip_prompt': ai_service.prompt_embedding_cache.stats,
+}
+if ai_service.semantic_cache:
+    _cache_stats['semantic_image'] = ai_service.semantic_cache.stats
+if ai_service.sd_result_cache:
+    _cache_stats['sd_result'] = ai_service.sd_result_cache.stats
+if ai_service.image_store:
+    _cache_stats['image_store'] = ai_service.image_store.store.stats
+if ai_service.image_proxy.store:
+    _cache_stats['image_proxy'] = ai_service.image_proxy.store.stats
+register_cache_stats(_cache_stats)
+metrics.callback(
+    'openai_circuit_state', 'OpenAI circuit breaker state per API (0 closed, 1 half-open, 2 open)', 'gauge',
+    ['api'],
+    lambda: [((api,), ('closed', 'half_open', 'open').index(breaker.state))
+             for api, breaker in resilient_client.breakers.items()]
+)
+metrics.callback(
+    'openai_scheduler_queue_depth', 'OpenAI calls waiting for rate-limit budget', 'gauge',
+    ['model', 'priority'],
+    lambda: list(resilient_client.scheduler.queue_depths().items())
+)
+metrics.callback(
+    'sd_batch_items_total', 'Images generated through the Stable Diffusion batcher', 'counter', [],
+    lambda: [((), ai_service.sd_batcher.stats()['items'])]
+)
+metrics.callback(
+    'sd_batches_total', 'Stable Diffusion pipeline calls made by the batcher', 'counter', [],
+    lambda: [((), ai_service.sd_batcher.stats()['batches'])]
+)
+metrics.callback(
+    'clip_batch_items_total', 'Images encoded through the CLIP batcher', 'counter', [],
+    lambda: [((), ai_service.clip_batcher.stats()['items'])]
+)
+metrics.callback(
+    'clip_batches_total', 'CLIP image forward passes made by the batcher', 'counter', [],
+    lambda: [((), ai_service.clip_batcher.stats()['batches'])]
+)
+if ai_service.embedding_index:
+    metrics.callback(
+        'embedding_index_vectors', 'Vectors in the similarity index by kind', 'gauge', ['kind'],
+        lambda: [((kind,), count) for kind, count in ai_service.embedding_index.stats()['kinds'].items()]
+    )
+
 @app.errorhandler(400)
 def bad_request(error):
     return jsonify({
@@ -52,6 +179,14 @@ def not_found(error):
         'message': 'The requested resource was not found'
     }), 404
 
+@app.errorhandler(413)
+def request_entity_too_large(error):
+    return jsonify({
+        'success': False,
+        'error': 'Request body too large',
+        'message': f"Uploads are limited to {UPLOAD_LIMITS.get(request.endpoint, 0) // (1024 * 1024)} MB"
+    }), 413
+
 @app.errorhandler(500)
 def internal_server_error(error):
     logger.error(f"Internal Server Error: {str(error)}")
@@ -67,53 +202,27 @@ def index():
 
 @app.route('/api/analyze', methods=['POST'])
 def analyze():
+    """Accepts JSON ({"prompt", "image_data": base64}), multipart/form-data
+    (``prompt`` field, ``image`` file) or a raw image body with
+    ``?prompt=``. Bodies over ANALYZE_MAX_UPLOAD_MB are rejected with 413.
+    An ``engine`` field or query parameter picks 'gpt' or 'local' analysis."""
     try:
-
-        data = request.get_json()
-        if not data:
-            logger.warning("No data provided in request")
+        prompt, image_bytes, engine, error = _analyze_input()
+        if error:
             return jsonify({
                 'success': False,
-                'error': 'No data provided'
-            }), 400
-
-
-        prompt = data.get('prompt')
-        if not prompt:
-            logger.warning("No prompt provided in request")
-            return jsonify({
-                'success': False,
-                'error': 'No prompt provided'
+                'error': error
             }), 400
 
 
         logger.info(f"Analyzing prompt: {prompt}")
 
 
-        image_data = data.get('image_data')
-        image_bytes = None
-
-
-        if image_data:
-            try:
-                if isinstance(image_data, str):
-                    if image_data.startswith('data:image'):
-                        image_data = image_data.split(',')[1]
-                    image_bytes = base64.b64decode(image_data)
-                else:
-                    raise ValueError("Invalid image data format")
-            except Exception as e:
-                logger.warning(f"Failed to process image data: {e}")
-                return jsonify({
-                    'success': False,
-                    'error': 'Invalid image data format'
-                }), 400
-
-
         logger.info(f"Calling AI service for analysis")
         result = ai_service.analyze_features(
             prompt=prompt,
-            image_data=image_bytes
+            image_data=image_bytes,
+            engine=engine
         )
 
         logger.info(f"Analysis result: {json.dumps(result, indent=2)}")
@@ -127,12 +236,17 @@ def analyze():
         response = {
             'success': True,
             'analysis': result.get('analysis', {}),
+            'engine': result.get('engine'),
             'message': 'Analysis completed successfully'
         }
+        if 'fallback_from' in result:
+            response['fallback_from'] = result['fallback_from']
 
         logger.info(f"Sending response: {json.dumps(response, indent=2)}")
         return jsonify(response)
 
+    except RequestEntityTooLarge:
+        raise
     except Exception as e:
         logger.error(f"Analysis failed: {str(e)}", exc_info=True)
         return jsonify({
@@ -142,6 +256,156 @@ def analyze():
 
 
 
+@app.route('/api/analyze/stream', methods=['POST'])
+def analyze_stream():
+    """Streaming /api/analyze with the same inputs: a category event for each
+    feature category as soon as the model has written it (already CLIP-scored
+    when an image is attached), then done with the full analysis."""
+    prompt, image_bytes, engine, error = _analyze_input()
+    if error:
+        return jsonify({'success': False, 'error': error}), 400
+
+    logger.info(f"Streaming analysis for prompt: {prompt}")
+
+    def generate():
+        for event, payload in ai_service.analyze_features_stream(prompt, image_bytes, engine):
+            yield _sse(event, payload)
+
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+
+def _analyze_input() -> Tuple[Optional[str], Optional[bytes], Optional[str], Optional[str]]:
+    """从 JSON、multipart 或原始图像请求体中取出 (prompt, 图像字节, 分析引擎, 错误信息)"""
+    mimetype = request.mimetype
+    engine = request.args.get('engine')
+    if mimetype == 'multipart/form-data':
+        # werkzeug streams file parts to a temporary file instead of memory
+        prompt = request.form.get('prompt')
+        engine = request.form.get('engine', engine)
+        upload = request.files.get('image')
+        image_bytes = upload.read() if upload else None
+    elif mimetype.startswith('image/') or mimetype == 'application/octet-stream':
+        prompt = request.args.get('prompt')
+        image_bytes = _read_body(request.stream) or None
+    else:
+        data = request.get_json(silent=True)
+        if not data:
+            logger.warning("No data provided in request")
+            return None, None, None, 'No data provided'
+
+        prompt = data.get('prompt')
+        engine = data.get('engine', engine)
+        image_data = data.get('image_data')
+        image_bytes = None
+        if image_data:
+            try:
+                image_bytes = _decode_image_data(image_data)
+            except Exception as e:
+                logger.warning(f"Failed to process image data: {e}")
+                return None, None, None, 'Invalid image data format'
+
+    if not prompt:
+        logger.warning("No prompt provided in request")
+        return None, None, None, 'No prompt provided'
+    if engine is not None and engine not in ANALYSIS_ENGINES:
+        return None, None, None, f"Unknown analysis engine: {engine}"
+    return prompt, image_bytes, engine, None
+
+
+def _read_body(stream, chunk_size: int = 64 * 1024) -> bytes:
+    """分块读取请求体。chunked 请求在达到上限时 werkzeug 只会截断，
+    继续读取才会抛出 413，所以要一直读到流结束"""
+    chunks = []
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            return b''.join(chunks)
+        chunks.append(chunk)
+
+
+def _decode_image_data(image_data) -> bytes:
+    """base64 字符串或 data URL 转为图像字节"""
+    if not isinstance(image_data, str):
+        raise ValueError("Invalid image data format")
+    if image_data.startswith('data:image'):
+        image_data = image_data.split(',')[1]
+    return base64.b64decode(image_data)
+
+
+@app.route('/api/analyze/batch', methods=['POST'])
+def analyze_batch():
+    """Analyze many prompt/image pairs in one request; results come back per item, in order.
+    An optional ``engine`` ('gpt' or 'local') applies to every item."""
+    try:
+        data = request.get_json(silent=True)
+        items = data.get('items') if isinstance(data, dict) else None
+        if not isinstance(items, list) or not items:
+            return jsonify({
+                'success': False,
+                'error': 'No items provided'
+            }), 400
+        if len(items) > ANALYZE_BATCH_MAX_ITEMS:
+            return jsonify({
+                'success': False,
+                'error': f'At most {ANALYZE_BATCH_MAX_ITEMS} items per batch'
+            }), 400
+        engine = data.get('engine')
+        if engine is not None and engine not in ANALYSIS_ENGINES:
+            return jsonify({
+                'success': False,
+                'error': f"Unknown analysis engine: {engine}"
+            }), 400
+
+        # Malformed items fail on their own instead of rejecting the whole batch
+        results = [None] * len(items)
+        valid = []
+        for index, item in enumerate(items):
+            prompt = item.get('prompt') if isinstance(item, dict) else None
+            if not isinstance(prompt, str) or not prompt.strip():
+                results[index] = {'success': False, 'error': 'No prompt provided'}
+                continue
+            image_bytes = None
+            if item.get('image_data'):
+                try:
+                    image_bytes = _decode_image_data(item['image_data'])
+                except Exception:
+                    results[index] = {'success': False, 'error': 'Invalid image data format'}
+                    continue
+            valid.append((index, prompt.strip(), image_bytes))
+
+        logger.info(f"Analyzing batch of {len(items)} items ({len({p for _, p, _ in valid})} distinct prompts)")
+        if valid:
+            analyses = async_pipeline.run(async_pipeline.analyze_batch(
+                [(prompt, image_bytes) for _, prompt, image_bytes in valid],
+                concurrency=ANALYZE_BATCH_CONCURRENCY,
+                engine=engine
+            ))
+            for (index, _, _), result in zip(valid, analyses):
+                results[index] = result
+
+        succeeded = sum(1 for r in results if r.get('success'))
+        return jsonify({
+            'success': True,
+            'results': results,
+            'stats': {
+                'items': len(items),
+                'unique_prompts': len({prompt for _, prompt, _ in valid}),
+                'succeeded': succeeded,
+                'failed': len(items) - succeeded
+            }
+        })
+
+    except Exception as e:
+        logger.error(f"Batch analysis failed: {str(e)}", exc_info=True)
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+
 @app.route('/api/interpolate', methods=['POST'])
 def interpolate_features():
     try:
@@ -157,35 +421,39 @@ def interpolate_features():
         model = data.get('model', 'dall-e-3')
         size = data.get('size', '1024x1024')
         quality = data.get('quality', 'standard')
+        fused = bool(data.get('fused', FUSED_PROMPTS))
+        seed = data.get('seed')
+        if not _valid_seed(seed):
+            return jsonify({'success': False, 'error': SEED_ERROR}), 400
 
         logger.info(f"Interpolating features with model: {model}, size: {size}")
 
+        if USE_ASYNC_PIPELINE:
+            response_data, status = async_pipeline.run(
+                async_pipeline.interpolate(features, model, size, quality, fused=fused, seed=seed)
+            )
+            return jsonify(response_data), status
 
-        feature_summary = []
-        combined_features_str = ""
 
-        for feature_id, feature_data in features.items():
-            source_prompt = feature_data.get('sourcePrompt', '')
-            weight = feature_data.get('weight', 0.5)
-            feature_dict = feature_data.get('features', {})
-
-            if not feature_dict:
-                continue
-
-            feature_desc = ", ".join([f"{k} ({v:.0%})" for k, v in feature_dict.items()])
-            feature_summary.append(f"{feature_desc} (weight: {weight:.0%})")
-            combined_features_str += f"Feature {feature_id}: {feature_desc} with weight {weight:.0%}; "
+        feature_summary, combined_features_str = summarize_interpolation_features(features)
 
         logger.info(f"Feature summary: {feature_summary}")
 
 
-        base_prompt = _compose_interpolation_prompt(combined_features_str)
+        generated_prompt, analysis = None, None
+        if fused:
+            generated_prompt, analysis = _fused_prompt_and_analysis(
+                fused_interpolation_request(combined_features_str)
+            )
 
+        if not generated_prompt:
+            base_prompt = _compose_interpolation_prompt(combined_features_str)
 
-        refined_prompt = _refine_interpolation_prompt(base_prompt)
 
+            refined_prompt = _refine_interpolation_prompt(base_prompt)
 
-        generated_prompt = refined_prompt.strip()
+
+            generated_prompt = refined_prompt.strip()
         logger.info(f"Final interpolation prompt: {generated_prompt}")
 
 
@@ -193,7 +461,8 @@ def interpolate_features():
             prompt=generated_prompt,
             model=model,
             size=size,
-            quality=quality
+            quality=quality,
+            seed=seed
         )
 
         if not result.get('success'):
@@ -201,14 +470,15 @@ def interpolate_features():
             return jsonify(result), 500
 
 
-        analysis_result = ai_service.analyze_features(prompt=generated_prompt)
+        if analysis is None:
+            analysis = ai_service.analyze_features(prompt=generated_prompt).get('analysis', {})
 
 
         response_data = {
             'success': True,
             'url': result['url'],
             'prompt': generated_prompt,
-            'analysis': analysis_result.get('analysis', {}),
+            'analysis': analysis,
             'feature_summary': feature_summary,
             'metadata': {
                 'model': model,
@@ -216,6 +486,8 @@ def interpolate_features():
                 'quality': quality
             }
         }
+        if 'seed' in result['metadata']:
+            response_data['metadata']['seed'] = result['metadata']['seed']
         return jsonify(response_data)
 
     except Exception as e:
@@ -230,26 +502,8 @@ def _compose_interpolation_prompt(features_str: str) -> str:
     """
     第一步 GPT：把feature信息融合成一个初步、合理的图像描述Prompt
     """
-    system_prompt = f"""
-    You are an assistant that combines multiple visual features into a cohesive image prompt.
-
-    Features: {features_str}
-
-    Requirements:
-    1. Return a single concise sentence or short paragraph describing an image that blends all these features.
-    2. Avoid any phrases like "Generating...", "Sure, here it is", etc.
-    3. Only return the prompt itself (no JSON needed here).
-    """
-
-    completion = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": "Compose the image prompt from these features."}
-        ],
-        temperature=0.7,
-        max_tokens=200
-    )
+    with timed('gpt_compose'):
+        completion = client.chat.completions.create(**compose_interpolation_request(features_str))
 
     return completion.choices[0].message.content.strip()
 
@@ -259,24 +513,25 @@ def _refine_interpolation_prompt(base_prompt: str) -> str:
     第二步 GPT：对初步Prompt做一次语言润色/扩展，让它更吸引人或更详细
     但仍然避免输出无关多余话。
     """
-    system_prompt = f"""
-    Refine the following image prompt to be more descriptive, artistic, and vivid,
-    but still concise. Return only the refined prompt text, nothing else.
+    with timed('gpt_refine'):
+        completion = client.chat.completions.create(**refine_interpolation_request(base_prompt))
 
-    Original prompt: {base_prompt}
-    """
+    return completion.choices[0].message.content.strip()
 
-    completion = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": "Please refine the prompt with synonyms or added flair."}
-        ],
-        temperature=0.7,
-        max_tokens=200
-    )
 
-    return completion.choices[0].message.content.strip()
+def _fused_prompt_and_analysis(request_kwargs: Dict[str, Any]):
+    """
+    合并模式：一次 GPT 调用返回 (prompt, analysis)。
+    调用或解析失败时返回 (None, None)，由调用方回退到多次调用的流程；
+    analysis 无效时为 None，只需单独补一次分析。
+    """
+    try:
+        with timed('gpt_fused'):
+            completion = client.chat.completions.create(**request_kwargs)
+        return ai_service.parse_fused_response(completion.choices[0].message.content.strip())
+    except Exception as e:
+        logger.warning(f"Fused prompt call failed, falling back to multi-call path: {e}")
+        return None, None
 
 
 @app.route('/api/generate', methods=['POST'])
@@ -293,9 +548,23 @@ def generate_image():
         size = data.get('size', '512x512')
         quality = data.get('quality', 'standard')
         base_prompt = data['prompt']
+        fused = bool(data.get('fused', FUSED_PROMPTS))
+        seed = data.get('seed')
+        if not _valid_seed(seed):
+            return jsonify({'success': False, 'error': SEED_ERROR}), 400
 
+        if USE_ASYNC_PIPELINE:
+            result, status = async_pipeline.run(
+                async_pipeline.generate(base_prompt, model, size, quality, fused=fused, seed=seed)
+            )
+            return jsonify(result), status
 
-        final_prompt = _refine_generation_prompt(base_prompt)
+        final_prompt, analysis = None, None
+        if fused:
+            final_prompt, analysis = _fused_prompt_and_analysis(fused_generation_request(base_prompt))
+
+        if not final_prompt:
+            final_prompt = _refine_generation_prompt(base_prompt)
 
         logger.info(f"Generating image with prompt: {final_prompt}")
 
@@ -303,7 +572,8 @@ def generate_image():
             prompt=final_prompt,
             model=model,
             size=size,
-            quality=quality
+            quality=quality,
+            seed=seed
         )
 
         if not result.get('success'):
@@ -311,8 +581,9 @@ def generate_image():
             return jsonify(result), 500
 
 
-        analysis_result = ai_service.analyze_features(final_prompt)
-        result['analysis'] = analysis_result.get('analysis', {})
+        if analysis is None:
+            analysis = ai_service.analyze_features(final_prompt).get('analysis', {})
+        result['analysis'] = analysis
 
         return jsonify(result)
 
@@ -327,57 +598,229 @@ def _refine_generation_prompt(user_prompt: str) -> str:
     """
     使用GPT对用户传来的prompt做一次语言润色或更多“人性化”调整。
     """
-    system_prompt = f"""
-    Refine the user's prompt to be more descriptive and vivid for an image generation system.
-    Avoid extra text like 'Generating...' or disclaimers.
-    Return only the refined prompt text itself.
+    with timed('gpt_refine'):
+        completion = client.chat.completions.create(**refine_generation_request(user_prompt))
 
-    Original prompt: {user_prompt}
-    """
+    return completion.choices[0].message.content.strip()
 
-    completion = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": "Please refine the prompt with synonyms or added flair."}
-        ],
-        temperature=0.7,
-        max_tokens=200
-    )
 
-    return completion.choices[0].message.content.strip()
 
+def _sse(event: str, payload: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
 
 
-@app.route('/api/proxy-image', methods=['POST'])
-def proxy_image():
-    try:
-        data = request.get_json()
-        image_url = data.get('url')
+def _stream_stages(start_pipeline) -> Response:
+    """
+    把流水线每个阶段的结果作为 Server-Sent Events 推送给前端。
+    start_pipeline(on_event) 返回流水线协程；最后一个事件是 done 或 error。
+    """
+    events = queue.Queue()
+    future = async_pipeline.submit(start_pipeline(lambda event, payload: events.put((event, payload))))
 
-        if not image_url or not image_url.startswith(('http://', 'https://')):
-            return jsonify({'success': False, 'error': 'Invalid or missing URL.'}), 400
+    def finished(f):
+        try:
+            body, status = f.result()
+            events.put(('done' if status == 200 else 'error', body))
+        except Exception as e:
+            logger.error(f"Streaming pipeline failed: {str(e)}", exc_info=True)
+            events.put(('error', {'success': False, 'error': f"Server error: {str(e)}"}))
 
+    future.add_done_callback(finished)
+
+    def generate():
+        while True:
+            try:
+                event, payload = events.get(timeout=SSE_KEEPALIVE_SECONDS)
+            except queue.Empty:
+                yield ": keep-alive\n\n"
+                continue
+            yield _sse(event, payload)
+            if event in ('done', 'error'):
+                return
+
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
 
-        response = requests.get(image_url, timeout=10)
-        if response.status_code != 200 or 'image' not in response.headers.get('Content-Type', ''):
-            return jsonify({'success': False, 'error': 'Failed to fetch a valid image.'}), response.status_code
 
+@app.route('/api/interpolate/stream', methods=['POST'])
+def interpolate_features_stream():
+    """Streaming /api/interpolate: composed, refined, image, analysis, then done."""
+    data = request.get_json(silent=True)
+    if not data:
+        return jsonify({'success': False, 'error': 'No data provided'}), 400
+
+    features = data.get('features', {})
+    if len(features) < 2:
+        return jsonify({'success': False, 'error': 'At least 2 features required'}), 400
+
+    model = data.get('model', 'dall-e-3')
+    size = data.get('size', '1024x1024')
+    quality = data.get('quality', 'standard')
+    fused = bool(data.get('fused', FUSED_PROMPTS))
+    seed = data.get('seed')
+    if not _valid_seed(seed):
+        return jsonify({'success': False, 'error': SEED_ERROR}), 400
+
+    logger.info(f"Streaming interpolation with model: {model}, size: {size}")
+    return _stream_stages(
+        lambda on_event: async_pipeline.interpolate(features, model, size, quality, fused=fused,
+                                                    on_event=on_event, seed=seed)
+    )
 
-        import base64
-        image_base64 = base64.b64encode(response.content).decode('utf-8')
+
+@app.route('/api/generate/stream', methods=['POST'])
+def generate_image_stream():
+    """Streaming /api/generate: refined, image, analysis, then done."""
+    data = request.get_json(silent=True)
+    if not data or 'prompt' not in data:
         return jsonify({
-            'success': True,
-            'data': f'data:image/png;base64,{image_base64}'
-        })
+            'success': False,
+            'error': 'No prompt provided'
+        }), 400
+
+    model = data.get('model', 'dall-e-2')
+    size = data.get('size', '512x512')
+    quality = data.get('quality', 'standard')
+    fused = bool(data.get('fused', FUSED_PROMPTS))
+    seed = data.get('seed')
+    if not _valid_seed(seed):
+        return jsonify({'success': False, 'error': SEED_ERROR}), 400
+
+    return _stream_stages(
+        lambda on_event: async_pipeline.generate(data['prompt'], model, size, quality, fused=fused,
+                                                 on_event=on_event, seed=seed)
+    )
 
-    except requests.exceptions.RequestException as e:
+
+# Fixed download names for the raster types ImageProxy allows
+PROXY_FILENAMES = {
+    'image/png': 'image.png',
+    'image/jpeg': 'image.jpg',
+    'image/webp': 'image.webp',
+    'image/gif': 'image.gif',
+}
+
+
+@app.route('/api/proxy-image', methods=['GET', 'POST'])
+def proxy_image():
+    """Return a remote image's raw bytes with its real Content-Type (url in JSON body or ?url=)."""
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        image_url = data.get('url')
+    else:
+        image_url = request.args.get('url')
+
+    if not image_url or not image_url.startswith(('http://', 'https://')):
+        return jsonify({'success': False, 'error': 'Invalid or missing URL.'}), 400
+
+    try:
+        body, content_type = ai_service.image_proxy.fetch(image_url)
+    except ProxyError as e:
         logger.error(f"Image fetch error: {str(e)}")
-        return jsonify({'success': False, 'error': 'Failed to fetch image.'}), 500
+        return jsonify({'success': False, 'error': str(e)}), e.status_code
     except Exception as e:
         logger.error(f"Unexpected error: {str(e)}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+    response = Response(body, mimetype=content_type)
+    response.headers['Cache-Control'] = 'private, max-age=3600'
+    # Served from our origin: never sniffed into HTML/script, and sandboxed if opened directly
+    response.headers['X-Content-Type-Options'] = 'nosniff'
+    response.headers['Content-Security-Policy'] = 'sandbox'
+    response.headers['Content-Disposition'] = f"inline; filename=\"{PROXY_FILENAMES.get(content_type, 'image')}\""
+    return response
+
+
+@app.route('/api/images/<image_id>', methods=['GET'])
+def get_image(image_id):
+    """Serve a generated image; ?format=png|webp|jpeg and ?quality=1-100 pick the encoding."""
+    store = ai_service.image_store
+    if store is None or not store.is_valid_id(image_id):
+        return jsonify({'success': False, 'error': 'Image not found'}), 404
+
+    fmt = request.args.get('format', 'png').lower()
+    if fmt not in IMAGE_FORMATS:
+        return jsonify({'success': False, 'error': f"Unsupported format: {fmt}"}), 400
+
+    quality = request.args.get('quality', str(DEFAULT_QUALITY))
+    if not quality.isdigit() or not 1 <= int(quality) <= 100:
+        return jsonify({'success': False, 'error': 'quality must be an integer between 1 and 100'}), 400
+    quality = int(quality)
+
+    # An id's bytes never change, so the id, format and quality make a strong validator
+    etag = f"{image_id}-{fmt}-{quality}" if fmt != 'png' else image_id
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        image = store.get(image_id, fmt, quality)
+        if image is None:
+            return jsonify({'success': False, 'error': 'Image not found'}), 404
+        data, content_type = image
+        response = Response(data, mimetype=content_type)
+
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = store.cache_control
+    return response
+
+
+@app.route('/api/similar', methods=['POST'])
+def similar():
+    """Top-k nearest indexed images / prompts to a ``text``, ``image_data``
+    (base64) or the ``id`` of an indexed item, optionally filtered by ``kind``."""
+    try:
+        data = request.get_json(silent=True) or {}
+        text, image_data, item_id = data.get('text'), data.get('image_data'), data.get('id')
+        if sum(value is not None for value in (text, image_data, item_id)) != 1:
+            return jsonify({
+                'success': False,
+                'error': 'Provide exactly one of text, image_data or id'
+            }), 400
+
+        k = data.get('k', 10)
+        if not isinstance(k, int) or isinstance(k, bool) or not 1 <= k <= SIMILAR_MAX_K:
+            return jsonify({
+                'success': False,
+                'error': f'k must be an integer between 1 and {SIMILAR_MAX_K}'
+            }), 400
+        kind = data.get('kind')
+        if kind is not None and kind not in SIMILAR_KINDS:
+            return jsonify({
+                'success': False,
+                'error': f"kind must be one of {', '.join(SIMILAR_KINDS)}"
+            }), 400
+
+        image_bytes = None
+        if image_data is not None:
+            try:
+                image_bytes = _decode_image_data(image_data)
+            except Exception:
+                return jsonify({
+                    'success': False,
+                    'error': 'Invalid image data format'
+                }), 400
+        if text is not None and (not isinstance(text, str) or not text.strip()):
+            return jsonify({
+                'success': False,
+                'error': 'text must be a non-empty string'
+            }), 400
+
+        with timed('similar_search'):
+            result = ai_service.find_similar(text=text, image_data=image_bytes, item_id=item_id, k=k, kind=kind)
+        if not result.get('success'):
+            status = {'not_found': 404, 'invalid_image': 400}.get(result.get('error_type'), 503)
+            return jsonify(result), status
+        return jsonify(result)
+
+    except Exception as e:
+        logger.error(f"Similarity search failed: {str(e)}", exc_info=True)
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+
 @app.route('/api/features/available', methods=['GET'])
 def get_available_features():
     """Get list of available feature types and their descriptions"""
@@ -396,12 +839,36 @@ def get_available_features():
 
 @app.route('/api/health')
 def health_check():
-    """Health check endpoint"""
+    """Health check endpoint with per-component readiness.
+
+    ``?require=clip,openai`` returns 503 until the listed components are ready,
+    so a readiness probe can wait for exactly what its routes need. ``ready``
+    only covers the components warmed at startup; the others load on first
+    use (state ``on_demand`` until then) and never hold traffic back.
+    """
+    components = ai_service.get_component_status()
+    required = [name for name in request.args.get('require', '').split(',') if name]
+    unknown = [name for name in required if name not in components]
+    if unknown:
+        return jsonify({
+            'success': False,
+            'error': f"Unknown components: {', '.join(unknown)}"
+        }), 400
+
+    not_ready = [name for name in required if components[name] != 'ready']
     return jsonify({
-        'status': 'healthy',
+        'status': 'starting' if not_ready else 'healthy',
+        'ready': all(components[name] in ('ready', 'unavailable') for name in ai_service.warmup_components),
+        'components': components,
         'timestamp': datetime.now().isoformat(),
         'version': '2.0.0'
-    })
+    }), 503 if not_ready else 200
+
+
+@app.route('/api/metrics')
+def metrics_endpoint():
+    """Prometheus text exposition of stage latencies, token usage and cache hit rates."""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
 
 
 
@@ -424,6 +891,23 @@ def before_request():
         response.headers.add('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
         return response
 
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_latency(response):
+    # 流式响应只统计到开始发送的时间
+    started = g.get('request_started')
+    if started is not None:
+        HTTP_REQUEST_SECONDS.observe(
+            time.perf_counter() - started,
+            endpoint=request.url_rule.rule if request.url_rule else 'unmatched',
+            method=request.method,
+            status=response.status_code
+        )
+    return response
+
 if __name__ == '__main__':
     print("\n=== Server Information ===")
     print(f"Template folder: {app.template_folder}")
@@ -0,0 +1,244 @@
+import asyncio
+import functools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from ai_service import ANALYSIS_ENGINE, ANALYSIS_ENGINES, ANALYSIS_LOCAL_FALLBACK
+from metrics import timed
+from rate_limit import priority
+from prompts import (
+    summarize_interpolation_features,
+    compose_interpolation_request,
+    refine_interpolation_request,
+    refine_generation_request,
+    fused_interpolation_request,
+    fused_generation_request
+)
+
+logger = logging.getLogger(__name__)
+
+# Called with (event name, payload) as each stage completes
+StageCallback = Callable[[str, Dict[str, Any]], None]
+
+
+def _emit(on_event: Optional[StageCallback], event: str, payload: Dict[str, Any]):
+    if on_event is None:
+        return
+    try:
+        on_event(event, payload)
+    except Exception as e:
+        logger.warning(f"Stage callback for {event} failed: {e}")
+
+
+class AsyncPipeline:
+    """Runs the /api/generate and /api/interpolate chains on a shared event loop.
+
+    GPT calls go through an ``AsyncOpenAI`` client, so one loop thread
+    multiplexes the network waits of every in-flight request instead of
+    parking a thread per call. The final feature analysis only depends on
+    the prompt and runs concurrently with image generation.
+    ``AIService.generate_image`` stays the single implementation of every
+    image backend and runs on a small thread pool.
+    """
+
+    def __init__(self, ai_service, client, max_workers: int = 8):
+        self.ai_service = ai_service
+        self.client = client
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='pipeline')
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name='async-pipeline', daemon=True)
+        self._thread.start()
+
+    def submit(self, coro) -> Future:
+        """Schedule a coroutine on the pipeline loop from any thread."""
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def run(self, coro, timeout: Optional[float] = None) -> Any:
+        """Submit a coroutine from a WSGI thread and wait for its result."""
+        return self.submit(coro).result(timeout)
+
+    async def _chat(self, request: Dict[str, Any], stage: str) -> str:
+        with timed(stage):
+            completion = await self.client.chat.completions.create(**request)
+        return completion.choices[0].message.content.strip()
+
+    async def analyze_prompt(self, prompt: str) -> Dict:
+        try:
+            response_text = await self._chat(self.ai_service.analysis_request(prompt), 'gpt_analysis')
+            logger.info(f"GPT raw response: {response_text}")
+            return self.ai_service.parse_analysis_response(response_text)
+        except Exception as e:
+            logger.error(f"GPT analysis failed: {str(e)}", exc_info=True)
+            return {}
+
+    async def prompt_features(self, prompt: str, engine: Optional[str] = None) -> Tuple[Dict, str]:
+        """Async counterpart of ``AIService.analyze_prompt``: (features, engine used)."""
+        engine = engine or ANALYSIS_ENGINE
+        if engine not in ANALYSIS_ENGINES:
+            raise ValueError(f"Unknown analysis engine: {engine}")
+        if engine == 'gpt':
+            features = await self.analyze_prompt(prompt)
+            if features or not ANALYSIS_LOCAL_FALLBACK:
+                return features, 'gpt'
+            logger.warning("GPT analysis returned no features, falling back to the local analyzer")
+
+        loop = asyncio.get_running_loop()
+        features = await loop.run_in_executor(self._executor, self.ai_service.analyze_prompt_locally, prompt)
+        if not features and engine == 'gpt':
+            return {}, 'gpt'
+        return features, 'local'
+
+    async def analyze_batch(self, items: List[Tuple[str, Optional[bytes]]], concurrency: int = 8,
+                            engine: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Analyze many (prompt, image bytes or None) pairs; one result dict per item.
+
+        Each distinct prompt is sent to GPT once, with at most ``concurrency``
+        calls in flight, at 'bulk' priority so interactive requests are
+        served first when the rate limit is tight. Meanwhile all images go
+        through CLIP in batched forward passes, so only the per-item scoring
+        waits for GPT. ``engine='local'`` skips GPT entirely.
+        """
+        loop = asyncio.get_running_loop()
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+        requested = engine or ANALYSIS_ENGINE
+
+        async def analyze(prompt):
+            async with semaphore:
+                with priority('bulk'):
+                    return await self.prompt_features(prompt, requested)
+
+        images = [image for _, image in items if image is not None]
+        encoding = loop.run_in_executor(self._executor, self.ai_service.encode_images, images) if images else None
+
+        prompts = list(dict.fromkeys(prompt for prompt, _ in items))
+        results_by_prompt = dict(zip(prompts, await asyncio.gather(*(analyze(p) for p in prompts))))
+        analyses = {prompt: features for prompt, (features, _) in results_by_prompt.items()}
+        self.ai_service.index_prompts(prompts, 'analyze_batch')
+        image_features = iter(await encoding) if encoding is not None else iter(())
+
+        # CLIP scoring only for items that have both an analysis and an encoded image
+        pairs, pair_items = [], []
+        for index, (prompt, image) in enumerate(items):
+            features = next(image_features) if image is not None else None
+            if features is not None and analyses[prompt]:
+                pairs.append((features, analyses[prompt]))
+                pair_items.append(index)
+        clip_results = await loop.run_in_executor(self._executor, self.ai_service.score_images, pairs) if pairs else []
+        clip_by_item = dict(zip(pair_items, clip_results))
+
+        results = []
+        for index, (prompt, _) in enumerate(items):
+            features, used = results_by_prompt[prompt]
+            if not features:
+                results.append({'success': False, 'error': self.ai_service.analysis_failure(used)})
+                continue
+            # Items sharing a prompt must not share the nested dicts CLIP scores are merged into
+            combined = {category: dict(terms) for category, terms in features.items()}
+            self.ai_service.merge_features(combined, clip_by_item.get(index, {}))
+            results.append(self.ai_service.analysis_result(combined, used, requested))
+        return results
+
+    async def fused_prompt_and_analysis(self, request: Dict[str, Any]) -> Tuple[Optional[str], Optional[Dict]]:
+        """One GPT call for the final prompt and its analysis; (None, None) means fall back."""
+        try:
+            response_text = await self._chat(request, 'gpt_fused')
+            return self.ai_service.parse_fused_response(response_text)
+        except Exception as e:
+            logger.warning(f"Fused prompt call failed, falling back to multi-call path: {e}")
+            return None, None
+
+    async def _image_and_analysis(self, prompt: str, model: str, size: str, quality: str,
+                                  analysis: Optional[Dict],
+                                  on_event: Optional[StageCallback] = None,
+                                  seed: Optional[int] = None) -> Tuple[Dict[str, Any], Dict]:
+        async def image():
+            result = await self.generate_image(prompt, model, size, quality, seed)
+            if result.get('success'):
+                _emit(on_event, 'image', {'url': result['url'], 'metadata': result.get('metadata', {})})
+            return result
+
+        async def analyze():
+            features, engine = await self.prompt_features(prompt)
+            _emit(on_event, 'analysis', {'analysis': features, 'engine': engine})
+            return features
+
+        if analysis is not None:
+            _emit(on_event, 'analysis', {'analysis': analysis})
+            return await image(), analysis
+        return await asyncio.gather(image(), analyze())
+
+    async def generate_image(self, prompt: str, model: str, size: str, quality: str,
+                             seed: Optional[int] = None) -> Dict[str, Any]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor,
+            functools.partial(self.ai_service.generate_image, prompt=prompt, model=model, size=size,
+                              quality=quality, seed=seed)
+        )
+
+    async def generate(self, base_prompt: str, model: str, size: str, quality: str,
+                       fused: bool = False,
+                       on_event: Optional[StageCallback] = None,
+                       seed: Optional[int] = None) -> Tuple[Dict[str, Any], int]:
+        final_prompt, analysis = None, None
+        if fused:
+            final_prompt, analysis = await self.fused_prompt_and_analysis(fused_generation_request(base_prompt))
+        if not final_prompt:
+            final_prompt = await self._chat(refine_generation_request(base_prompt), 'gpt_refine')
+        logger.info(f"Generating image with prompt: {final_prompt}")
+        _emit(on_event, 'refined', {'prompt': final_prompt})
+
+        result, analysis = await self._image_and_analysis(final_prompt, model, size, quality, analysis, on_event, seed)
+
+        if not result.get('success'):
+            logger.error(f"Generation failed: {result.get('error')}")
+            return result, 500
+
+        result['analysis'] = analysis
+        return result, 200
+
+    async def interpolate(self, features: Dict[str, Any], model: str, size: str, quality: str,
+                          fused: bool = False,
+                          on_event: Optional[StageCallback] = None,
+                          seed: Optional[int] = None) -> Tuple[Dict[str, Any], int]:
+        feature_summary, combined_features_str = summarize_interpolation_features(features)
+        logger.info(f"Feature summary: {feature_summary}")
+
+        generated_prompt, analysis = None, None
+        if fused:
+            generated_prompt, analysis = await self.fused_prompt_and_analysis(
+                fused_interpolation_request(combined_features_str)
+            )
+        if not generated_prompt:
+            base_prompt = await self._chat(compose_interpolation_request(combined_features_str), 'gpt_compose')
+            _emit(on_event, 'composed', {'prompt': base_prompt})
+            generated_prompt = (await self._chat(refine_interpolation_request(base_prompt), 'gpt_refine')).strip()
+        logger.info(f"Final interpolation prompt: {generated_prompt}")
+        _emit(on_event, 'refined', {'prompt': generated_prompt, 'feature_summary': feature_summary})
+
+        result, analysis = await self._image_and_analysis(
+            generated_prompt, model, size, quality, analysis, on_event, seed
+        )
+
+        if not result.get('success'):
+            logger.error(f"Generation failed: {result.get('error')}")
+            return result, 500
+
+        response_data = {
+            'success': True,
+            'url': result['url'],
+            'prompt': generated_prompt,
+            'analysis': analysis,
+            'feature_summary': feature_summary,
+            'metadata': {
+                'model': model,
+                'size': size,
+                'quality': quality
+            }
+        }
+        if 'seed' in result['metadata']:
+            response_data['metadata']['seed'] = result['metadata']['seed']
+        return response_data, 200
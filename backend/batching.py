@@ -0,0 +1,110 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Hashable, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Called with (batch key, items) and returns one result per item, in order
+BatchHandler = Callable[[Hashable, List[Any]], Sequence[Any]]
+
+
+class MicroBatcher:
+    """Collects concurrent calls that share a key and runs them as one batch.
+
+    ``submit`` queues an item under its key. A single worker thread takes
+    the oldest key, waits until either ``max_batch_size`` items are queued
+    under it or the first of them has waited ``max_wait_ms``, then hands the
+    whole batch to ``handler``. Items with other keys keep their place in the
+    queue for the next round. Because one worker runs every batch, the
+    handler is never called concurrently; ``max_batch_size=1`` therefore
+    serializes calls without batching them.
+    """
+
+    def __init__(self, handler: BatchHandler, max_batch_size: int = 4,
+                 max_wait_ms: float = 50.0, name: str = 'batcher'):
+        self.handler = handler
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.name = name
+        self.batches = 0
+        self.items = 0
+        self._pending: "OrderedDict[Hashable, List[Tuple[Any, Future, float]]]" = OrderedDict()
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+    def submit(self, item: Any, key: Hashable = None) -> Future:
+        future: Future = Future()
+        with self._cond:
+            self._pending.setdefault(key, []).append((item, future, time.monotonic()))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._worker, name=self.name, daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return future
+
+    def run(self, item: Any, key: Hashable = None, timeout: Optional[float] = None) -> Any:
+        """Submit ``item`` and wait for its result."""
+        return self.submit(item, key).result(timeout)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'batches': self.batches,
+                'items': self.items,
+                'mean_batch_size': self.items / self.batches if self.batches else 0.0,
+                'queued': sum(len(v) for v in self._pending.values())
+            }
+
+    def _next_batch(self) -> Tuple[Hashable, List[Tuple[Any, Future, float]]]:
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+
+            key, queue = next(iter(self._pending.items()))
+            deadline = queue[0][2] + self.max_wait
+            while len(queue) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            batch = queue[:self.max_batch_size]
+            del queue[:self.max_batch_size]
+            if not queue:
+                del self._pending[key]
+            return key, batch
+
+    def _worker(self):
+        while True:
+            key, batch = self._next_batch()
+            self._run(key, batch)
+
+    def _run(self, key: Hashable, batch: List[Tuple[Any, Future, float]]):
+        live = [(item, future) for item, future, _ in batch if future.set_running_or_notify_cancel()]
+        if not live:
+            return
+        items = [item for item, _ in live]
+        futures = [future for _, future in live]
+
+        with self._cond:
+            self.batches += 1
+            self.items += len(items)
+
+        try:
+            results = list(self.handler(key, items))
+            if len(results) != len(items):
+                raise RuntimeError(f"{self.name} handler returned {len(results)} results for {len(items)} items")
+        except Exception as e:
+            logger.error(f"{self.name} batch of {len(items)} failed: {e}")
+            for future in futures:
+                future.set_exception(e)
+            return
+
+        for future, result in zip(futures, results):
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
@@ -0,0 +1,108 @@
+"""Throughput benchmark for the CLIP image-encoding batcher.
+
+Usage (from the backend directory):
+
+    python benchmarks/bench_clip_batching.py --concurrency 16 --per-client 8 --batch-sizes 1,4,16
+
+``--concurrency`` client threads each encode ``--per-client`` images. The
+first row, "direct", is the old behaviour: every caller runs its own
+batch-1 forward pass in its own thread, so the passes compete for cores.
+Every other row routes the same calls through ``AIService.clip_batcher``
+with that maximum batch size. Reported per configuration:
+  * images/s:  total images divided by wall time
+  * p50 / p95: per-image latency seen by a caller
+  * batch:     mean number of images per forward pass
+The model is loaded and warmed up once before any timing starts.
+"""
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image  # noqa: E402
+
+from ai_service import AIService  # noqa: E402
+from batching import MicroBatcher  # noqa: E402
+
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def _images(count: int, size: int):
+    # Distinct solid-colour images; decoding is not part of this benchmark
+    return [Image.new('RGB', (size, size), ((37 * i) % 256, (91 * i) % 256, (53 * i) % 256)) for i in range(count)]
+
+
+def run_config(service: AIService, batch_size, max_wait_ms: float, concurrency: int,
+               per_client: int, images) -> dict:
+    if batch_size is None:
+        encode = service._get_image_features
+    else:
+        service.clip_batcher = MicroBatcher(
+            service._run_clip_image_batch,
+            max_batch_size=batch_size,
+            max_wait_ms=max_wait_ms,
+            name=f'clip-batcher-{batch_size}'
+        )
+        encode = service.clip_batcher.run
+    latencies = []
+    lock = threading.Lock()
+
+    def client(index: int):
+        for n in range(per_client):
+            image = images[(index * per_client + n) % len(images)]
+            started = time.perf_counter()
+            encode(image)
+            with lock:
+                latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    return {
+        'config': 'direct' if batch_size is None else f'batch {batch_size}',
+        'images_per_s': len(latencies) / elapsed,
+        'p50': statistics.median(latencies),
+        'p95': _percentile(latencies, 95),
+        'mean_batch': 1.0 if batch_size is None else service.clip_batcher.stats()['mean_batch_size']
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--per-client', type=int, default=8)
+    parser.add_argument('--batch-sizes', default='1,4,16')
+    parser.add_argument('--max-wait-ms', type=float, default=10.0)
+    parser.add_argument('--image-size', type=int, default=512)
+    args = parser.parse_args()
+
+    service = AIService()
+    if service.clip_model is None:
+        parser.error("CLIP model could not be loaded")
+
+    images = _images(args.concurrency * args.per_client, args.image_size)
+    # Load weights and run one untimed pass so kernels and allocator are warm
+    service._get_image_features(images[:2])
+
+    print(f"{'config':>8} {'images/s':>9} {'p50 (s)':>8} {'p95 (s)':>8} {'mean batch':>10}")
+    configs = [None] + [int(b) for b in args.batch_sizes.split(',')]
+    for batch_size in configs:
+        r = run_config(service, batch_size, args.max_wait_ms, args.concurrency, args.per_client, images)
+        print(f"{r['config']:>8} {r['images_per_s']:>9.2f} {r['p50']:>8.3f} {r['p95']:>8.3f} {r['mean_batch']:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""CPU time, peak memory and accuracy of ClipPreprocessor against CLIPImageProcessor.
+
+Usage (from the backend directory):
+
+    python benchmarks/bench_clip_preprocess.py --repeat 5
+
+Both paths start from the encoded bytes of synthetic photo-like images
+(smooth gradients plus noise) and produce the normalized 224x224 batch the
+model consumes. Reported per image: median milliseconds, peak Python-heap
+allocation during one run, and the maximum / mean absolute difference of
+the output tensors plus their cosine similarity. tracemalloc sees NumPy
+buffers but not PIL's own image memory, so the full-resolution decode the
+processor path also pays is not included in its MB column.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+import torch  # noqa: E402
+from PIL import Image  # noqa: E402
+from transformers import CLIPImageProcessor  # noqa: E402
+
+from clip_preprocess import ClipPreprocessor  # noqa: E402
+
+CASES = [(4000, 3000, 'JPEG'), (3024, 4032, 'JPEG'), (1920, 1080, 'JPEG'), (1024, 1024, 'PNG'), (512, 512, 'JPEG')]
+
+
+def _photo(width: int, height: int, fmt: str) -> bytes:
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:height, 0:width]
+    pixels = np.stack([x * 255 / width, y * 255 / height, (x + y) * 127 / (width + height)], -1)
+    pixels += rng.normal(0, 8, pixels.shape)
+    buffer = BytesIO()
+    Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(buffer, fmt, quality=90)
+    return buffer.getvalue()
+
+
+def _measure(fn, repeat: int):
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - started)
+    tracemalloc.start()
+    out = fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return out, statistics.median(times), peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    processor = CLIPImageProcessor()
+    fast = ClipPreprocessor.from_processor(processor)
+
+    print(f"{'image':>16} {'processor ms':>12} {'fast ms':>8} {'processor MB':>12} {'fast MB':>8} "
+          f"{'max diff':>8} {'mean diff':>9} {'cosine':>8}")
+    for width, height, fmt in CASES:
+        data = _photo(width, height, fmt)
+        ref, ref_time, ref_peak = _measure(
+            lambda: processor(images=Image.open(BytesIO(data)).convert('RGB'), return_tensors='pt')['pixel_values'],
+            args.repeat
+        )
+        out, fast_time, fast_peak = _measure(lambda: fast.to_tensor([fast.load(data)]), args.repeat)
+        diff = (out - ref).abs()
+        cosine = torch.nn.functional.cosine_similarity(out.flatten(), ref.flatten(), dim=0)
+        print(f"{f'{width}x{height} {fmt}':>16} {ref_time * 1000:>12.1f} {fast_time * 1000:>8.1f} "
+              f"{ref_peak / 1e6:>12.1f} {fast_peak / 1e6:>8.1f} {diff.max():>8.4f} {diff.mean():>9.5f} {cosine:>8.5f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,242 @@
+"""End-to-end HTTP benchmark against a local fake OpenAI server.
+
+Usage (from the backend directory):
+
+    python benchmarks/bench_http.py --concurrency 1,4,16 --requests 64 --latency-ms 300
+    python benchmarks/bench_http.py --save baseline.json
+    python benchmarks/bench_http.py --compare baseline.json --max-regression 0.2
+
+Starts ``fake_openai.py`` and the Flask app as separate processes, the app
+pointed at the fake through ``OPENAI_BASE_URL``, then for every endpoint
+and concurrency level sends ``--requests`` requests from that many client
+threads. Reported per row: p50 / p95 / p99 latency, median time to the
+first line of the body (the first event of a streaming endpoint such as
+``/api/analyze/stream``), requests per second and non-2xx responses. The LLM response cache is off unless
+``--llm-cache`` is given, so every request pays the fake latency.
+
+With ``--compare`` the run exits with status 1 when any row's p95 or RPS
+is more than ``--max-regression`` worse than in the saved baseline.
+"""
+import argparse
+import json
+import math
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+
+APP_CHILD = """
+import app
+app.app.run(host='127.0.0.1', port={port}, use_reloader=False, threaded=True)
+"""
+
+PROMPTS = [
+    "a lighthouse on a cliff at dusk",
+    "a quiet forest lake in the morning fog",
+    "a neon city street in the rain",
+    "a bowl of lemons on a wooden table",
+]
+
+
+def _payload(endpoint: str, i: int) -> dict:
+    prompt = f"{PROMPTS[i % len(PROMPTS)]} #{i}"
+    if endpoint in ('/api/analyze', '/api/analyze/stream'):
+        return {'prompt': prompt}
+    if endpoint == '/api/generate':
+        return {'prompt': prompt, 'model': 'dall-e-2', 'size': '512x512'}
+    return {
+        'features': {
+            'a': {'weight': 0.6, 'features': {'crimson': 0.8, f'variant {i}': 0.5}},
+            'b': {'weight': 0.4, 'features': {'serene': 0.7}}
+        },
+        'model': 'dall-e-3',
+        'size': '1024x1024'
+    }
+
+
+ENDPOINTS = ('/api/analyze', '/api/generate', '/api/interpolate')
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _wait_for(url: str, timeout: float = 60.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=1):
+                return
+        except urllib.error.HTTPError:
+            return
+        except (urllib.error.URLError, ConnectionError, OSError):
+            time.sleep(0.05)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return float('nan')
+    # Nearest-rank percentile
+    index = min(len(ordered) - 1, max(0, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def _post(url: str, body: dict, timeout: float):
+    data = json.dumps(body).encode('utf-8')
+    req = urllib.request.Request(url, data=data, headers={'Content-Type': 'application/json'})
+    started = time.perf_counter()
+    first = None
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as response:
+            response.readline()
+            first = time.perf_counter() - started
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        e.read()
+        status = e.code
+    except (urllib.error.URLError, OSError):
+        status = 0
+    elapsed = time.perf_counter() - started
+    return elapsed, first if first is not None else elapsed, status
+
+
+def run_level(base: str, endpoint: str, concurrency: int, total: int, timeout: float) -> dict:
+    latencies, firsts, errors = [], [], 0
+    lock = threading.Lock()
+
+    def one(i):
+        nonlocal errors
+        elapsed, first, status = _post(f"{base}{endpoint}", _payload(endpoint, i), timeout)
+        with lock:
+            latencies.append(elapsed)
+            firsts.append(first)
+            if not 200 <= status < 300:
+                errors += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(total)))
+    wall = time.perf_counter() - started
+
+    return {
+        'endpoint': endpoint,
+        'concurrency': concurrency,
+        'requests': total,
+        'errors': errors,
+        'p50': _percentile(latencies, 50),
+        'p95': _percentile(latencies, 95),
+        'p99': _percentile(latencies, 99),
+        'first_p50': _percentile(firsts, 50),
+        'rps': total / wall
+    }
+
+
+def compare(rows, baseline_path: str, max_regression: float) -> bool:
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = {(r['endpoint'], r['concurrency']): r for r in json.load(f)['rows']}
+
+    ok = True
+    print(f"\nComparison with {baseline_path} (tolerance {max_regression:.0%}):")
+    for row in rows:
+        old = baseline.get((row['endpoint'], row['concurrency']))
+        if old is None:
+            continue
+        p95_change = row['p95'] / old['p95'] - 1 if old['p95'] else 0.0
+        rps_change = row['rps'] / old['rps'] - 1 if old['rps'] else 0.0
+        regressed = p95_change > max_regression or rps_change < -max_regression
+        ok = ok and not regressed
+        print(f"  {row['endpoint']:<20} c={row['concurrency']:<3} p95 {p95_change:+.1%}  rps {rps_change:+.1%}"
+              f"{'  REGRESSION' if regressed else ''}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--endpoints', default=','.join(ENDPOINTS))
+    parser.add_argument('--concurrency', default='1,4,16')
+    parser.add_argument('--requests', type=int, default=48, help="requests per endpoint and concurrency level")
+    parser.add_argument('--latency-ms', type=float, default=300.0)
+    parser.add_argument('--jitter-ms', type=float, default=50.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--error-status', type=int, default=500, choices=(429, 500, 503))
+    parser.add_argument('--stream-ms', type=float, default=0.0,
+                        help="time the fake takes to stream a response after --latency-ms")
+    parser.add_argument('--timeout', type=float, default=120.0)
+    parser.add_argument('--llm-cache', action='store_true', help="keep the LLM response cache enabled")
+    parser.add_argument('--app-env', action='append', default=[], metavar='KEY=VALUE',
+                        help="extra environment for the app process (repeatable)")
+    parser.add_argument('--save', help="write results to this JSON file")
+    parser.add_argument('--compare', help="baseline JSON written by --save")
+    parser.add_argument('--max-regression', type=float, default=0.2)
+    args = parser.parse_args()
+
+    fake_port, app_port = _free_port(), _free_port()
+    fake = subprocess.Popen(
+        [sys.executable, os.path.join(BENCH_DIR, 'fake_openai.py'), '--port', str(fake_port),
+         '--latency-ms', str(args.latency_ms), '--jitter-ms', str(args.jitter_ms),
+         '--error-rate', str(args.error_rate), '--error-status', str(args.error_status),
+         '--stream-ms', str(args.stream_ms)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+    env = dict(os.environ)
+    env.update({
+        'OPENAI_API_KEY': 'sk-benchmark',
+        'OPENAI_BASE_URL': f"http://127.0.0.1:{fake_port}/v1",
+        'WARMUP_ON_START': '0',
+        'LLM_CACHE_SIZE': env.get('LLM_CACHE_SIZE', '1024') if args.llm_cache else '0',
+    })
+    for item in args.app_env:
+        key, _, value = item.partition('=')
+        env[key] = value
+    app = subprocess.Popen(
+        [sys.executable, '-c', APP_CHILD.replace('{port}', str(app_port))],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+    base = f"http://127.0.0.1:{app_port}"
+    rows = []
+    try:
+        _wait_for(f"http://127.0.0.1:{fake_port}/stats")
+        _wait_for(f"{base}/api/health")
+
+        print(f"fake OpenAI latency {args.latency_ms:.0f}±{args.jitter_ms:.0f} ms, error rate {args.error_rate:.1%}")
+        print(f"{'endpoint':<20} {'conc':>4} {'reqs':>5} {'err':>4} {'p50 (s)':>8} {'p95 (s)':>8} "
+              f"{'p99 (s)':>8} {'first (s)':>9} {'rps':>7}")
+        for endpoint in args.endpoints.split(','):
+            for concurrency in (int(c) for c in args.concurrency.split(',')):
+                row = run_level(base, endpoint, concurrency, args.requests, args.timeout)
+                rows.append(row)
+                print(f"{endpoint:<20} {concurrency:>4} {row['requests']:>5} {row['errors']:>4} "
+                      f"{row['p50']:>8.3f} {row['p95']:>8.3f} {row['p99']:>8.3f} {row['first_p50']:>9.3f} "
+                      f"{row['rps']:>7.2f}", flush=True)
+    finally:
+        app.terminate()
+        fake.terminate()
+        app.wait(timeout=10)
+        fake.wait(timeout=10)
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump({'config': vars(args), 'rows': rows}, f, indent=2)
+        print(f"\nSaved results to {args.save}")
+
+    if args.compare and not compare(rows, args.compare, args.max_regression):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""Latency of the offline (CLIP-only) prompt analysis.
+
+Usage (from the backend directory):
+
+    python benchmarks/bench_local_analysis.py --prompts 200
+
+Loads CLIP the way the app does, times the one-off descriptor encoding
+(``prepare``), then analyzes ``--prompts`` distinct prompts so every
+call pays for its own CLIP text encoding (the text-embedding cache
+would otherwise answer repeats). Reported: median, p95 and max
+milliseconds per analysis, and one sample result.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ai_service import AIService  # noqa: E402
+
+SUBJECTS = ["a red fox", "an old lighthouse", "a neon city street", "a bowl of lemons", "a dragon"]
+SETTINGS = ["in the snow at golden hour", "on a cliff in a storm", "in the rain at night", "on a wooden table"]
+STYLES = ["oil painting", "watercolor", "cinematic photograph", "pixel art", "pencil sketch"]
+
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--prompts', type=int, default=200)
+    args = parser.parse_args()
+
+    service = AIService(client=object())
+    if service.clip_model is None:
+        sys.exit("CLIP model could not be loaded")
+
+    started = time.perf_counter()
+    service.local_analyzer.prepare(service._encode_texts)
+    descriptors = sum(len(terms) for terms in service.local_analyzer.vocabulary.values())
+    print(f"prepare: {time.perf_counter() - started:.2f} s for {descriptors} descriptors")
+
+    latencies, sample = [], None
+    for i in range(args.prompts):
+        prompt = (f"{SUBJECTS[i % len(SUBJECTS)]} {SETTINGS[i % len(SETTINGS)]}, "
+                  f"{STYLES[i % len(STYLES)]}, variation {i}")
+        started = time.perf_counter()
+        result = service.analyze_prompt_locally(prompt)
+        latencies.append((time.perf_counter() - started) * 1000)
+        sample = sample or (prompt, result)
+
+    print(f"analyze: p50 {statistics.median(latencies):.1f} ms, p95 {_percentile(latencies, 95):.1f} ms, "
+          f"max {max(latencies):.1f} ms over {len(latencies)} prompts on {service.device}")
+    print(f"sample: {sample[0]}\n{json.dumps(sample[1], indent=2)}")
+
+
+if __name__ == '__main__':
+    main()
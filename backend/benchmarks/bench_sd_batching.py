@@ -0,0 +1,93 @@
+"""Throughput benchmark for cross-request Stable Diffusion batching.
+
+Usage (from the backend directory):
+
+    SD_MODEL_ID=runwayml/stable-diffusion-v1-5 \\
+        python benchmarks/bench_sd_batching.py --concurrency 4 --batch-sizes 1,2,4
+
+For every batch size the same number of concurrent callers each generate
+``--per-client`` images through ``AIService._generate_with_stable_diffusion_local``;
+batch size 1 is the unbatched baseline. Reported per configuration:
+  * images/s:  total images divided by wall time
+  * p50 / p95: per-image latency seen by a caller
+  * batch:     mean number of images per pipeline call
+The pipeline is loaded and warmed up once before any timing starts.
+"""
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ai_service import AIService  # noqa: E402
+from batching import MicroBatcher  # noqa: E402
+
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def run_config(service: AIService, batch_size: int, max_wait_ms: float,
+               concurrency: int, per_client: int, size: str) -> dict:
+    service.sd_batcher = MicroBatcher(
+        service._run_stable_diffusion_batch,
+        max_batch_size=batch_size,
+        max_wait_ms=max_wait_ms,
+        name=f'sd-batcher-{batch_size}'
+    )
+    latencies = []
+    lock = threading.Lock()
+
+    def client(index: int):
+        for n in range(per_client):
+            started = time.perf_counter()
+            service._generate_with_stable_diffusion_local(f"benchmark prompt {index}-{n}", size)
+            with lock:
+                latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    return {
+        'batch_size': batch_size,
+        'images_per_s': len(latencies) / elapsed,
+        'p50': statistics.median(latencies),
+        'p95': _percentile(latencies, 95),
+        'mean_batch': service.sd_batcher.stats()['mean_batch_size']
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--per-client', type=int, default=2)
+    parser.add_argument('--batch-sizes', default='1,2,4')
+    parser.add_argument('--max-wait-ms', type=float, default=50.0)
+    parser.add_argument('--size', default='512x512')
+    args = parser.parse_args()
+
+    service = AIService()
+    if not service.sd_available:
+        parser.error("diffusers is not installed")
+
+    # Load weights and run one untimed image so kernels and caches are warm
+    service._generate_with_stable_diffusion_local("warm-up", args.size)
+
+    print(f"{'batch':>5} {'images/s':>9} {'p50 (s)':>8} {'p95 (s)':>8} {'mean batch':>10}")
+    for batch_size in (int(b) for b in args.batch_sizes.split(',')):
+        r = run_config(service, batch_size, args.max_wait_ms, args.concurrency, args.per_client, args.size)
+        print(f"{r['batch_size']:>5} {r['images_per_s']:>9.3f} {r['p50']:>8.2f} {r['p95']:>8.2f} {r['mean_batch']:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""Seconds-per-image benchmark for the CPU Stable Diffusion runtime profile.
+
+Usage (from the backend directory, on a machine without CUDA):
+
+    python benchmarks/bench_sd_cpu.py --images 3 --size 512x512
+
+Thread pools and torch.compile are process-wide, so every configuration
+runs in a fresh interpreter. The configurations add one option at a time
+on top of the baseline so each step's effect can be read off directly:
+
+    baseline        torch defaults, implicit torch.autocast("cpu")
+    +threads        intra-op threads = available CPUs, 1 inter-op thread
+    +channels_last  UNet and VAE in channels_last
+    +fp32           no autocast at all
+    +bf16           bfloat16 autocast only when the CPU supports it
+    +compile        torch.compile of the UNet, cache in --compile-cache-dir
+
+"load" is pipeline load time; "first" is the first image (includes
+compilation); "s/image" is the median of the following images.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CONFIGS = [
+    ('baseline', {'SD_CPU_PROFILE': 'baseline'}),
+    ('+threads', {'SD_CPU_PROFILE': 'baseline', 'SD_CPU_THREADS': '-1', 'SD_CPU_INTEROP_THREADS': '1'}),
+    ('+channels_last', {'SD_CPU_PROFILE': 'optimized', 'SD_CPU_BF16': 'default'}),
+    ('+fp32', {'SD_CPU_PROFILE': 'optimized', 'SD_CPU_BF16': '0'}),
+    ('+bf16', {'SD_CPU_PROFILE': 'optimized'}),
+    ('+compile', {'SD_CPU_PROFILE': 'compiled'}),
+]
+
+CHILD = """
+import time
+from ai_service import AIService
+service = AIService()
+t0 = time.perf_counter()
+service._init_stable_diffusion_local()
+print(f"LOAD {time.perf_counter() - t0:.3f}", flush=True)
+for i in range({images} + 1):
+    t0 = time.perf_counter()
+    service._generate_with_stable_diffusion_local(f"a lighthouse on a cliff at dusk, study {i}", "{size}")
+    print(f"IMAGE {time.perf_counter() - t0:.3f}", flush=True)
+"""
+
+
+def run_config(env_overrides: dict, images: int, size: str, steps_env: dict) -> dict:
+    env = dict(os.environ)
+    env.setdefault('OPENAI_API_KEY', 'sk-benchmark')
+    env['SD_BATCH_MAX_SIZE'] = '1'
+    env.update(steps_env)
+    env.update(env_overrides)
+    proc = subprocess.run(
+        [sys.executable, '-c', CHILD.replace('{images}', str(images)).replace('{size}', size)],
+        cwd=BACKEND_DIR,
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        text=True
+    )
+
+    load, times = float('nan'), []
+    for line in proc.stdout.splitlines():
+        if line.startswith('LOAD '):
+            load = float(line.split()[1])
+        elif line.startswith('IMAGE '):
+            times.append(float(line.split()[1]))
+
+    if proc.returncode != 0 or not times:
+        return {'load': load, 'first': float('nan'), 'per_image': float('nan')}
+    return {
+        'load': load,
+        'first': times[0],
+        'per_image': statistics.median(times[1:]) if len(times) > 1 else float('nan')
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', type=int, default=3, help="timed images per configuration")
+    parser.add_argument('--size', default='512x512')
+    parser.add_argument('--only', help="comma-separated configuration names to run")
+    parser.add_argument('--compile-cache-dir', default=os.path.join(BACKEND_DIR, '.cache', 'torch_compile'))
+    args = parser.parse_args()
+
+    selected = set(args.only.split(',')) if args.only else None
+    extra = {'SD_COMPILE_CACHE_DIR': args.compile_cache_dir, 'CUDA_VISIBLE_DEVICES': ''}
+
+    print(f"{'config':<15} {'load (s)':>9} {'first (s)':>9} {'s/image':>9}")
+    for name, overrides in CONFIGS:
+        if selected and name not in selected:
+            continue
+        r = run_config(overrides, args.images, args.size, extra)
+        print(f"{name:<15} {r['load']:>9.2f} {r['first']:>9.2f} {r['per_image']:>9.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""Query latency and recall of EmbeddingIndex, exact against IVF.
+
+Usage (from the backend directory):
+
+    python benchmarks/bench_similar.py --sizes 100000,1000000 --lists 1024 --probes 8,16
+
+For each size the index is filled with synthetic clustered unit vectors
+(CLIP embeddings are far from uniform; uniform random vectors would make
+any coarse quantizer look worse than it is) in a temporary directory.
+Reported per configuration: median and p95 query latency over
+``--queries`` held-out queries, and recall@k against the exact result.
+Build and IVF training times are printed once per size.
+"""
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+
+from embedding_index import EmbeddingIndex  # noqa: E402
+
+ADD_CHUNK = 50000
+
+
+def _clustered(rng, count: int, centers: np.ndarray, spread: float) -> np.ndarray:
+    vectors = centers[rng.integers(0, len(centers), count)] + rng.normal(0, spread, (count, centers.shape[1]))
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def _run(index: EmbeddingIndex, queries: np.ndarray, k: int, exact: bool):
+    latencies, ids = [], []
+    for query in queries:
+        started = time.perf_counter()
+        results = index.search(query, k=k, exact=exact)
+        latencies.append(time.perf_counter() - started)
+        ids.append({r['id'] for r in results})
+    return latencies, ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='100000,1000000')
+    parser.add_argument('--dim', type=int, default=512)
+    parser.add_argument('--lists', type=int, default=1024)
+    parser.add_argument('--probes', default='8,16')
+    parser.add_argument('--queries', type=int, default=50)
+    parser.add_argument('-k', type=int, default=10)
+    parser.add_argument('--clusters', type=int, default=2000)
+    parser.add_argument('--spread', type=float, default=0.04)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    centers = rng.normal(0, 1, (args.clusters, args.dim)) / np.sqrt(args.dim)
+    queries = _clustered(rng, args.queries, centers, args.spread)
+
+    print(f"{'size':>9} {'config':>10} {'p50 ms':>8} {'p95 ms':>8} {'recall@' + str(args.k):>10}")
+    for size in (int(s) for s in args.sizes.split(',')):
+        root = tempfile.mkdtemp(prefix='bench-similar-')
+        try:
+            index = EmbeddingIndex(root)
+            started = time.perf_counter()
+            for start in range(0, size, ADD_CHUNK):
+                count = min(ADD_CHUNK, size - start)
+                index.add_many([f'v{start + i}' for i in range(count)],
+                               _clustered(rng, count, centers, args.spread), 'image')
+            build = time.perf_counter() - started
+
+            index.ivf_lists = args.lists
+            started = time.perf_counter()
+            index.train_ivf()
+            train = time.perf_counter() - started
+            print(f"# {size} vectors: build {build:.1f} s, IVF training {train:.1f} s")
+
+            exact_latencies, truth = _run(index, queries, args.k, exact=True)
+            print(f"{size:>9} {'exact':>10} {statistics.median(exact_latencies) * 1000:>8.1f} "
+                  f"{_percentile(exact_latencies, 95) * 1000:>8.1f} {1.0:>10.3f}")
+            for probes in (int(p) for p in args.probes.split(',')):
+                index.ivf_probes = probes
+                latencies, found = _run(index, queries, args.k, exact=False)
+                recall = np.mean([len(f & t) / max(1, len(t)) for f, t in zip(found, truth)])
+                print(f"{size:>9} {f'ivf/{probes}':>10} {statistics.median(latencies) * 1000:>8.1f} "
+                      f"{_percentile(latencies, 95) * 1000:>8.1f} {recall:>10.3f}")
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
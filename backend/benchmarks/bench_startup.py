@@ -0,0 +1,102 @@
+"""Startup benchmark: time from process launch to the first HTTP responses.
+
+Usage (from the backend directory):
+
+    python benchmarks/bench_startup.py --runs 5
+
+Each run starts the Flask app in a fresh interpreter and records
+  * import: time until ``import app`` finished (reported by the child)
+  * health: time until ``/api/health`` answered 200
+  * index:  time until ``/`` answered 200
+  * clip:   time until ``/api/health?require=clip`` answered 200
+"""
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = """
+import time
+t0 = time.perf_counter()
+import app
+print(f"IMPORT {time.perf_counter() - t0:.4f}", flush=True)
+app.app.run(host='127.0.0.1', port={port}, use_reloader=False, threaded=True)
+"""
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _wait_for(url: str, start: float, timeout: float) -> float:
+    while time.perf_counter() - start < timeout:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as response:
+                if response.status == 200:
+                    return time.perf_counter() - start
+        except (urllib.error.URLError, ConnectionError, OSError):
+            pass
+        time.sleep(0.01)
+    return float('nan')
+
+
+def run_once(timeout: float, wait_clip: bool) -> dict:
+    port = _free_port()
+    env = dict(os.environ)
+    env.setdefault('OPENAI_API_KEY', 'sk-benchmark')
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, '-c', CHILD.replace('{port}', str(port))],
+        cwd=BACKEND_DIR,
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        text=True
+    )
+    try:
+        base = f"http://127.0.0.1:{port}"
+        timings = {
+            'health': _wait_for(f"{base}/api/health", start, timeout),
+            'index': _wait_for(f"{base}/", start, timeout),
+            'clip': _wait_for(f"{base}/api/health?require=clip", start, timeout) if wait_clip else float('nan')
+        }
+    finally:
+        proc.terminate()
+        out, _ = proc.communicate(timeout=10)
+
+    timings['import'] = float('nan')
+    for line in out.splitlines():
+        if line.startswith('IMPORT '):
+            timings['import'] = float(line.split()[1])
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--timeout', type=float, default=300.0)
+    parser.add_argument('--skip-clip', action='store_true', help="do not wait for CLIP warm-up")
+    args = parser.parse_args()
+
+    results = [run_once(args.timeout, not args.skip_clip) for _ in range(args.runs)]
+
+    print(f"{'stage':<8} {'median (s)':>10} {'min (s)':>10} {'max (s)':>10}")
+    for stage in ('import', 'health', 'index', 'clip'):
+        values = [r[stage] for r in results if r[stage] == r[stage]]
+        if not values:
+            print(f"{stage:<8} {'n/a':>10}")
+            continue
+        print(f"{stage:<8} {statistics.median(values):>10.3f} {min(values):>10.3f} {max(values):>10.3f}")
+
+
+if __name__ == '__main__':
+    main()
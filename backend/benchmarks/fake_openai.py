@@ -0,0 +1,243 @@
+"""Local stand-in for the OpenAI chat-completions and images endpoints.
+
+Usage (from the backend directory):
+
+    python benchmarks/fake_openai.py --port 8900 --latency-ms 400 --jitter-ms 100 --error-rate 0.02
+
+then start the app with ``OPENAI_BASE_URL=http://127.0.0.1:8900/v1``.
+
+Endpoints:
+  POST /v1/chat/completions    answers in the shape each caller expects:
+                               the schema-shaped analysis for the
+                               ``feature_analysis`` JSON schema, fused JSON
+                               for other ``response_format`` requests, an
+                               analysis JSON for the legacy feature-analysis
+                               prompt, a short prompt sentence otherwise;
+                               ``stream: true`` answers as server-sent
+                               chunks spread over ``stream-ms``
+  POST /v1/images/generations  returns a URL served by this process
+  GET  /images/<id>.png        a small PNG, so proxy fetches stay local
+
+Every POST sleeps ``latency-ms`` +/- ``jitter-ms`` (uniform) and fails
+with a 500 (or a 429 for ``--error-status 429``) with probability
+``error-rate``. Chat responses include a ``usage`` block (streams only
+with ``stream_options.include_usage``).
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+
+ANALYSIS = {
+    "color": {"crimson": 0.8, "gold": 0.6},
+    "style": {"impressionist": 0.7},
+    "lighting": {"golden hour": 0.9},
+    "mood": {"serene": 0.75},
+    "object": {"lighthouse": 0.85}
+}
+# Stream chunks carry this many characters each
+STREAM_CHUNK_CHARS = 16
+PROMPT = "A lighthouse on a windswept cliff at golden hour, painted in loose impressionist strokes"
+
+
+def _png() -> bytes:
+    try:
+        from PIL import Image
+    except ImportError:
+        # 1x1 transparent PNG
+        return bytes.fromhex(
+            '89504e470d0a1a0a0000000d49484452000000010000000108060000001f15c489'
+            '0000000d4944415478da63f8ffff3f0005fe02fea7d6a3d20000000049454e44ae426082'
+        )
+    buffer = BytesIO()
+    Image.new('RGB', (256, 256), (180, 90, 40)).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'FakeOpenAI/1.0'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, body: dict):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_stream(self, completion: dict, include_usage: bool):
+        """Send ``completion`` as chat.completion.chunk events, sleeping between chunks."""
+        content = completion['choices'][0]['message']['content']
+        pieces = [content[i:i + STREAM_CHUNK_CHARS] for i in range(0, len(content), STREAM_CHUNK_CHARS)]
+        delay = self.server.config['stream'] / max(1, len(pieces))
+        base = {key: completion[key] for key in ('id', 'created', 'model')}
+        base['object'] = 'chat.completion.chunk'
+
+        events = [{**base, 'choices': [{'index': 0, 'delta': {'content': piece}, 'finish_reason': None}]}
+                  for piece in pieces]
+        events.append({**base, 'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]})
+        if include_usage:
+            events.append({**base, 'choices': [], 'usage': completion['usage']})
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for index, event in enumerate(events):
+            if index and index <= len(pieces):
+                time.sleep(delay)
+            self._write_chunk(f"data: {json.dumps(event)}\n\n".encode('utf-8'))
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._write_chunk(b'')
+
+    def _write_chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+        self.wfile.flush()
+
+    def _inject(self) -> bool:
+        """Sleep for the configured latency; return True when an error was sent instead."""
+        config = self.server.config
+        delay = config['latency'] + random.uniform(-config['jitter'], config['jitter'])
+        time.sleep(max(0.0, delay))
+        if random.random() < config['error_rate']:
+            with self.server.lock:
+                self.server.counts['errors'] += 1
+            status = config['error_status']
+            self._send_json(status, {'error': {
+                'message': 'Injected failure',
+                'type': 'rate_limit_error' if status == 429 else 'server_error'
+            }})
+            return True
+        return False
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            self._send_json(400, {'error': {'message': 'Invalid JSON'}})
+            return
+
+        if self.path.endswith('/chat/completions'):
+            with self.server.lock:
+                self.server.counts['chat'] += 1
+            if not self._inject():
+                completion = self._chat_completion(body)
+                if body.get('stream'):
+                    self._send_stream(completion, (body.get('stream_options') or {}).get('include_usage'))
+                else:
+                    self._send_json(200, completion)
+        elif self.path.endswith('/images/generations'):
+            with self.server.lock:
+                self.server.counts['images'] += 1
+            if not self._inject():
+                host = self.headers.get('Host', f"127.0.0.1:{self.server.server_port}")
+                self._send_json(200, {
+                    'created': int(time.time()),
+                    'data': [{'url': f"http://{host}/images/{uuid.uuid4().hex}.png"}]
+                })
+        else:
+            self._send_json(404, {'error': {'message': f"Unknown endpoint {self.path}"}})
+
+    def do_GET(self):
+        if self.path.startswith('/images/'):
+            data = self.server.png
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/png')
+            self.send_header('Content-Length', str(len(data)))
+            self.send_header('ETag', '"fake-image"')
+            self.end_headers()
+            self.wfile.write(data)
+        elif self.path == '/stats':
+            with self.server.lock:
+                self._send_json(200, dict(self.server.counts))
+        else:
+            self._send_json(404, {'error': {'message': f"Unknown endpoint {self.path}"}})
+
+    @staticmethod
+    def _chat_completion(body: dict) -> dict:
+        messages = body.get('messages', [])
+        system = ' '.join(m.get('content', '') for m in messages if m.get('role') == 'system')
+
+        response_format = body.get('response_format') or {}
+        if (response_format.get('json_schema') or {}).get('name') == 'feature_analysis':
+            properties = response_format['json_schema']['schema']['properties']
+            content = json.dumps({
+                category: [{'term': term, 'score': score} for term, score in ANALYSIS.get(category, {}).items()]
+                for category in properties
+            })
+        elif response_format:
+            content = json.dumps({'prompt': PROMPT, 'analysis': ANALYSIS})
+        elif 'Categories to analyze' in system:
+            content = json.dumps(ANALYSIS)
+        else:
+            content = PROMPT
+
+        prompt_tokens = sum(len(m.get('content', '')) for m in messages) // 4
+        completion_tokens = len(content) // 4
+        return {
+            'id': f"chatcmpl-{uuid.uuid4().hex[:24]}",
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': body.get('model', 'gpt-4o-mini'),
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': content},
+                'finish_reason': 'stop'
+            }],
+            'usage': {
+                'prompt_tokens': prompt_tokens,
+                'completion_tokens': completion_tokens,
+                'total_tokens': prompt_tokens + completion_tokens
+            }
+        }
+
+
+def make_server(host: str = '127.0.0.1', port: int = 0, latency_ms: float = 300.0, jitter_ms: float = 0.0,
+                error_rate: float = 0.0, error_status: int = 500, stream_ms: float = 0.0) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host, port), FakeOpenAIHandler)
+    server.daemon_threads = True
+    server.config = {
+        'latency': latency_ms / 1000.0,
+        'jitter': jitter_ms / 1000.0,
+        'error_rate': error_rate,
+        'error_status': error_status,
+        'stream': stream_ms / 1000.0
+    }
+    server.counts = {'chat': 0, 'images': 0, 'errors': 0}
+    server.lock = threading.Lock()
+    server.png = _png()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--latency-ms', type=float, default=300.0)
+    parser.add_argument('--jitter-ms', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--error-status', type=int, default=500, choices=(429, 500, 503))
+    parser.add_argument('--stream-ms', type=float, default=0.0,
+                        help='spread streamed responses over this long, after --latency-ms')
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, args.latency_ms, args.jitter_ms, args.error_rate, args.error_status,
+                         args.stream_ms)
+    print(f"READY http://{args.host}:{server.server_port}/v1", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def content_key(fields: Dict[str, Any]) -> str:
+    """Stable sha256 hex digest of a JSON-serialisable description."""
+    blob = json.dumps(fields, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(blob.encode('utf-8')).hexdigest()
+
+
+class BlobStore:
+    """On-disk key -> bytes store with a total size budget.
+
+    Files live at ``<root>/<key[:2]>/<key><suffix>`` and are written through
+    a temporary file plus ``os.replace``, so readers never see partial
+    data and several processes can share one directory. Recency is tracked
+    through file mtimes (touched on every hit); when the total size exceeds
+    ``max_bytes`` the least recently used files are deleted.
+    """
+
+    def __init__(self, root: str, max_bytes: int = 1 << 30, suffix: str = ''):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # key -> size, least recently used first
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._total = 0
+        os.makedirs(self.root, exist_ok=True)
+        self._scan()
+
+    def __contains__(self, key: str) -> bool:
+        return os.path.exists(self.path_for(key))
+
+    def path_for(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], f"{key}{self.suffix}")
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self.path_for(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            with self._lock:
+                self.misses += 1
+                if key in self._entries:
+                    self._total -= self._entries.pop(key)
+            return None
+
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+            if key not in self._entries:
+                self._total += len(data)
+            self._entries[key] = len(data)
+            self._entries.move_to_end(key)
+        return data
+
+    def put(self, key: str, data: bytes):
+        if len(data) > self.max_bytes:
+            return
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Failed to write {path}: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+
+        with self._lock:
+            self._total += len(data) - self._entries.pop(key, 0)
+            self._entries[key] = len(data)
+            self._evict()
+
+    def delete(self, key: str):
+        with self._lock:
+            self._total -= self._entries.pop(key, 0)
+        try:
+            os.remove(self.path_for(key))
+        except OSError:
+            pass
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._total,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0
+            }
+
+    def _evict(self):
+        while self._total > self.max_bytes and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self._total -= size
+            try:
+                os.remove(self.path_for(key))
+            except OSError:
+                pass
+
+    def _scan(self):
+        found = []
+        for shard in os.listdir(self.root):
+            shard_dir = os.path.join(self.root, shard)
+            if not os.path.isdir(shard_dir):
+                continue
+            for name in os.listdir(shard_dir):
+                if not name.endswith(self.suffix) or name.endswith('.tmp'):
+                    continue
+                try:
+                    st = os.stat(os.path.join(shard_dir, name))
+                except OSError:
+                    continue
+                key = name[:len(name) - len(self.suffix)] if self.suffix else name
+                found.append((st.st_mtime, key, st.st_size))
+
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self._total += size
+        if found:
+            logger.info(f"Blob store {self.root}: {len(found)} entries, {self._total} bytes")
+        with self._lock:
+            self._evict()
+
+    @classmethod
+    def from_env(cls, dir_variable: str, size_variable: str, default_mb: int = 1024,
+                 suffix: str = '') -> Optional["BlobStore"]:
+        """Store under ``$dir_variable`` with a ``$size_variable`` MB budget; None when unset."""
+        root = os.getenv(dir_variable)
+        if not root:
+            return None
+        max_mb = float(os.getenv(size_variable, str(default_mb)))
+        try:
+            return cls(root, max_bytes=int(max_mb * 1024 * 1024), suffix=suffix)
+        except OSError as e:
+            logger.warning(f"Cannot use {root} for {dir_variable}: {e}")
+            return None
@@ -0,0 +1,120 @@
+import logging
+import math
+from io import BytesIO
+from typing import Optional, Sequence, TYPE_CHECKING
+
+import numpy as np
+from PIL import Image
+
+if TYPE_CHECKING:
+    import torch
+
+logger = logging.getLogger(__name__)
+
+# openai/clip-vit-* image preprocessing
+CLIP_IMAGE_SIZE = 224
+CLIP_MEAN = (0.48145466, 0.4578275, 0.40821073)
+CLIP_STD = (0.26862954, 0.26130258, 0.27577711)
+
+
+class ClipPreprocessor:
+    """Decode, resize, center-crop and normalize images for CLIP without ``CLIPProcessor``.
+
+    Mirrors ``CLIPImageProcessor`` (shortest edge to ``size``, center crop
+    to ``crop_size``, rescale to [0, 1], normalize) with less work:
+
+    * JPEGs are decoded with ``Image.draft`` at the largest DCT reduction
+      (1/2, 1/4 or 1/8) that still covers the target, so a 4000x3000 photo
+      is never held in memory at full resolution.
+    * Resize and crop are one ``Image.resize`` over the crop's source box,
+      without the intermediate resized image.
+    * Pixels are written straight into one preallocated (N, 3, H, W)
+      float32 tensor and normalized in place.
+
+    Results match the processor to within resampling noise.
+    """
+
+    def __init__(self, size: int = CLIP_IMAGE_SIZE, crop_size: int = CLIP_IMAGE_SIZE,
+                 mean: Sequence[float] = CLIP_MEAN, std: Sequence[float] = CLIP_STD,
+                 resample: int = Image.BICUBIC):
+        self.size = size
+        self.crop_size = crop_size
+        self.resample = resample
+        mean = np.asarray(mean, dtype=np.float32)
+        std = np.asarray(std, dtype=np.float32)
+        # (x / 255 - mean) / std == x * scale - shift
+        self._scale = (1.0 / (255.0 * std)).reshape(1, 3, 1, 1)
+        self._shift = (mean / std).reshape(1, 3, 1, 1)
+
+    @classmethod
+    def from_processor(cls, processor) -> Optional["ClipPreprocessor"]:
+        """Read the settings of a ``CLIPProcessor``; None when they are not the standard CLIP recipe."""
+        image_processor = getattr(processor, 'image_processor', processor)
+        size = getattr(image_processor, 'size', None)
+        crop_size = getattr(image_processor, 'crop_size', None)
+        if size is None and crop_size is None:
+            return cls()
+
+        if (not isinstance(size, dict) or 'shortest_edge' not in size
+                or not isinstance(crop_size, dict) or crop_size.get('height') != crop_size.get('width')
+                or not getattr(image_processor, 'do_center_crop', True)
+                or not getattr(image_processor, 'do_normalize', True)):
+            logger.info(f"Unsupported CLIP image processor settings {size} / {crop_size}, using CLIPProcessor")
+            return None
+
+        return cls(
+            size=size['shortest_edge'],
+            crop_size=crop_size['height'],
+            mean=getattr(image_processor, 'image_mean', None) or CLIP_MEAN,
+            std=getattr(image_processor, 'image_std', None) or CLIP_STD,
+            resample=int(getattr(image_processor, 'resample', Image.BICUBIC))
+        )
+
+    def load(self, data: bytes) -> Image.Image:
+        """Encoded image bytes -> RGB image of ``crop_size`` x ``crop_size``."""
+        return self.fit(self.decode(data))
+
+    def decode(self, data: bytes) -> Image.Image:
+        """Decode to RGB, at reduced resolution when the format allows it."""
+        image = Image.open(BytesIO(data))
+        if image.format == 'JPEG':
+            width, height = image.size
+            shortest = min(width, height)
+            if shortest > self.size:
+                image.draft('RGB', (math.ceil(width * self.size / shortest),
+                                    math.ceil(height * self.size / shortest)))
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        return image
+
+    def fit(self, image: Image.Image) -> Image.Image:
+        """Shortest edge to ``size`` then center crop, as a single resample."""
+        width, height = image.size
+        if (width, height) == (self.crop_size, self.crop_size):
+            return image
+
+        # Resized dimensions as CLIPImageProcessor computes them
+        if width <= height:
+            resized_w, resized_h = self.size, int(self.size * height / width)
+        else:
+            resized_w, resized_h = int(self.size * width / height), self.size
+        left = (resized_w - self.crop_size) // 2
+        top = (resized_h - self.crop_size) // 2
+
+        sx, sy = width / resized_w, height / resized_h
+        box = (left * sx, top * sy, (left + self.crop_size) * sx, (top + self.crop_size) * sy)
+        return image.resize((self.crop_size, self.crop_size), self.resample, box=box)
+
+    def to_tensor(self, images: Sequence[Image.Image]) -> "torch.Tensor":
+        """Normalized (N, 3, crop_size, crop_size) float32 batch."""
+        import torch
+
+        batch = torch.empty((len(images), 3, self.crop_size, self.crop_size), dtype=torch.float32)
+        for i, image in enumerate(images):
+            if image.mode != 'RGB':
+                image = image.convert('RGB')
+            pixels = torch.from_numpy(np.array(self.fit(image)))
+            batch[i].copy_(pixels.permute(2, 0, 1))
+
+        batch.mul_(torch.from_numpy(self._scale)).sub_(torch.from_numpy(self._shift))
+        return batch
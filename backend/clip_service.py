@@ -7,9 +7,11 @@ import numpy as np
 from typing import Dict, List, Tuple, Optional, Any
 import logging
 from dataclasses import dataclass
-from transformers import CLIPProcessor, CLIPModel
 import base64
 import json
+from embedding_cache import get_text_embedding_cache
+from model_registry import CLIP_MODEL_ID, get_clip
+from clip_preprocess import ClipPreprocessor
 
 logger = logging.getLogger(__name__)
 
@@ -23,10 +25,10 @@ class ClipFeatureAnalysis:
 class CLIPService:
     def __init__(self):
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
-        self.model = CLIPModel.from_pretrained("openai/clip-vit-base-patch32")
-        self.processor = CLIPProcessor.from_pretrained("openai/clip-vit-base-patch32")
-        self.model.to(self.device)
+        self.model, self.processor = get_clip(self.device)
+        self.preprocessor = ClipPreprocessor.from_processor(self.processor)
         self._cache = {}
+        self.text_embedding_cache = get_text_embedding_cache(CLIP_MODEL_ID)
         self.feature_types = {
             'color': {'name': 'Color', 'descriptors': []},
             'style': {'name': 'Style', 'descriptors': []},
@@ -161,10 +163,7 @@ class CLIPService:
             image = self._prepare_image(image_data)
 
 
-            inputs = self.processor(
-                images=image,
-                return_tensors="pt"
-            ).to(self.device)
+            inputs = self._image_inputs(image)
 
             with torch.no_grad():
                 image_features = self.model.get_image_features(**inputs)
@@ -242,12 +241,20 @@ class CLIPService:
                 image_bytes = image_data
 
 
+            if self.preprocessor is not None:
+                return self.preprocessor.load(image_bytes)
             return Image.open(BytesIO(image_bytes)).convert('RGB')
 
         except Exception as e:
             logger.error(f"Image preparation failed: {str(e)}")
             raise
 
+    def _image_inputs(self, image: Image.Image) -> Dict[str, torch.Tensor]:
+        if self.preprocessor is not None:
+            return {'pixel_values': self.preprocessor.to_tensor([image]).to(self.device)}
+        inputs = self.processor(images=image, return_tensors="pt")
+        return {k: v.to(self.device) for k, v in inputs.items()}
+
     async def encode_image(self, image_data: str):
         try:
 
@@ -260,13 +267,8 @@ class CLIPService:
                 image_bytes = image_data
 
 
-            image = Image.open(BytesIO(image_bytes)).convert('RGB')
-
-            inputs = self.processor(
-                images=image,
-                return_tensors="pt"
-            )
-            inputs = {k: v.to(self.device) for k, v in inputs.items()}
+            image = self._prepare_image(image_bytes)
+            inputs = self._image_inputs(image)
 
             with torch.no_grad():
                 image_features = self.model.get_image_features(**inputs)
@@ -283,19 +285,26 @@ class CLIPService:
         features = {}
 
         for category, desc_list in descriptors.items():
-            inputs = self.processor(
-                text=[f"This image has {desc} {category}" for desc in desc_list],
-                return_tensors="pt",
-                padding=True
-            ).to(self.device)
-
-            with torch.no_grad():
-                text_features = self.model.get_text_features(**inputs)
-                normalized = text_features / text_features.norm(dim=-1, keepdim=True)
-                features[category] = normalized.cpu().numpy()
+            features[category] = self.text_embedding_cache.get_or_encode(
+                [f"This image has {desc} {category}" for desc in desc_list],
+                self._encode_texts
+            )
 
         return features
 
+    def _encode_texts(self, texts: List[str]) -> np.ndarray:
+        inputs = self.processor(
+            text=texts,
+            return_tensors="pt",
+            padding=True,
+            truncation=True
+        ).to(self.device)
+
+        with torch.no_grad():
+            text_features = self.model.get_text_features(**inputs)
+            normalized = text_features / text_features.norm(dim=-1, keepdim=True)
+        return normalized.cpu().numpy()
+
     def _calculate_similarity(self, image_features: np.ndarray, text_features: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
         similarity = {}
 
@@ -0,0 +1,171 @@
+import atexit
+import json
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class TextEmbeddingCache:
+    """Bounded cache of CLIP text embeddings keyed by the exact prompt string.
+
+    Vectors live as float16 rows of one contiguous matrix. When ``path`` is
+    given the matrix is restored from ``<path>.npy`` as a copy-on-write
+    memory map (pages stay shared between workers until written) and the
+    string -> row mapping from ``<path>.keys.json``.
+    """
+
+    def __init__(self, capacity: int = 4096, path: Optional[str] = None):
+        self.capacity = capacity
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._rows: "OrderedDict[str, int]" = OrderedDict()
+        self._vectors: Optional[np.ndarray] = None
+        self._lock = threading.Lock()
+        self._dirty = False
+
+        if self.path:
+            self._load()
+            atexit.register(self.save)
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def get_or_encode(self, texts: Sequence[str], encode: Callable[[List[str]], np.ndarray]) -> np.ndarray:
+        """Return float32 embeddings for ``texts``; only unseen strings are passed to ``encode``."""
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+
+        result: List[Optional[np.ndarray]] = [None] * len(texts)
+        missing: Dict[str, List[int]] = {}
+
+        with self._lock:
+            for i, text in enumerate(texts):
+                row = self._rows.get(text)
+                if row is None:
+                    missing.setdefault(text, []).append(i)
+                    continue
+                self._rows.move_to_end(text)
+                result[i] = self._vectors[row].astype(np.float32)
+            self.hits += len(texts) - sum(len(v) for v in missing.values())
+            self.misses += sum(len(v) for v in missing.values())
+
+        if missing:
+            new_texts = list(missing.keys())
+            # Round through float16 so a hit and a miss give the same numbers
+            encoded = np.asarray(encode(new_texts), dtype=np.float16).astype(np.float32)
+            with self._lock:
+                for text, vector in zip(new_texts, encoded):
+                    self._store(text, vector)
+                    for i in missing[text]:
+                        result[i] = vector
+
+        return np.stack(result)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._rows),
+                'capacity': self.capacity,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0
+            }
+
+    def save(self):
+        """Atomically write the matrix and key sidecar to ``path``."""
+        if not self.path:
+            return
+        with self._lock:
+            if not self._dirty or self._vectors is None:
+                return
+            vectors = np.array(self._vectors, dtype=np.float16)
+            keys = list(self._rows.items())
+            self._dirty = False
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_matrix = f"{self.path}.{os.getpid()}.tmp.npy"
+        tmp_keys = f"{self.path}.{os.getpid()}.tmp.json"
+        try:
+            np.save(tmp_matrix, vectors)
+            with open(tmp_keys, 'w', encoding='utf-8') as f:
+                json.dump(keys, f, ensure_ascii=False)
+            os.replace(tmp_matrix, f"{self.path}.npy")
+            os.replace(tmp_keys, f"{self.path}.keys.json")
+            logger.info(f"Saved {len(keys)} text embeddings to {self.path}")
+        except OSError as e:
+            logger.warning(f"Failed to save text embedding cache: {e}")
+
+    def _store(self, text: str, vector: np.ndarray):
+        if self.capacity <= 0:
+            return
+        if self._vectors is None or self._vectors.shape[1] != vector.shape[0]:
+            self._vectors = np.zeros((self.capacity, vector.shape[0]), dtype=np.float16)
+            self._rows.clear()
+
+        if text in self._rows:
+            row = self._rows[text]
+            self._rows.move_to_end(text)
+        elif len(self._rows) < self.capacity:
+            row = len(self._rows)
+            self._rows[text] = row
+        else:
+            _, row = self._rows.popitem(last=False)
+            self._rows[text] = row
+
+        self._vectors[row] = vector
+        self._dirty = True
+
+    def _load(self):
+        matrix_path = f"{self.path}.npy"
+        keys_path = f"{self.path}.keys.json"
+        if not (os.path.exists(matrix_path) and os.path.exists(keys_path)):
+            return
+        try:
+            vectors = np.load(matrix_path, mmap_mode='c')
+            with open(keys_path, 'r', encoding='utf-8') as f:
+                keys = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable text embedding cache at {self.path}: {e}")
+            return
+
+        if vectors.dtype != np.float16 or vectors.ndim != 2 or vectors.shape[0] != self.capacity:
+            logger.info(f"Text embedding cache at {self.path} has a different layout, starting empty")
+            return
+
+        self._vectors = vectors
+        self._rows = OrderedDict((text, int(row)) for text, row in keys if 0 <= int(row) < self.capacity)
+        logger.info(f"Loaded {len(self._rows)} cached text embeddings from {self.path}")
+
+
+_caches: Dict[str, TextEmbeddingCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_text_embedding_cache(model_name: str) -> TextEmbeddingCache:
+    """Process-wide cache for one text encoder, configured from the environment.
+
+    CLIP_TEXT_CACHE_SIZE bounds the number of rows; CLIP_TEXT_CACHE_DIR, when
+    set, enables persistence between restarts.
+    """
+    with _caches_lock:
+        cache = _caches.get(model_name)
+        if cache is None:
+            cache_dir = os.getenv('CLIP_TEXT_CACHE_DIR')
+            path = None
+            if cache_dir:
+                path = os.path.join(cache_dir, re.sub(r'[^A-Za-z0-9_.-]+', '_', model_name))
+            cache = TextEmbeddingCache(
+                capacity=int(os.getenv('CLIP_TEXT_CACHE_SIZE', '4096')),
+                path=path
+            )
+            _caches[model_name] = cache
+        return cache
@@ -0,0 +1,487 @@
+import json
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locking, one process per index
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Rows converted to float32 and scored per block during exact search
+SEARCH_BLOCK_ROWS = 8192
+# k-means on a sample of at most this many rows per list
+IVF_SAMPLE_PER_LIST = 64
+IVF_ITERATIONS = 8
+
+
+def _dot(block: np.ndarray, query: np.ndarray) -> np.ndarray:
+    """float16 rows @ float32 query. torch, when installed, converts half
+    precision with SIMD; NumPy's conversion is several times slower."""
+    try:
+        import torch
+    except ImportError:
+        return np.asarray(block, dtype=np.float32) @ query
+    return (torch.from_numpy(np.ascontiguousarray(block)).float() @ torch.from_numpy(query)).numpy()
+
+
+def _grown(array: np.ndarray, size: int) -> np.ndarray:
+    """``array`` with room for at least ``size`` elements (capacity doubles)."""
+    if len(array) >= size:
+        return array
+    grown = np.zeros(max(1024, 2 * len(array), size), dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+
+class EmbeddingIndex:
+    """Append-only store of L2-normalized embeddings with top-k cosine search.
+
+    Layout under ``root``:
+
+    * ``index.json``: the vector dimension.
+    * ``vectors.f16``: (capacity, dim) float16 matrix, memory-mapped and
+      grown by doubling.
+    * ``meta.jsonl``: one line per row with its id, kind and metadata.
+      The line is written after the vector, so a torn append leaves a row
+      that is simply overwritten.
+    * ``ivf.npy`` and ``ivf_assign.i32``: optional coarse quantizer.
+    * ``.lock``: taken with ``flock`` around every write.
+
+    Several processes (gunicorn workers) may share one directory: writes
+    hold the directory lock, and each process first loads the rows others
+    appended, so row numbers and ``meta.jsonl`` stay in step. Searches
+    pick up new rows whenever ``meta.jsonl`` has grown.
+
+    Search is exact by default: the matrix is scored in float32 blocks.
+    With ``ivf_lists`` set, a spherical k-means quantizer is trained in the
+    background once ``ivf_lists * IVF_SAMPLE_PER_LIST`` vectors exist, and
+    retrained whenever the index has doubled since the last training. A
+    query then scores only the rows of its ``ivf_probes`` nearest lists.
+    """
+
+    def __init__(self, root: str, ivf_lists: int = 0, ivf_probes: int = 8):
+        self.root = root
+        self.ivf_lists = ivf_lists
+        self.ivf_probes = max(1, ivf_probes)
+        os.makedirs(root, exist_ok=True)
+
+        self._lock = threading.RLock()
+        self._vectors_path = os.path.join(root, 'vectors.f16')
+        self._meta_path = os.path.join(root, 'meta.jsonl')
+        self._header_path = os.path.join(root, 'index.json')
+        self._ivf_path = os.path.join(root, 'ivf.npy')
+        self._assign_path = os.path.join(root, 'ivf_assign.i32')
+        self._lock_path = os.path.join(root, '.lock')
+        # Bytes of meta.jsonl already loaded, and the quantizer file version we hold
+        self._meta_offset = 0
+        self._ivf_mtime: Optional[float] = None
+
+        self.dim: Optional[int] = None
+        self.count = 0
+        self._vectors: Optional[np.memmap] = None
+        self._rows: Dict[str, int] = {}
+        self._meta: List[Dict[str, Any]] = []
+        self._kinds: Dict[str, int] = {}
+        self._kind_codes = np.zeros(0, dtype=np.int16)
+
+        self._centroids: Optional[np.ndarray] = None
+        self._assign = np.zeros(0, dtype=np.int32)
+        self._assigned = 0
+        # Inverted lists: rows sorted by list, and each list's slice of that order
+        self._list_order = np.zeros(0, dtype=np.int32)
+        self._list_offsets = np.zeros(1, dtype=np.int64)
+        self._listed = 0
+        self._trained_count = 0
+        self._training = False
+
+        with self._lock, self._directory_lock():
+            self._load()
+
+    @classmethod
+    def from_env(cls) -> Optional["EmbeddingIndex"]:
+        """EMBEDDING_INDEX_DIR (a persistent directory; unset or empty disables the
+        index), EMBEDDING_IVF_LISTS (0 keeps search exact) and EMBEDDING_IVF_PROBES."""
+        root = os.getenv('EMBEDDING_INDEX_DIR', '')
+        if not root:
+            return None
+        try:
+            return cls(
+                root,
+                ivf_lists=int(os.getenv('EMBEDDING_IVF_LISTS', '0')),
+                ivf_probes=int(os.getenv('EMBEDDING_IVF_PROBES', '8'))
+            )
+        except (OSError, ValueError) as e:
+            logger.warning(f"Embedding index disabled, cannot use {root}: {e}")
+            return None
+
+    def __contains__(self, item_id: str) -> bool:
+        return item_id in self._rows
+
+    def add(self, item_id: str, vector, kind: str, metadata: Optional[Dict[str, Any]] = None) -> bool:
+        """Append ``vector`` under ``item_id``; False when the id is already indexed."""
+        return self.add_many([item_id], np.asarray(vector, dtype=np.float32).reshape(1, -1), kind,
+                             [metadata]) == 1
+
+    def add_many(self, item_ids: Sequence[str], vectors, kind: str,
+                 metadata: Optional[Sequence[Optional[Dict[str, Any]]]] = None) -> int:
+        """Append rows in one write; ids already indexed (or repeated) are skipped. Returns rows added."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        if vectors.ndim != 2 or len(vectors) != len(item_ids):
+            raise ValueError("Expected one vector per id")
+        if not np.all(np.isfinite(norms)) or np.any(norms == 0):
+            raise ValueError("Cannot index a zero or non-finite vector")
+        vectors = vectors / norms
+        metadata = metadata or [None] * len(item_ids)
+
+        with self._shared():
+            keep, seen = [], set()
+            for i, item_id in enumerate(item_ids):
+                if item_id not in self._rows and item_id not in seen:
+                    seen.add(item_id)
+                    keep.append(i)
+            if not keep:
+                return 0
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                with open(self._header_path, 'w', encoding='utf-8') as f:
+                    json.dump({'dim': self.dim}, f)
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"Expected {self.dim}-d vectors, got {vectors.shape[1]}")
+
+            start = self.count
+            self._ensure_capacity(start + len(keep))
+            # Left to the page cache; flushing the whole mapping per append is O(n)
+            self._vectors[start:start + len(keep)] = vectors[keep]
+
+            entries = [{'id': item_ids[i], 'kind': kind, 'metadata': metadata[i] or {}} for i in keep]
+            encoded = ''.join(json.dumps(entry) + '\n' for entry in entries).encode('utf-8')
+            with open(self._meta_path, 'ab') as f:
+                f.write(encoded)
+            self._meta_offset += len(encoded)
+            for entry in entries:
+                self._append_entry(entry)
+
+            if self._centroids is not None:
+                self._append_assignments(vectors[keep])
+
+        self._maybe_train()
+        return len(keep)
+
+    def vector(self, item_id: str) -> Optional[np.ndarray]:
+        with self._lock:
+            row = self._rows.get(item_id)
+            return None if row is None else np.asarray(self._vectors[row], dtype=np.float32)
+
+    def search(self, query, k: int = 10, kind: Optional[str] = None,
+               exclude: Optional[str] = None, exact: bool = False) -> List[Dict[str, Any]]:
+        """Top-``k`` rows by cosine similarity to ``query``, best first."""
+        query = np.asarray(query, dtype=np.float32).reshape(-1)
+        norm = np.linalg.norm(query)
+        if norm:
+            query = query / norm
+
+        self._catch_up()
+        with self._lock:
+            count = self.count
+            if count == 0 or k <= 0:
+                return []
+            if query.shape[0] != self.dim:
+                raise ValueError(f"Expected a {self.dim}-d query, got {query.shape[0]}")
+            vectors = self._vectors
+            kind_codes = self._kind_codes[:count]
+            kind_code = self._kinds.get(kind) if kind else None
+            if kind and kind_code is None:
+                return []
+            exclude_row = self._rows.get(exclude) if exclude else None
+            use_ivf = not exact and self._centroids is not None and self._assigned >= count
+            if use_ivf:
+                centroids, assign = self._centroids, self._assign[:count]
+                order, offsets, listed = self._list_order, self._list_offsets, self._listed
+
+        if use_ivf:
+            probes = np.argsort(centroids @ query)[::-1][:self.ivf_probes]
+            # Rows of the probed lists, plus rows appended since the lists were last sorted
+            tail = listed + np.flatnonzero(np.isin(assign[listed:], probes))
+            rows = np.sort(np.concatenate([order[offsets[p]:offsets[p + 1]] for p in probes] + [tail]))
+            if kind_code is not None:
+                rows = rows[kind_codes[rows] == kind_code]
+            scores = _dot(vectors[rows], query)
+        else:
+            rows = None
+            scores = np.empty(count, dtype=np.float32)
+            for start in range(0, count, SEARCH_BLOCK_ROWS):
+                end = min(count, start + SEARCH_BLOCK_ROWS)
+                scores[start:end] = _dot(vectors[start:end], query)
+            if kind_code is not None:
+                scores[kind_codes != kind_code] = -np.inf
+
+        if exclude_row is not None:
+            if rows is None:
+                scores[exclude_row] = -np.inf
+            else:
+                scores[rows == exclude_row] = -np.inf
+
+        k = min(k, len(scores))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+
+        results = []
+        for i in top:
+            if not np.isfinite(scores[i]):
+                continue
+            row = int(rows[i]) if rows is not None else int(i)
+            entry = self._meta[row]
+            results.append({
+                'id': entry['id'],
+                'kind': entry['kind'],
+                'score': float(scores[i]),
+                'metadata': entry['metadata']
+            })
+        return results
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'entries': self.count,
+                'dim': self.dim,
+                'bytes': self.count * (self.dim or 0) * 2,
+                'kinds': {kind: int(np.sum(self._kind_codes[:self.count] == code))
+                          for kind, code in self._kinds.items()},
+                'ivf_lists': 0 if self._centroids is None else len(self._centroids),
+                'ivf_trained_count': self._trained_count
+            }
+
+    def train_ivf(self):
+        """(Re)build the coarse quantizer from the current vectors."""
+        with self._lock:
+            count, dim, vectors = self.count, self.dim, self._vectors
+        n_lists = min(self.ivf_lists, count)
+        if n_lists < 2:
+            return
+
+        rng = np.random.default_rng(0)
+        sample_size = min(count, n_lists * IVF_SAMPLE_PER_LIST)
+        sample_rows = np.sort(rng.choice(count, sample_size, replace=False))
+        sample = np.asarray(vectors[sample_rows], dtype=np.float32)
+
+        centroids = sample[rng.choice(sample_size, n_lists, replace=False)].copy()
+        for _ in range(IVF_ITERATIONS):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            # Empty lists keep their previous centroid
+            centroids = np.where(norms > 0, sums / np.maximum(norms, 1e-12), centroids)
+
+        assign = self._assign_rows(vectors, 0, count, centroids)
+        with self._shared():
+            # Rows appended while training
+            if self.count > count:
+                assign = np.concatenate([assign, self._assign_rows(self._vectors, count, self.count, centroids)])
+            self._centroids = centroids
+            self._assign, self._assigned = assign, len(assign)
+            self._sort_lists()
+            self._trained_count = self.count
+            np.save(self._ivf_path, centroids)
+            assign.tofile(self._assign_path)
+            self._ivf_mtime = os.path.getmtime(self._ivf_path)
+        logger.info(f"Trained IVF index with {n_lists} lists over {count} vectors")
+
+    @staticmethod
+    def _assign_rows(vectors, start: int, end: int, centroids: np.ndarray) -> np.ndarray:
+        assign = np.empty(end - start, dtype=np.int32)
+        for block in range(start, end, SEARCH_BLOCK_ROWS):
+            stop = min(end, block + SEARCH_BLOCK_ROWS)
+            chunk = np.asarray(vectors[block:stop], dtype=np.float32)
+            assign[block - start:stop - start] = np.argmax(chunk @ centroids.T, axis=1)
+        return assign
+
+    def _append_assignments(self, vectors: np.ndarray):
+        labels = np.argmax(vectors @ self._centroids.T, axis=1).astype(np.int32)
+        self._assign = _grown(self._assign, self._assigned + len(labels))
+        self._assign[self._assigned:self._assigned + len(labels)] = labels
+        self._assigned += len(labels)
+        with open(self._assign_path, 'ab') as f:
+            labels.tofile(f)
+        if self._assigned - self._listed > max(1024, self._listed // 10):
+            self._sort_lists()
+
+    def _sort_lists(self):
+        assign = self._assign[:self._assigned]
+        self._list_order = np.argsort(assign, kind='stable').astype(np.int32)
+        counts = np.bincount(assign, minlength=len(self._centroids))
+        self._list_offsets = np.concatenate([[0], np.cumsum(counts)])
+        self._listed = self._assigned
+
+    def _maybe_train(self):
+        if not self.ivf_lists:
+            return
+        with self._lock:
+            threshold = max(self.ivf_lists * IVF_SAMPLE_PER_LIST, 2 * self._trained_count)
+            if self._training or self.count < threshold:
+                return
+            self._training = True
+
+        def run():
+            try:
+                self.train_ivf()
+            except Exception as e:
+                logger.error(f"IVF training failed: {e}")
+            finally:
+                self._training = False
+
+        threading.Thread(target=run, name='ivf-train', daemon=True).start()
+
+    def _append_entry(self, entry: Dict[str, Any]):
+        row = len(self._meta)
+        self._meta.append(entry)
+        self._rows[entry['id']] = row
+        code = self._kinds.setdefault(entry['kind'], len(self._kinds))
+        self._kind_codes = _grown(self._kind_codes, row + 1)
+        self._kind_codes[row] = code
+        self.count = row + 1
+
+    def _ensure_capacity(self, rows: int):
+        capacity = 0 if self._vectors is None else self._vectors.shape[0]
+        if rows <= capacity:
+            return
+        # Another process may have grown the file further; never shrink it
+        file_rows = os.path.getsize(self._vectors_path) // (2 * self.dim) if os.path.exists(self._vectors_path) else 0
+        new_capacity = max(1024, capacity * 2, rows, file_rows)
+        if self._vectors is not None:
+            self._vectors.flush()
+        with open(self._vectors_path, 'ab') as f:
+            if new_capacity > file_rows:
+                f.truncate(new_capacity * self.dim * 2)
+        self._vectors = np.memmap(self._vectors_path, dtype=np.float16, mode='r+',
+                                  shape=(new_capacity, self.dim))
+
+    @contextmanager
+    def _directory_lock(self):
+        """Exclusive cross-process lock on the index directory (no-op without fcntl)."""
+        if fcntl is None:
+            yield
+            return
+        with open(self._lock_path, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    @contextmanager
+    def _shared(self):
+        """Both locks, with rows written by other processes loaded first."""
+        with self._lock, self._directory_lock():
+            self._refresh()
+            yield
+
+    def _catch_up(self):
+        """Load other processes' rows if meta.jsonl or the quantizer changed since we last looked."""
+        try:
+            grown = os.path.getsize(self._meta_path) > self._meta_offset
+            retrained = os.path.exists(self._ivf_path) and os.path.getmtime(self._ivf_path) != self._ivf_mtime
+        except OSError:
+            return
+        if grown or retrained:
+            with self._shared():
+                pass
+
+    def _refresh(self):
+        """Append the complete meta.jsonl lines past ``_meta_offset``; call with both locks held."""
+        try:
+            size = os.path.getsize(self._meta_path)
+        except OSError:
+            return
+        if size > self._meta_offset:
+            with open(self._meta_path, 'rb') as f:
+                f.seek(self._meta_offset)
+                data = f.read(size - self._meta_offset)
+            end = data.rfind(b'\n') + 1
+            if end:
+                if self.dim is None:
+                    with open(self._header_path, 'r', encoding='utf-8') as f:
+                        self.dim = json.load(f)['dim']
+                rows = os.path.getsize(self._vectors_path) // (2 * self.dim)
+                if self._vectors is None or self._vectors.shape[0] < rows:
+                    self._vectors = np.memmap(self._vectors_path, dtype=np.float16, mode='r+',
+                                              shape=(rows, self.dim))
+                for line in data[:end].splitlines():
+                    self._append_entry(json.loads(line))
+                self._meta_offset += end
+
+        if os.path.exists(self._ivf_path) and os.path.getmtime(self._ivf_path) != self._ivf_mtime:
+            self._load_ivf()
+        elif self._centroids is not None and self._assigned < self.count:
+            # Assignments the other writers appended along with their rows
+            stored = np.fromfile(self._assign_path, dtype=np.int32, offset=4 * self._assigned) \
+                if os.path.exists(self._assign_path) else np.zeros(0, dtype=np.int32)
+            labels = stored[:self.count - self._assigned]
+            if self._assigned + len(labels) < self.count:
+                labels = np.concatenate([labels, self._assign_rows(
+                    self._vectors, self._assigned + len(labels), self.count, self._centroids)])
+            self._assign = _grown(self._assign, self.count)
+            self._assign[self._assigned:self.count] = labels
+            self._assigned = self.count
+            if self._assigned - self._listed > max(1024, self._listed // 10):
+                self._sort_lists()
+
+    def _load(self):
+        if not os.path.exists(self._meta_path):
+            return
+
+        if not os.path.exists(self._header_path) or not os.path.exists(self._vectors_path):
+            return
+        with open(self._header_path, 'r', encoding='utf-8') as f:
+            self.dim = json.load(f)['dim']
+
+        entries, torn = [], False
+        with open(self._meta_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    torn = True
+                    break
+        rows = os.path.getsize(self._vectors_path) // (2 * self.dim)
+        if torn or len(entries) > rows:
+            # Interrupted append: keep the rows that are complete on both sides
+            entries = entries[:rows]
+            with open(self._meta_path, 'w', encoding='utf-8') as f:
+                f.writelines(json.dumps(entry) + '\n' for entry in entries)
+        self._meta_offset = os.path.getsize(self._meta_path)
+        if not entries:
+            return
+
+        self._vectors = np.memmap(self._vectors_path, dtype=np.float16, mode='r+', shape=(rows, self.dim))
+        for entry in entries:
+            self._append_entry(entry)
+
+        if os.path.exists(self._ivf_path):
+            self._load_ivf()
+        logger.info(f"Loaded embedding index with {self.count} vectors from {self.root}")
+
+    def _load_ivf(self):
+        """Read the quantizer and its row assignments, computing any that are missing."""
+        self._ivf_mtime = os.path.getmtime(self._ivf_path)
+        self._centroids = np.load(self._ivf_path)
+        assign = np.fromfile(self._assign_path, dtype=np.int32) if os.path.exists(self._assign_path) else \
+            np.zeros(0, dtype=np.int32)
+        assign = assign[:self.count]
+        if len(assign) < self.count:
+            assign = np.concatenate([assign, self._assign_rows(self._vectors, len(assign), self.count,
+                                                               self._centroids)])
+            assign.tofile(self._assign_path)
+        self._assign, self._assigned = assign, len(assign)
+        self._sort_lists()
+        self._trained_count = max(self._trained_count, self.count)
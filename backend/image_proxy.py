@@ -0,0 +1,223 @@
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from blob_store import BlobStore, content_key
+from metrics import timed
+
+logger = logging.getLogger(__name__)
+
+_MAX_AGE = re.compile(r'max-age=(\d+)')
+
+# Raster formats the proxy serves; anything else (notably image/svg+xml, which
+# can carry script) is refused, since proxied bytes are served from our origin
+ALLOWED_CONTENT_TYPES = ('image/png', 'image/jpeg', 'image/webp', 'image/gif')
+
+
+class ProxyError(Exception):
+    """A remote image could not be served; ``status_code`` is the HTTP status to return."""
+
+    def __init__(self, message: str, status_code: int = 502):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class ImageProxy:
+    """Fetches remote images over one pooled session and keeps them on disk.
+
+    Bodies are cached under a key derived from the URL, with a ``.meta``
+    sidecar holding the content type and the ETag / Last-Modified
+    validators. A cached image is served as-is while fresh (the origin's
+    ``max-age``, else ``ttl``); after that it is revalidated with a
+    conditional GET. If revalidation fails the stale copy is served, since
+    signed DALL-E URLs expire long before the image changes. Downloads are
+    streamed and abandoned as soon as they exceed ``max_bytes``.
+    """
+
+    def __init__(self, store: Optional[BlobStore] = None, max_bytes: int = 20 * 1024 * 1024,
+                 timeout: float = 10.0, ttl: float = 3600.0, pool_size: int = 16):
+        self.store = store
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.ttl = ttl
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._prefetcher = ThreadPoolExecutor(max_workers=2, thread_name_prefix='image-prefetch')
+        self._inflight: Dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "ImageProxy":
+        """PROXY_CACHE_DIR (empty disables the disk cache), PROXY_CACHE_MAX_MB,
+        PROXY_MAX_BYTES, PROXY_TIMEOUT and PROXY_CACHE_TTL."""
+        store = None
+        root = os.getenv('PROXY_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'image-proxy-cache'))
+        if root:
+            try:
+                max_mb = float(os.getenv('PROXY_CACHE_MAX_MB', '512'))
+                store = BlobStore(root, max_bytes=int(max_mb * 1024 * 1024))
+            except OSError as e:
+                logger.warning(f"Image proxy cache disabled, cannot use {root}: {e}")
+
+        return cls(
+            store=store,
+            max_bytes=int(os.getenv('PROXY_MAX_BYTES', str(20 * 1024 * 1024))),
+            timeout=float(os.getenv('PROXY_TIMEOUT', '10')),
+            ttl=float(os.getenv('PROXY_CACHE_TTL', '3600'))
+        )
+
+    @timed('proxy_fetch')
+    def fetch(self, url: str) -> Tuple[bytes, str]:
+        """(bytes, Content-Type) for ``url``; raises ProxyError."""
+        key = content_key({'url': url})
+
+        # A prefetch of the same URL is already downloading; wait for it
+        with self._lock:
+            pending = self._inflight.get(key)
+        if pending is not None:
+            pending.wait(self.timeout)
+
+        cached = self._load(key)
+        # Entries cached before the type allowlist are downloaded (and checked) again
+        if cached is not None and cached[1].get('content_type') not in ALLOWED_CONTENT_TYPES:
+            cached = None
+        if cached is not None:
+            data, meta = cached
+            if time.time() < meta['fetched_at'] + meta['max_age']:
+                return data, meta['content_type']
+            try:
+                return self._download(url, key, cached)
+            except ProxyError as e:
+                logger.warning(f"Revalidation of {url} failed, serving cached copy: {e}")
+                return data, meta['content_type']
+
+        return self._download(url, key, None)
+
+    def prefetch(self, url: str):
+        """Download ``url`` into the cache in the background."""
+        if self.store is None:
+            return
+        key = content_key({'url': url})
+        with self._lock:
+            if key in self._inflight:
+                return
+            done = self._inflight[key] = threading.Event()
+
+        def run():
+            try:
+                if self._load(key) is None:
+                    self._download(url, key, None)
+            except Exception as e:
+                logger.info(f"Prefetch of {url} failed: {e}")
+            finally:
+                with self._lock:
+                    self._inflight.pop(key, None)
+                done.set()
+
+        self._prefetcher.submit(run)
+
+    def _download(self, url: str, key: str, cached: Optional[Tuple[bytes, Dict[str, Any]]],
+                  retried: bool = False) -> Tuple[bytes, str]:
+        """Fetch ``url`` (revalidating ``cached`` when given) and store it.
+
+        Upstream errors are not passed through as-is: a 404 stays a 404,
+        anything else becomes a 502, so an upstream 401/403 is never
+        mistaken for our own API rejecting the caller.
+        """
+        headers = {}
+        if retried:
+            headers['Cache-Control'] = 'no-cache'
+        elif cached is not None:
+            meta = cached[1]
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+
+        try:
+            with self.session.get(url, headers=headers, timeout=self.timeout, stream=True) as response:
+                if response.status_code == 304 and cached is not None:
+                    data, meta = cached
+                    meta.update(fetched_at=time.time(), max_age=self._max_age(response, meta['max_age']))
+                    self._save_meta(key, meta)
+                    return data, meta['content_type']
+
+                if response.status_code == 304 and not retried:
+                    # Nothing cached to revalidate against: ask again without conditions
+                    logger.info(f"Upstream answered 304 for {url} with no cached copy, retrying unconditionally")
+                    return self._download(url, key, None, retried=True)
+
+                if response.status_code != 200:
+                    status = 404 if response.status_code == 404 else 502
+                    raise ProxyError(f"Upstream returned {response.status_code}", status)
+
+                content_type = response.headers.get('Content-Type', '').split(';')[0].strip()
+                if content_type not in ALLOWED_CONTENT_TYPES:
+                    raise ProxyError(f"Unsupported image type: {content_type or 'unknown'}", 415)
+
+                declared = response.headers.get('Content-Length')
+                if declared and declared.isdigit() and int(declared) > self.max_bytes:
+                    raise ProxyError(f"Image larger than {self.max_bytes} bytes", 413)
+
+                chunks, size = [], 0
+                for chunk in response.iter_content(64 * 1024):
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise ProxyError(f"Image larger than {self.max_bytes} bytes", 413)
+                    chunks.append(chunk)
+                data = b''.join(chunks)
+
+                meta = {
+                    'url': url,
+                    'content_type': content_type,
+                    'etag': response.headers.get('ETag'),
+                    'last_modified': response.headers.get('Last-Modified'),
+                    'fetched_at': time.time(),
+                    'max_age': self._max_age(response, self.ttl)
+                }
+                cacheable = 'no-store' not in response.headers.get('Cache-Control', '')
+        except requests.exceptions.RequestException as e:
+            raise ProxyError(f"Failed to fetch image: {e}", 502)
+
+        if self.store is not None and cacheable:
+            self.store.put(key, data)
+            self._save_meta(key, meta)
+        return data, content_type
+
+    @staticmethod
+    def _max_age(response, default: float) -> float:
+        cache_control = response.headers.get('Cache-Control', '')
+        if 'no-cache' in cache_control or 'no-store' in cache_control:
+            return 0.0
+        match = _MAX_AGE.search(cache_control)
+        return float(match.group(1)) if match else default
+
+    def _load(self, key: str) -> Optional[Tuple[bytes, Dict[str, Any]]]:
+        if self.store is None:
+            return None
+        raw_meta = self.store.get(f"{key}.meta")
+        if raw_meta is None:
+            return None
+        data = self.store.get(key)
+        if data is None:
+            return None
+        try:
+            return data, json.loads(raw_meta)
+        except ValueError:
+            return None
+
+    def _save_meta(self, key: str, meta: Dict[str, Any]):
+        self.store.put(f"{key}.meta", json.dumps(meta).encode('utf-8'))
@@ -0,0 +1,118 @@
+import hashlib
+import logging
+import os
+import re
+import sys
+import tempfile
+from io import BytesIO
+from typing import Optional, Tuple
+
+from blob_store import BlobStore
+
+logger = logging.getLogger(__name__)
+
+# format name -> (PIL format, Content-Type)
+IMAGE_FORMATS = {
+    'png': ('PNG', 'image/png'),
+    'webp': ('WEBP', 'image/webp'),
+    'jpeg': ('JPEG', 'image/jpeg'),
+    'jpg': ('JPEG', 'image/jpeg'),
+}
+DEFAULT_QUALITY = 85
+# Browser cache lifetime of an image that may later be evicted, and of one that never is
+DEFAULT_MAX_AGE = 86400
+IMMUTABLE_MAX_AGE = 31536000
+
+_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+
+class ImageStore:
+    """Generated images kept on disk and served by ``/api/images/<id>``.
+
+    Originals are stored as PNG under the first 32 hex digits of their
+    sha256, so the same image always gets the same id and URL. WebP / JPEG
+    renditions are encoded on first request and stored next to the
+    original; everything shares one LRU byte budget.
+
+    An id's bytes never change, but an evicted (or wiped tempdir) image
+    stops resolving, so responses are only marked ``immutable`` when the
+    store is ``persistent``: a configured directory without eviction.
+    """
+
+    def __init__(self, store: BlobStore, persistent: bool = False, max_age: int = DEFAULT_MAX_AGE):
+        self.store = store
+        self.persistent = persistent
+        self.max_age = max_age
+
+    @classmethod
+    def from_env(cls) -> Optional["ImageStore"]:
+        """IMAGE_STORE_DIR (empty disables the store; unset uses a tempdir),
+        IMAGE_STORE_MAX_MB (0 never evicts) and IMAGE_CACHE_MAX_AGE (seconds,
+        for stores that may evict)."""
+        configured = os.getenv('IMAGE_STORE_DIR')
+        root = os.path.join(tempfile.gettempdir(), 'image-store') if configured is None else configured
+        if not root:
+            return None
+        max_mb = float(os.getenv('IMAGE_STORE_MAX_MB', '2048'))
+        max_bytes = int(max_mb * 1024 * 1024) if max_mb > 0 else sys.maxsize
+        try:
+            return cls(
+                BlobStore(root, max_bytes=max_bytes),
+                persistent=configured is not None and max_mb <= 0,
+                max_age=int(os.getenv('IMAGE_CACHE_MAX_AGE', str(DEFAULT_MAX_AGE)))
+            )
+        except OSError as e:
+            logger.warning(f"Image store disabled, cannot use {root}: {e}")
+            return None
+
+    @property
+    def cache_control(self) -> str:
+        """Cache-Control for ``/api/images/<id>`` responses."""
+        if self.persistent:
+            return f"public, max-age={IMMUTABLE_MAX_AGE}, immutable"
+        return f"public, max-age={self.max_age}"
+
+    @staticmethod
+    def is_valid_id(image_id: str) -> bool:
+        return bool(_ID_PATTERN.match(image_id))
+
+    @staticmethod
+    def url_for(image_id: str) -> str:
+        return f"/api/images/{image_id}"
+
+    def put_png(self, png: bytes) -> str:
+        """Store PNG bytes and return their id."""
+        image_id = hashlib.sha256(png).hexdigest()[:32]
+        if image_id not in self.store:
+            self.store.put(image_id, png)
+        return image_id
+
+    def get(self, image_id: str, fmt: str = 'png', quality: int = DEFAULT_QUALITY) -> Optional[Tuple[bytes, str]]:
+        """(bytes, Content-Type) of ``image_id`` in ``fmt``; None when unknown."""
+        pil_format, content_type = IMAGE_FORMATS[fmt]
+        if pil_format == 'PNG':
+            data = self.store.get(image_id)
+            return (data, content_type) if data is not None else None
+
+        variant_key = f"{image_id}.{pil_format.lower()}.q{quality}"
+        data = self.store.get(variant_key)
+        if data is not None:
+            return data, content_type
+
+        original = self.store.get(image_id)
+        if original is None:
+            return None
+        data = self._encode(original, pil_format, quality)
+        self.store.put(variant_key, data)
+        return data, content_type
+
+    @staticmethod
+    def _encode(png: bytes, pil_format: str, quality: int) -> bytes:
+        from PIL import Image
+
+        image = Image.open(BytesIO(png))
+        if pil_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        buffer = BytesIO()
+        image.save(buffer, format=pil_format, quality=quality)
+        return buffer.getvalue()
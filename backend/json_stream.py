@@ -0,0 +1,94 @@
+import json
+import logging
+from typing import Any, Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class JSONObjectStream:
+    """Incremental parser for a JSON object that arrives in pieces.
+
+    ``feed`` takes the next chunk of text and returns the top-level
+    ``(key, value)`` members that were completed by it, so a caller can
+    act on ``"color": {...}`` while the model is still writing the next
+    category. Only string, bracket and escape state is tracked while
+    scanning; each finished member is decoded once with ``json.loads``.
+
+    Text before the opening brace (whitespace, a ```json fence) and after
+    the closing one is ignored. A member that does not decode is logged
+    and skipped rather than failing the rest of the object.
+    """
+
+    def __init__(self):
+        self.result: Dict[str, Any] = {}
+        self.done = False
+        self._text = ''
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._member_start = None
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        if self.done or not chunk:
+            return []
+        self._text += chunk
+        members = []
+        text = self._text
+        for pos in range(self._pos, len(text)):
+            char = text[pos]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == '\\':
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+
+            if self._depth == 0:
+                if char == '{':
+                    self._depth = 1
+                    self._member_start = pos + 1
+                continue
+
+            if char == '"':
+                self._in_string = True
+            elif char in '{[':
+                self._depth += 1
+            elif char in '}]':
+                self._depth -= 1
+                if self._depth == 0:
+                    self._finish_member(text[self._member_start:pos], members)
+                    self.done = True
+                    break
+            elif char == ',' and self._depth == 1:
+                self._finish_member(text[self._member_start:pos], members)
+                self._member_start = pos + 1
+
+        # Everything before the current member has been consumed
+        if self._member_start is not None:
+            self._text = text[self._member_start:]
+            self._pos = len(text) - self._member_start
+            self._member_start = 0
+        else:
+            self._text = ''
+            self._pos = 0
+        return members
+
+    def close(self) -> Dict[str, Any]:
+        """The complete object; ValueError if the closing brace never arrived."""
+        if not self.done:
+            raise ValueError("JSON object ended before its closing brace")
+        return self.result
+
+    def _finish_member(self, member: str, members: List[Tuple[str, Any]]):
+        if not member.strip():
+            return
+        try:
+            (key, value), = json.loads('{' + member + '}').items()
+        except ValueError as e:
+            logger.warning(f"Skipping undecodable JSON member {member[:80]!r}: {e}")
+            return
+        self.result[key] = value
+        members.append((key, value))
@@ -0,0 +1,346 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from types import SimpleNamespace
+from typing import Any, Dict, Iterator, List, Optional
+
+from metrics import record_chat_completion
+
+logger = logging.getLogger(__name__)
+
+# Request arguments that never change the completion itself; a streamed
+# completion shares its entry with the same request made without streaming
+_NON_SEMANTIC_KWARGS = ('timeout', 'extra_headers', 'extra_query', 'user', 'stream', 'stream_options')
+
+
+class ResponseCache:
+    """LRU + TTL cache for chat completions with an optional SQLite backend.
+
+    The in-memory layer is per process; the SQLite file (when configured) is
+    shared between every worker pointed at the same path.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 3600.0, db_path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.db_path = db_path
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+        if self.db_path:
+            os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+            conn = self._connection()
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_expires ON responses(expires_at)")
+            conn.commit()
+            logger.info(f"LLM response cache persisted at {self.db_path}")
+
+    @classmethod
+    def from_env(cls) -> "ResponseCache":
+        """Build a cache from LLM_CACHE_SIZE / LLM_CACHE_TTL / LLM_CACHE_DB."""
+        return cls(
+            max_entries=int(os.getenv('LLM_CACHE_SIZE', '1024')),
+            ttl=float(os.getenv('LLM_CACHE_TTL', '3600')),
+            db_path=os.getenv('LLM_CACHE_DB') or None
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 and self.ttl > 0
+
+    @staticmethod
+    def make_key(request: Dict[str, Any]) -> str:
+        """Hash model, messages and sampling params into a stable key."""
+        relevant = {k: v for k, v in request.items() if k not in _NON_SEMANTIC_KWARGS}
+        payload = json.dumps(relevant, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def in_memory(self, key: str) -> bool:
+        """True when ``get`` would be answered without touching SQLite."""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and entry[0] > time.time()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+
+        value = self._db_get(key, now)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        self._remember(key, value, now + self.ttl)
+        return value
+
+    def set(self, key: str, value: Dict[str, Any]):
+        expires_at = time.time() + self.ttl
+        self._remember(key, value, expires_at)
+        self._db_set(key, value, expires_at)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        if self.db_path:
+            conn = self._connection()
+            conn.execute("DELETE FROM responses")
+            conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0
+            }
+
+    def _remember(self, key: str, value: Dict[str, Any], expires_at: float):
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=5.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _db_get(self, key: str, now: float) -> Optional[Dict[str, Any]]:
+        if not self.db_path:
+            return None
+        try:
+            row = self._connection().execute(
+                "SELECT value, expires_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or row[1] <= now:
+                return None
+            return json.loads(row[0])
+        except (sqlite3.Error, json.JSONDecodeError) as e:
+            logger.warning(f"LLM cache read failed: {e}")
+            return None
+
+    def _db_set(self, key: str, value: Dict[str, Any], expires_at: float):
+        if not self.db_path:
+            return
+        try:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value, default=str), expires_at)
+            )
+            conn.execute("DELETE FROM responses WHERE expires_at <= ?", (time.time(),))
+            conn.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"LLM cache write failed: {e}")
+
+
+def _dump_completion(completion) -> Dict[str, Any]:
+    if hasattr(completion, 'model_dump'):
+        return completion.model_dump()
+    return completion.dict()
+
+
+def _load_completion(data: Dict[str, Any]):
+    from openai.types.chat import ChatCompletion
+    return ChatCompletion.construct(**data)
+
+
+def _replay_stream(data: Dict[str, Any]) -> Iterator[Any]:
+    """A cached completion as a stream: a single chunk carrying the whole message."""
+    from openai.types.chat import ChatCompletionChunk
+    choice = data['choices'][0]
+    yield ChatCompletionChunk.construct(
+        id=data.get('id'),
+        object='chat.completion.chunk',
+        created=data.get('created'),
+        model=data.get('model'),
+        choices=[{
+            'index': 0,
+            'delta': {'role': 'assistant', 'content': choice['message'].get('content')},
+            'finish_reason': choice.get('finish_reason')
+        }]
+    )
+
+
+def _completion_from_chunks(chunks: List[Any]) -> Dict[str, Any]:
+    """Reassemble streamed chunks into the dict form of a ChatCompletion."""
+    content, finish_reason, usage = [], None, None
+    for chunk in chunks:
+        if getattr(chunk, 'usage', None) is not None:
+            usage = _dump_completion(chunk.usage)
+        for choice in chunk.choices or []:
+            if choice.delta.content:
+                content.append(choice.delta.content)
+            finish_reason = choice.finish_reason or finish_reason
+    first = chunks[0] if chunks else None
+    return {
+        'id': getattr(first, 'id', None),
+        'object': 'chat.completion',
+        'created': getattr(first, 'created', None),
+        'model': getattr(first, 'model', None),
+        'choices': [{
+            'index': 0,
+            'message': {'role': 'assistant', 'content': ''.join(content)},
+            'finish_reason': finish_reason
+        }],
+        'usage': usage
+    }
+
+
+class LazyOpenAI:
+    """Defers importing the OpenAI SDK and building the client until first use.
+
+    ``asynchronous=True`` builds an ``AsyncOpenAI`` client instead.
+    """
+
+    def __init__(self, asynchronous: bool = False, **client_kwargs):
+        self._asynchronous = asynchronous
+        self._client_kwargs = client_kwargs
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._client is not None
+
+    def load(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    if self._asynchronous:
+                        from openai import AsyncOpenAI as client_class
+                    else:
+                        from openai import OpenAI as client_class
+                    self._client = client_class(**self._client_kwargs)
+        return self._client
+
+    def __getattr__(self, name):
+        return getattr(self.load(), name)
+
+
+class CachedOpenAI:
+    """Drop-in wrapper around an OpenAI client that caches chat completions.
+
+    Only ``chat.completions.create`` is intercepted; every other attribute
+    (``images``, ``models`` ...) is forwarded to the wrapped client.
+    Streamed requests are cached once their stream has finished normally
+    and replayed from the cache as a one-chunk stream.
+    """
+
+    def __init__(self, client, cache: Optional[ResponseCache] = None):
+        self._client = client
+        self.cache = cache if cache is not None else ResponseCache.from_env()
+        self.chat = SimpleNamespace(
+            completions=SimpleNamespace(create=self._create_chat_completion)
+        )
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def _is_cacheable(self, kwargs: Dict[str, Any]) -> bool:
+        return self.cache.enabled and kwargs.get('n', 1) == 1
+
+    def _create_chat_completion(self, **kwargs):
+        streaming = bool(kwargs.get('stream'))
+        if not self._is_cacheable(kwargs):
+            completion = self._client.chat.completions.create(**kwargs)
+            if streaming:
+                return self._recorded_stream(kwargs.get('model'), completion, None)
+            record_chat_completion(kwargs.get('model'), completion, 'uncached')
+            return completion
+
+        key = self.cache.make_key(kwargs)
+        cached = self.cache.get(key)
+        if cached is not None:
+            logger.info(f"LLM cache hit for model {kwargs.get('model')}")
+            record_chat_completion(kwargs.get('model'), None, 'hit')
+            return _replay_stream(cached) if streaming else _load_completion(cached)
+
+        completion = self._client.chat.completions.create(**kwargs)
+        if streaming:
+            return self._recorded_stream(kwargs.get('model'), completion, key)
+        record_chat_completion(kwargs.get('model'), completion, 'miss')
+        self.cache.set(key, _dump_completion(completion))
+        return completion
+
+    def _recorded_stream(self, model: str, stream, key: Optional[str]) -> Iterator[Any]:
+        """Pass chunks through; when the stream completes, record its usage and
+        cache it under ``key``. Streams closed early or cut off are not cached."""
+        chunks = []
+        try:
+            for chunk in stream:
+                chunks.append(chunk)
+                yield chunk
+        finally:
+            close = getattr(stream, 'close', None)
+            if close is not None:
+                close()
+
+        completion = _completion_from_chunks(chunks)
+        record_chat_completion(model, _load_completion(completion), 'uncached' if key is None else 'miss')
+        if key is not None and completion['choices'][0]['finish_reason'] == 'stop':
+            self.cache.set(key, completion)
+
+
+class CachedAsyncOpenAI(CachedOpenAI):
+    """Async counterpart of :class:`CachedOpenAI`; pass the same cache to share hits.
+
+    The event loop is shared by every in-flight request, so SQLite reads
+    and writes (which can wait out another worker's lock for seconds) run
+    in the loop's default executor; in-memory hits are answered inline.
+    """
+
+    async def _create_chat_completion(self, **kwargs):
+        # Streams are passed through uncached here
+        if kwargs.get('stream') or not self._is_cacheable(kwargs):
+            completion = await self._client.chat.completions.create(**kwargs)
+            record_chat_completion(kwargs.get('model'), completion, 'uncached')
+            return completion
+
+        loop = asyncio.get_running_loop()
+        key = self.cache.make_key(kwargs)
+        if self.cache.db_path and not self.cache.in_memory(key):
+            cached = await loop.run_in_executor(None, self.cache.get, key)
+        else:
+            cached = self.cache.get(key)
+        if cached is not None:
+            logger.info(f"LLM cache hit for model {kwargs.get('model')}")
+            record_chat_completion(kwargs.get('model'), None, 'hit')
+            return _load_completion(cached)
+
+        completion = await self._client.chat.completions.create(**kwargs)
+        record_chat_completion(kwargs.get('model'), completion, 'miss')
+        if self.cache.db_path:
+            # Written in the background; the response does not wait for SQLite
+            loop.run_in_executor(None, self.cache.set, key, _dump_completion(completion))
+        else:
+            self.cache.set(key, _dump_completion(completion))
+        return completion
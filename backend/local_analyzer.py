@@ -0,0 +1,175 @@
+import json
+import logging
+import os
+import re
+import threading
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Curated descriptors for the nine feature categories of AIService.feature_types.
+# LOCAL_ANALYSIS_VOCABULARY may point to a JSON file of the same shape to replace them.
+DESCRIPTOR_VOCABULARY: Dict[str, List[str]] = {
+    'color': [
+        'red', 'crimson', 'scarlet', 'orange', 'amber', 'gold', 'yellow', 'green', 'emerald', 'teal',
+        'turquoise', 'blue', 'navy', 'cobalt', 'purple', 'violet', 'magenta', 'pink', 'brown', 'silver',
+        'white', 'black', 'black and white', 'monochrome', 'sepia', 'pastel', 'neon', 'vibrant',
+        'muted', 'earth tones', 'warm tones', 'cool tones',
+    ],
+    'style': [
+        'photorealistic', 'impressionist', 'expressionist', 'surrealist', 'cubist', 'abstract',
+        'art nouveau', 'art deco', 'baroque', 'renaissance', 'gothic', 'minimalist', 'pop art',
+        'watercolor', 'oil painting', 'pencil sketch', 'ink drawing', 'charcoal drawing', 'digital art',
+        '3d render', 'pixel art', 'low poly', 'anime', 'comic book', 'ukiyo-e', 'cyberpunk',
+        'steampunk', 'vaporwave', 'fantasy art', 'concept art', 'cinematic', 'vintage photograph',
+    ],
+    'composition': [
+        'centered', 'symmetrical', 'asymmetrical', 'rule of thirds', 'golden ratio', 'leading lines',
+        'diagonal', 'framed', 'layered depth', 'negative space', 'cluttered', 'close-up', 'macro',
+        'wide shot', 'panoramic', 'full body', 'group shot', 'silhouette', 'foreground focus',
+    ],
+    'lighting': [
+        'golden hour', 'blue hour', 'sunrise', 'sunset', 'midday sun', 'overcast', 'moonlight',
+        'candlelight', 'neon lights', 'studio lighting', 'soft light', 'harsh light', 'backlit',
+        'rim light', 'volumetric light', 'god rays', 'dramatic shadows', 'chiaroscuro', 'low key',
+        'high key', 'ambient glow', 'bioluminescent',
+    ],
+    'mood': [
+        'serene', 'peaceful', 'calm', 'cozy', 'joyful', 'playful', 'whimsical', 'dreamy', 'romantic',
+        'hopeful', 'nostalgic', 'melancholic', 'lonely', 'somber', 'mysterious', 'eerie', 'ominous',
+        'dark', 'tense', 'chaotic', 'energetic', 'dramatic', 'epic', 'majestic',
+    ],
+    'object': [
+        'person', 'woman', 'man', 'child', 'crowd', 'cat', 'dog', 'horse', 'bird', 'fox', 'wolf',
+        'deer', 'lion', 'fish', 'dragon', 'robot', 'car', 'motorcycle', 'bicycle', 'train', 'ship',
+        'boat', 'airplane', 'spaceship', 'house', 'castle', 'tower', 'lighthouse', 'bridge', 'city',
+        'street', 'skyscraper', 'ruins', 'tree', 'forest', 'flower', 'garden', 'mountain', 'river',
+        'lake', 'ocean', 'beach', 'waterfall', 'desert', 'snow', 'clouds', 'moon', 'sun', 'stars',
+        'planet', 'galaxy', 'fire', 'rain', 'road', 'table', 'food', 'fruit', 'book', 'sword', 'crown',
+    ],
+    'perspective': [
+        'eye level', "bird's eye view", 'aerial view', "worm's eye view", 'low angle', 'high angle',
+        'top-down view', 'isometric', 'first person view', 'over the shoulder', 'side view',
+        'front view', 'wide angle', 'fisheye', 'telephoto', 'one-point perspective',
+    ],
+    'detail': [
+        'highly detailed', 'intricate', 'ultra detailed', 'fine detail', 'sharp focus',
+        'hyperrealistic', '8k resolution', 'simple', 'minimal detail', 'rough sketch',
+        'loose brushwork', 'soft focus', 'bokeh', 'grainy',
+    ],
+    'texture': [
+        'smooth', 'rough', 'glossy', 'matte', 'metallic', 'rusty', 'wooden', 'stone', 'marble',
+        'glass', 'velvet', 'silk', 'fur', 'feathered', 'leathery', 'wet', 'cracked', 'weathered',
+        'crystalline', 'fluffy', 'knitted',
+    ],
+}
+
+# How each descriptor is phrased before CLIP encodes it
+DESCRIPTOR_TEMPLATES = {
+    'color': '{term} colors',
+    'style': '{term} style',
+    'composition': '{term} composition',
+    'lighting': '{term} lighting',
+    'mood': 'a {term} mood',
+    'object': 'a picture of a {term}',
+    'perspective': '{term}',
+    'detail': '{term}',
+    'texture': '{term} texture',
+}
+
+# Prompts that say nothing in particular; a descriptor's mean similarity to
+# them is its baseline, so generically "close to everything" phrases don't win
+NEUTRAL_PROMPTS = ('an image', 'a picture', 'a photo', 'a scene', 'something')
+
+# Score of a descriptor that the prompt names literally
+LITERAL_SCORE = 0.9
+
+
+class LocalFeatureAnalyzer:
+    """Prompt feature analysis without GPT: the prompt's CLIP text embedding
+    is scored against precomputed embeddings of a curated vocabulary.
+
+    For every descriptor the similarity to the prompt minus its baseline
+    (similarity to a few neutral prompts) is turned into a z-score over the
+    whole vocabulary. Descriptors at least ``min_z`` standard deviations
+    above the mean are kept, at most ``top_k`` per category, scored 0.5 at
+    the threshold and rising with the z-score. Descriptors the prompt names
+    literally are always kept with LITERAL_SCORE. Categories without a
+    kept descriptor are left out, as in the GPT analysis.
+
+    Descriptor embeddings are computed once by ``prepare``; afterwards an
+    analysis is one matrix-vector product plus the prompt's own encoding.
+    """
+
+    def __init__(self, vocabulary: Optional[Dict[str, List[str]]] = None, top_k: int = 3, min_z: float = 3.0):
+        self.vocabulary = {category: list(terms) for category, terms in (vocabulary or DESCRIPTOR_VOCABULARY).items()}
+        self.top_k = top_k
+        self.min_z = min_z
+        self._categories = [category for category, terms in self.vocabulary.items() for _ in terms]
+        self._terms = [term for terms in self.vocabulary.values() for term in terms]
+        self._patterns = [re.compile(r'\b' + re.escape(term.lower()) + r'(?:s|es)?\b') for term in self._terms]
+        self._embeddings: Optional[np.ndarray] = None
+        self._baseline: Optional[np.ndarray] = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "LocalFeatureAnalyzer":
+        """LOCAL_ANALYSIS_TOP_K, LOCAL_ANALYSIS_MIN_Z and LOCAL_ANALYSIS_VOCABULARY (JSON file)."""
+        vocabulary = None
+        path = os.getenv('LOCAL_ANALYSIS_VOCABULARY')
+        if path:
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    vocabulary = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Ignoring LOCAL_ANALYSIS_VOCABULARY {path}: {e}")
+        return cls(
+            vocabulary=vocabulary,
+            top_k=int(os.getenv('LOCAL_ANALYSIS_TOP_K', '3')),
+            min_z=float(os.getenv('LOCAL_ANALYSIS_MIN_Z', '3.0'))
+        )
+
+    @property
+    def ready(self) -> bool:
+        return self._embeddings is not None
+
+    def prepare(self, encode_texts: Callable[[List[str]], np.ndarray], batch_size: int = 128):
+        """Encode the vocabulary once; ``encode_texts`` returns L2-normalized rows."""
+        with self._lock:
+            if self._embeddings is not None:
+                return
+            phrases = [DESCRIPTOR_TEMPLATES.get(category, '{term}').format(term=term)
+                       for category, term in zip(self._categories, self._terms)]
+            embeddings = np.concatenate([
+                np.asarray(encode_texts(phrases[start:start + batch_size]), dtype=np.float32)
+                for start in range(0, len(phrases), batch_size)
+            ])
+            neutral = np.asarray(encode_texts(list(NEUTRAL_PROMPTS)), dtype=np.float32)
+            self._baseline = (embeddings @ neutral.T).mean(axis=1)
+            self._embeddings = embeddings
+            logger.info(f"Local analyzer prepared {len(phrases)} descriptors")
+
+    def analyze(self, prompt: str, embedding: np.ndarray) -> Dict[str, Dict[str, float]]:
+        """``{category: {term: score}}`` for ``prompt`` given its normalized CLIP text embedding."""
+        if self._embeddings is None:
+            raise RuntimeError("LocalFeatureAnalyzer.prepare() has not been called")
+
+        lift = self._embeddings @ np.asarray(embedding, dtype=np.float32).reshape(-1) - self._baseline
+        z = (lift - lift.mean()) / (lift.std() or 1.0)
+        text = prompt.lower()
+
+        candidates: Dict[str, List] = {}
+        for index, (category, term) in enumerate(zip(self._categories, self._terms)):
+            literal = self._patterns[index].search(text) is not None
+            if not literal and z[index] < self.min_z:
+                continue
+            score = min(0.85, 0.5 + 0.1 * float(z[index] - self.min_z))
+            candidates.setdefault(category, []).append((LITERAL_SCORE if literal else score, term))
+
+        result = {}
+        for category, scored in candidates.items():
+            scored.sort(reverse=True)
+            result[category] = {term: round(score, 3) for score, term in scored[:self.top_k]}
+        return result
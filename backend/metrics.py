@@ -0,0 +1,249 @@
+import bisect
+import contextvars
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Seconds; spans cache hits (ms) up to CPU Stable Diffusion runs (minutes)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return self.header() + [
+            f"{self.name}{_labels(self.labelnames, key)} {_format(value)}" for key, value in items
+        ]
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts (+Inf last), sum, count]
+        self._values: Dict[LabelValues, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = [(key, list(counts), total, count) for key, (counts, total, count) in self._values.items()]
+
+        lines = self.header()
+        for key, counts, total, count in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = _labels(self.labelnames, key, f'le="{_format(bound)}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_format(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class CallbackMetric(_Metric):
+    """Counter or gauge whose samples are read from ``collect()`` at scrape time."""
+
+    def __init__(self, name: str, documentation: str, metric_type: str, labelnames: Sequence[str],
+                 collect: Callable[[], Iterable[Tuple[LabelValues, float]]]):
+        super().__init__(name, documentation, labelnames)
+        self.type = metric_type
+        self.collect = collect
+
+    def render(self) -> List[str]:
+        try:
+            samples = list(self.collect())
+        except Exception as e:
+            logger.warning(f"Collecting {self.name} failed: {e}")
+            samples = []
+        return self.header() + [
+            f"{self.name}{_labels(self.labelnames, key)} {_format(value)}" for key, value in samples
+        ]
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def callback(self, name: str, documentation: str, metric_type: str, labelnames: Sequence[str],
+                 collect: Callable[[], Iterable[Tuple[LabelValues, float]]]) -> CallbackMetric:
+        """Register (or replace) a metric read from ``collect`` on every scrape."""
+        metric = CallbackMetric(name, documentation, metric_type, labelnames, collect)
+        with self._lock:
+            self._metrics[name] = metric
+        return metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+metrics = MetricsRegistry()
+
+STAGE_SECONDS = metrics.histogram(
+    'pipeline_stage_seconds', 'Time spent in each pipeline stage', ['stage']
+)
+STAGE_ERRORS = metrics.counter(
+    'pipeline_stage_errors_total', 'Pipeline stages that raised', ['stage']
+)
+HTTP_REQUEST_SECONDS = metrics.histogram(
+    'http_request_seconds', 'HTTP request latency by route', ['endpoint', 'method', 'status']
+)
+LLM_REQUESTS = metrics.counter(
+    'llm_requests_total', 'Chat completion requests by model and cache outcome', ['model', 'cache']
+)
+LLM_TOKENS = metrics.counter(
+    'llm_tokens_total', 'Tokens billed by the chat API (cache hits are not counted)', ['model', 'type']
+)
+
+
+_current_stage: contextvars.ContextVar = contextvars.ContextVar('pipeline_stage', default=None)
+
+
+def current_stage() -> Optional[str]:
+    """Innermost ``timed`` stage of the running thread or task, or None."""
+    return _current_stage.get()
+
+
+@contextmanager
+def timed(stage: str):
+    """Record the duration of the enclosed block under ``stage``; exceptions are counted and re-raised.
+
+    The stage is also visible to code inside the block via ``current_stage()``.
+    """
+    started = time.perf_counter()
+    token = _current_stage.set(stage)
+    try:
+        yield
+    except BaseException:
+        STAGE_ERRORS.inc(stage=stage)
+        raise
+    finally:
+        _current_stage.reset(token)
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage=stage)
+
+
+def record_chat_completion(model: str, completion, cache: str):
+    """Count one chat completion and, unless it came from the cache, its token usage."""
+    LLM_REQUESTS.inc(model=model, cache=cache)
+    if cache == 'hit':
+        return
+    usage = getattr(completion, 'usage', None)
+    if usage is None:
+        return
+    LLM_TOKENS.inc(getattr(usage, 'prompt_tokens', 0) or 0, model=model, type='prompt')
+    LLM_TOKENS.inc(getattr(usage, 'completion_tokens', 0) or 0, model=model, type='completion')
+
+
+def register_cache_stats(sources: Dict[str, Callable[[], Dict]]):
+    """Expose ``stats()`` dicts (hits / misses / entries / bytes) of named caches."""
+    def counts():
+        for name, stats in sources.items():
+            s = stats()
+            for field, result in (('hits', 'hit'), ('misses', 'miss')):
+                if field in s:
+                    yield (name, result), s[field]
+
+    def sizes(field):
+        def collect():
+            for name, stats in sources.items():
+                s = stats()
+                if field in s:
+                    yield (name,), s[field]
+        return collect
+
+    metrics.callback('cache_lookups_total', 'Cache lookups by cache and result', 'counter',
+                     ['cache', 'result'], counts)
+    metrics.callback('cache_entries', 'Entries currently held per cache', 'gauge',
+                     ['cache'], sizes('entries'))
+    metrics.callback('cache_bytes', 'Bytes currently held per cache', 'gauge',
+                     ['cache'], sizes('bytes'))
@@ -0,0 +1,119 @@
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+CLIP_MODEL_ID = "openai/clip-vit-base-patch32"
+
+
+class ModelUnavailableError(RuntimeError):
+    """Raised instead of loading while a failed model waits out its backoff."""
+
+
+class ModelRegistry:
+    """Process-wide store that loads each model at most once.
+
+    Every key has its own lock, so concurrent first requests for the same
+    model wait for a single load while unrelated models load in parallel.
+    A loader that raises leaves nothing behind; the key is retried on a
+    later access once its backoff (``retry_base`` seconds, doubling per
+    consecutive failure up to ``retry_max``) has passed. Until then
+    ``get`` raises ModelUnavailableError without calling the loader.
+
+    ``status`` reports pending / loading / ready / failed per key; it only
+    changes while the key's lock is held.
+    """
+
+    def __init__(self, retry_base: float = 5.0, retry_max: float = 300.0):
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self._models: Dict[str, Any] = {}
+        self._status: Dict[str, str] = {}
+        # key -> (consecutive failures, time.monotonic() of the next allowed attempt)
+        self._failures: Dict[str, Tuple[int, float]] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str, loader: Callable[[], Any]) -> Any:
+        model = self._models.get(key)
+        if model is not None:
+            return model
+        self._check_backoff(key)
+
+        with self._lock:
+            key_lock = self._locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            model = self._models.get(key)
+            if model is not None:
+                return model
+            self._check_backoff(key)
+
+            logger.info(f"Loading model {key}")
+            self._status[key] = 'loading'
+            try:
+                model = loader()
+            except Exception as e:
+                failures = self._failures.get(key, (0, 0.0))[0] + 1
+                delay = min(self.retry_max, self.retry_base * 2 ** (failures - 1))
+                self._failures[key] = (failures, time.monotonic() + delay)
+                self._status[key] = 'failed'
+                logger.warning(f"Loading model {key} failed ({failures} in a row), retrying in {delay:g}s: {e}")
+                raise
+            self._models[key] = model
+            self._failures.pop(key, None)
+            self._status[key] = 'ready'
+            return model
+
+    def _check_backoff(self, key: str):
+        failures, retry_at = self._failures.get(key, (0, 0.0))
+        wait = retry_at - time.monotonic()
+        if wait > 0:
+            raise ModelUnavailableError(f"Model {key} failed to load {failures} time(s); next retry in {wait:.0f}s")
+
+    def status(self, key: str) -> str:
+        return self._status.get(key, 'pending')
+
+    def retry_due(self, key: str) -> bool:
+        """True when the key is not loaded and a load may be attempted now."""
+        return key not in self._models and self._failures.get(key, (0, 0.0))[1] <= time.monotonic()
+
+    def is_loaded(self, key: str) -> bool:
+        return key in self._models
+
+    def keys(self) -> List[str]:
+        return list(self._models.keys())
+
+    def unload(self, key: str):
+        with self._lock:
+            self._models.pop(key, None)
+            self._status.pop(key, None)
+            self._failures.pop(key, None)
+
+
+registry = ModelRegistry(
+    retry_base=float(os.getenv('MODEL_RETRY_BASE_SECONDS', '5')),
+    retry_max=float(os.getenv('MODEL_RETRY_MAX_SECONDS', '300'))
+)
+
+
+def clip_key(device: str, model_id: str = CLIP_MODEL_ID) -> str:
+    return f"clip:{model_id}:{device}"
+
+
+def get_clip(device: str, model_id: str = CLIP_MODEL_ID) -> Tuple[Any, Any]:
+    """Shared (CLIPModel, CLIPProcessor) pair for ``device``."""
+    def _load():
+        from transformers import CLIPProcessor, CLIPModel
+
+        model = CLIPModel.from_pretrained(model_id)
+        processor = CLIPProcessor.from_pretrained(model_id)
+        model.to(device)
+        model.eval()
+        logger.info(f"CLIP model {model_id} loaded on {device}")
+        return model, processor
+
+    return registry.get(clip_key(device, model_id), _load)
@@ -0,0 +1,174 @@
+from typing import Any, Dict, List, Tuple
+
+
+def summarize_interpolation_features(features: Dict[str, Any]) -> Tuple[List[str], str]:
+    """把前端传来的 features 整理成摘要列表和拼接字符串"""
+    feature_summary = []
+    combined_features_str = ""
+
+    for feature_id, feature_data in features.items():
+        weight = feature_data.get('weight', 0.5)
+        feature_dict = feature_data.get('features', {})
+
+        if not feature_dict:
+            continue
+
+        feature_desc = ", ".join([f"{k} ({v:.0%})" for k, v in feature_dict.items()])
+        feature_summary.append(f"{feature_desc} (weight: {weight:.0%})")
+        combined_features_str += f"Feature {feature_id}: {feature_desc} with weight {weight:.0%}; "
+
+    return feature_summary, combined_features_str
+
+
+def compose_interpolation_request(features_str: str) -> Dict[str, Any]:
+    """
+    第一步 GPT：把feature信息融合成一个初步、合理的图像描述Prompt
+    """
+    system_prompt = f"""
+    You are an assistant that combines multiple visual features into a cohesive image prompt.
+
+    Features: {features_str}
+
+    Requirements:
+    1. Return a single concise sentence or short paragraph describing an image that blends all these features.
+    2. Avoid any phrases like "Generating...", "Sure, here it is", etc.
+    3. Only return the prompt itself (no JSON needed here).
+    """
+
+    return dict(
+        model="gpt-4o-mini",
+        messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": "Compose the image prompt from these features."}
+        ],
+        temperature=0.7,
+        max_tokens=200
+    )
+
+
+def refine_interpolation_request(base_prompt: str) -> Dict[str, Any]:
+    """
+    第二步 GPT：对初步Prompt做一次语言润色/扩展，让它更吸引人或更详细
+    但仍然避免输出无关多余话。
+    """
+    system_prompt = f"""
+    Refine the following image prompt to be more descriptive, artistic, and vivid,
+    but still concise. Return only the refined prompt text, nothing else.
+
+    Original prompt: {base_prompt}
+    """
+
+    return dict(
+        model="gpt-4o-mini",
+        messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": "Please refine the prompt with synonyms or added flair."}
+        ],
+        temperature=0.7,
+        max_tokens=200
+    )
+
+
+def refine_generation_request(user_prompt: str) -> Dict[str, Any]:
+    """
+    使用GPT对用户传来的prompt做一次语言润色或更多“人性化”调整。
+    """
+    system_prompt = f"""
+    Refine the user's prompt to be more descriptive and vivid for an image generation system.
+    Avoid extra text like 'Generating...' or disclaimers.
+    Return only the refined prompt text itself.
+
+    Original prompt: {user_prompt}
+    """
+
+    return dict(
+        model="gpt-4o-mini",
+        messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": "Please refine the prompt with synonyms or added flair."}
+        ],
+        temperature=0.7,
+        max_tokens=200
+    )
+
+
+FUSED_OUTPUT_FORMAT = """
+    Output Format Requirements:
+    Return ONLY a JSON object with exactly two keys:
+    {
+        "prompt": "<the final image prompt text>",
+        "analysis": {
+            "<category>": {"<term>": <confidence score>}
+        }
+    }
+
+    "analysis" describes the visual elements of YOUR final prompt.
+    Categories to analyze:
+    - color (Color palette and tones)
+    - style (Artistic style and technique)
+    - composition (Layout and arrangement)
+    - lighting (Light and shadow effects)
+    - mood (Emotional atmosphere)
+    - object (Any subject or entity in the scene: cars, people, animals, etc.)
+    - perspective (Viewpoint and depth)
+    - detail (Level of detail and complexity)
+    - texture (Surface qualities)
+
+    Rules:
+    1. Include ONLY categories where features are clearly present
+    2. Each term MUST have a single numeric score (0.0-1.0)
+    3. Be specific and precise in terminology
+    4. Do NOT use lists or complex objects for scores
+    """
+
+
+def fused_interpolation_request(features_str: str) -> Dict[str, Any]:
+    """
+    合并模式：一次 GPT 调用完成 融合 + 润色 + 特征分析
+    """
+    system_prompt = f"""
+    You are an assistant that combines multiple visual features into a cohesive image prompt.
+
+    Features: {features_str}
+
+    Requirements:
+    1. Write a prompt describing an image that blends all these features.
+    2. Make it descriptive, artistic, and vivid, but still concise.
+    3. Avoid any phrases like "Generating...", "Sure, here it is", etc.
+    {FUSED_OUTPUT_FORMAT}
+    """
+
+    return dict(
+        model="gpt-4o-mini",
+        messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": "Compose the image prompt from these features and analyze it."}
+        ],
+        temperature=0.7,
+        max_tokens=1000,
+        response_format={"type": "json_object"}
+    )
+
+
+def fused_generation_request(user_prompt: str) -> Dict[str, Any]:
+    """
+    合并模式：一次 GPT 调用完成 润色 + 特征分析
+    """
+    system_prompt = f"""
+    Refine the user's prompt to be more descriptive and vivid for an image generation system.
+    Avoid extra text like 'Generating...' or disclaimers.
+
+    Original prompt: {user_prompt}
+    {FUSED_OUTPUT_FORMAT}
+    """
+
+    return dict(
+        model="gpt-4o-mini",
+        messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": "Please refine the prompt with synonyms or added flair and analyze it."}
+        ],
+        temperature=0.7,
+        max_tokens=1000,
+        response_format={"type": "json_object"}
+    )
@@ -0,0 +1,238 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Optional, Tuple
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Requests and tokens per minute for every model the app calls. The
+# defaults are conservative low-tier limits; set OPENAI_RATE_LIMITS to the
+# account's real ones (``{"gpt-4o-mini": {"rpm": 5000, "tpm": 2000000}}``,
+# ``null`` removes a model's budget). Models without a budget are not throttled.
+RATE_LIMITS: Dict[str, Dict[str, float]] = {
+    'gpt-4o-mini': {'rpm': 500, 'tpm': 200000},
+    'dall-e-2': {'rpm': 50},
+    'dall-e-3': {'rpm': 50},
+}
+
+# Served in this order; within one priority, first come first served
+PRIORITIES = ('interactive', 'bulk')
+# Completion tokens assumed when a request does not set max_tokens
+DEFAULT_COMPLETION_TOKENS = 256
+# Async waiters that are not at the head of their queue re-check this often
+ASYNC_POLL_SECONDS = 0.02
+
+OPENAI_QUEUE_SECONDS = metrics.histogram(
+    'openai_scheduler_wait_seconds', 'Time OpenAI calls waited for rate-limit budget',
+    ['model', 'priority']
+)
+
+_priority: contextvars.ContextVar = contextvars.ContextVar('llm_priority', default='interactive')
+
+
+def current_priority() -> str:
+    return _priority.get()
+
+
+@contextmanager
+def priority(level: str):
+    """Run the enclosed calls at ``level`` ('interactive' or 'bulk')."""
+    if level not in PRIORITIES:
+        raise ValueError(f"Unknown priority {level}; expected one of {', '.join(PRIORITIES)}")
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def estimate_tokens(request: Dict[str, Any]) -> int:
+    """Token cost of a chat request as the provider counts it against TPM:
+    prompt length (~4 characters per token) plus the max_tokens it may generate."""
+    messages = request.get('messages') or []
+    chars = sum(len(str(message.get('content') or '')) for message in messages)
+    return chars // 4 + 4 * len(messages) + int(request.get('max_tokens') or DEFAULT_COMPLETION_TOKENS)
+
+
+class TokenBucket:
+    """Refills at ``per_minute / 60`` per second up to ``burst_seconds`` worth of budget."""
+
+    def __init__(self, per_minute: float, burst_seconds: float = 10.0):
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self.level = self.capacity
+        self._updated = time.monotonic()
+
+    def wait_time(self, cost: float, now: float) -> float:
+        """Seconds until ``cost`` can be taken; costs above capacity only need a full bucket."""
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+        missing = min(cost, self.capacity) - self.level
+        return max(0.0, missing / self.rate)
+
+    def take(self, cost: float):
+        # The full cost is charged, so an oversized request delays the ones after it
+        self.level -= cost
+
+
+class _ModelBudget:
+    def __init__(self, rpm: Optional[float], tpm: Optional[float], burst_seconds: float):
+        self.requests = TokenBucket(rpm, burst_seconds) if rpm else None
+        self.tokens = TokenBucket(tpm, burst_seconds) if tpm else None
+        # (priority rank, arrival) of every waiting call; the smallest goes next
+        self.queue: list = []
+
+    def wait_time(self, tokens: int, now: float) -> float:
+        waits = [0.0]
+        if self.requests:
+            waits.append(self.requests.wait_time(1, now))
+        if self.tokens and tokens:
+            waits.append(self.tokens.wait_time(tokens, now))
+        return max(waits)
+
+    def take(self, tokens: int):
+        if self.requests:
+            self.requests.take(1)
+        if self.tokens and tokens:
+            self.tokens.take(tokens)
+
+
+class RateLimitScheduler:
+    """Holds outbound OpenAI calls until their model's RPM and TPM token
+    buckets can pay for them.
+
+    Calls queue per model and are released strictly by priority (every
+    waiting 'interactive' call before any 'bulk' one), then by arrival.
+    Bursts are smoothed rather than rejected: a call only fails when its
+    own ``timeout`` passes while it is still queued. The priority comes
+    from the ``priority()`` context of the caller.
+    """
+
+    def __init__(self, limits: Optional[Dict[str, Dict[str, float]]] = None, burst_seconds: float = 10.0):
+        self._budgets = {
+            model: _ModelBudget(limit.get('rpm'), limit.get('tpm'), burst_seconds)
+            for model, limit in (RATE_LIMITS if limits is None else limits).items() if limit
+        }
+        self._arrivals = itertools.count()
+        self._cond = threading.Condition()
+
+    @classmethod
+    def from_env(cls) -> "RateLimitScheduler":
+        """RATE_LIMITS merged with OPENAI_RATE_LIMITS (JSON); OPENAI_RATE_LIMIT_BURST_S sets
+        how many seconds of budget may be spent at once."""
+        limits = {model: dict(limit) for model, limit in RATE_LIMITS.items()}
+        overrides = os.getenv('OPENAI_RATE_LIMITS')
+        if overrides:
+            try:
+                for model, limit in json.loads(overrides).items():
+                    limits[model] = dict(limit) if limit else None
+            except (ValueError, AttributeError, TypeError) as e:
+                logger.warning(f"Ignoring invalid OPENAI_RATE_LIMITS: {e}")
+        return cls(limits, burst_seconds=float(os.getenv('OPENAI_RATE_LIMIT_BURST_S', '10')))
+
+    def acquire(self, model: str, tokens: int = 0, timeout: Optional[float] = None):
+        """Block until the call may be sent; TimeoutError after ``timeout`` seconds in the queue."""
+        budget = self._budgets.get(model)
+        if budget is None:
+            return
+        level = current_priority()
+        ticket = self._enqueue(budget, level)
+        started = time.monotonic()
+        deadline = None if timeout is None else started + timeout
+        try:
+            with self._cond:
+                while True:
+                    wait = self._ready_in(budget, ticket, tokens)
+                    if wait == 0:
+                        break
+                    if deadline is not None:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            raise TimeoutError(f"Waited {timeout:.1f}s for {model} rate-limit budget")
+                        wait = remaining if wait is None else min(wait, remaining)
+                    self._cond.wait(wait)
+        except BaseException:
+            self._dequeue(budget, ticket)
+            raise
+        OPENAI_QUEUE_SECONDS.observe(time.monotonic() - started, model=model, priority=level)
+
+    async def acquire_async(self, model: str, tokens: int = 0, timeout: Optional[float] = None):
+        """Coroutine version of :meth:`acquire`; waits without blocking the event loop."""
+        budget = self._budgets.get(model)
+        if budget is None:
+            return
+        level = current_priority()
+        ticket = self._enqueue(budget, level)
+        started = time.monotonic()
+        deadline = None if timeout is None else started + timeout
+        try:
+            while True:
+                with self._cond:
+                    wait = self._ready_in(budget, ticket, tokens)
+                if wait == 0:
+                    break
+                delay = ASYNC_POLL_SECONDS if wait is None else wait
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutError(f"Waited {timeout:.1f}s for {model} rate-limit budget")
+                    delay = min(delay, remaining)
+                await asyncio.sleep(delay)
+        except BaseException:
+            self._dequeue(budget, ticket)
+            raise
+        OPENAI_QUEUE_SECONDS.observe(time.monotonic() - started, model=model, priority=level)
+
+    def try_acquire(self, model: str, tokens: int = 0) -> bool:
+        """Take budget only if nobody is queued and it is available right now (used for hedges)."""
+        budget = self._budgets.get(model)
+        if budget is None:
+            return True
+        with self._cond:
+            if budget.queue or budget.wait_time(tokens, time.monotonic()) > 0:
+                return False
+            budget.take(tokens)
+            return True
+
+    def queue_depths(self) -> Dict[Tuple[str, str], int]:
+        with self._cond:
+            depths = {(model, level): 0 for model in self._budgets for level in PRIORITIES}
+            for model, budget in self._budgets.items():
+                for rank, _ in budget.queue:
+                    depths[(model, PRIORITIES[rank])] += 1
+            return depths
+
+    def _enqueue(self, budget: _ModelBudget, level: str) -> Tuple[int, int]:
+        ticket = (PRIORITIES.index(level), next(self._arrivals))
+        with self._cond:
+            heapq.heappush(budget.queue, ticket)
+        return ticket
+
+    def _dequeue(self, budget: _ModelBudget, ticket: Tuple[int, int]):
+        with self._cond:
+            if ticket in budget.queue:
+                budget.queue.remove(ticket)
+                heapq.heapify(budget.queue)
+                self._cond.notify_all()
+
+    def _ready_in(self, budget: _ModelBudget, ticket: Tuple[int, int], tokens: int) -> Optional[float]:
+        """0 after taking the budget for ``ticket``; otherwise seconds to wait,
+        or None when other calls are ahead of it. Called with the lock held."""
+        if budget.queue[0] != ticket:
+            return None
+        wait = budget.wait_time(tokens, time.monotonic())
+        if wait > 0:
+            return wait
+        heapq.heappop(budget.queue)
+        budget.take(tokens)
+        self._cond.notify_all()
+        return 0
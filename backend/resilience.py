@@ -0,0 +1,470 @@
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, Optional
+
+from metrics import current_stage, metrics
+from rate_limit import RateLimitScheduler, estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# Per-stage call policy, looked up by the ``timed`` stage the call runs
+# under (``generate_image:dall-e-3`` falls back to ``generate_image``).
+#   timeout:  seconds allowed for one attempt
+#   deadline: seconds allowed for the whole call, retries included
+#   retries:  extra attempts after a retryable failure
+#   hedge:    send a duplicate when an attempt outlives the stage's p95;
+#             only for cheap idempotent calls
+CALL_POLICIES: Dict[str, Dict[str, Any]] = {
+    'gpt_analysis': {'timeout': 20.0, 'deadline': 45.0, 'retries': 2, 'hedge': True},
+    'gpt_refine': {'timeout': 20.0, 'deadline': 45.0, 'retries': 2, 'hedge': True},
+    'gpt_compose': {'timeout': 20.0, 'deadline': 45.0, 'retries': 2, 'hedge': True},
+    'gpt_fused': {'timeout': 30.0, 'deadline': 60.0, 'retries': 1, 'hedge': False},
+    'generate_image': {'timeout': 90.0, 'deadline': 150.0, 'retries': 2, 'hedge': False},
+    'default': {'timeout': 30.0, 'deadline': 60.0, 'retries': 2, 'hedge': False},
+}
+
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 8.0
+# Until a stage has this many latency samples, hedge after HEDGE_DEFAULT_DELAY
+HEDGE_MIN_SAMPLES = 20
+HEDGE_DEFAULT_DELAY = 4.0
+HEDGE_MIN_DELAY = 0.05
+
+OPENAI_RETRIES = metrics.counter(
+    'openai_retries_total', 'OpenAI calls retried after a failed attempt', ['stage', 'reason']
+)
+OPENAI_HEDGES = metrics.counter(
+    'openai_hedged_requests_total', 'Hedged duplicate OpenAI requests by which copy answered first',
+    ['stage', 'winner']
+)
+OPENAI_REJECTIONS = metrics.counter(
+    'openai_circuit_rejections_total', 'OpenAI calls failed fast by an open circuit breaker', ['api']
+)
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling an API whose circuit breaker is open."""
+
+    def __init__(self, api: str, retry_in: float):
+        super().__init__(f"OpenAI {api} API circuit is open, retry in {retry_in:.0f}s")
+        self.api = api
+        self.retry_in = retry_in
+
+
+def retry_reason(error: BaseException) -> Optional[str]:
+    """Why ``error`` is worth retrying, or None when it is not (bad request, auth ...)."""
+    if isinstance(error, (TimeoutError, asyncio.TimeoutError)):
+        return 'timeout'
+    name = type(error).__name__
+    if name == 'APITimeoutError':
+        return 'timeout'
+    if name == 'APIConnectionError':
+        return 'connection'
+    status = getattr(error, 'status_code', None)
+    if status == 429:
+        return 'rate_limit'
+    if status in (408, 409) or (isinstance(status, int) and status >= 500):
+        return 'server_error'
+    return None
+
+
+def _retry_after(error: BaseException) -> Optional[float]:
+    response = getattr(error, 'response', None)
+    value = getattr(response, 'headers', {}).get('retry-after') if response is not None else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def _backoff(attempt: int, error: BaseException) -> float:
+    """Full-jitter exponential backoff; a server Retry-After wins when it is longer."""
+    delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+    return max(delay, _retry_after(error) or 0.0)
+
+
+class CallPolicy:
+    def __init__(self, timeout: float = 30.0, deadline: float = 60.0, retries: int = 2, hedge: bool = False):
+        self.timeout = timeout
+        self.deadline = deadline
+        self.retries = retries
+        self.hedge = hedge
+
+    @classmethod
+    def table_from_env(cls) -> Dict[str, "CallPolicy"]:
+        """CALL_POLICIES merged with the JSON object in OPENAI_CALL_POLICIES
+        (e.g. ``{"gpt_analysis": {"timeout": 10}}``); OPENAI_HEDGING=0 turns hedging off."""
+        table = {stage: dict(policy) for stage, policy in CALL_POLICIES.items()}
+        overrides = os.getenv('OPENAI_CALL_POLICIES')
+        if overrides:
+            try:
+                for stage, policy in json.loads(overrides).items():
+                    table.setdefault(stage, dict(CALL_POLICIES['default'])).update(policy)
+            except (ValueError, AttributeError) as e:
+                logger.warning(f"Ignoring invalid OPENAI_CALL_POLICIES: {e}")
+        hedging = os.getenv('OPENAI_HEDGING', '1') == '1'
+        return {stage: cls(**{**policy, 'hedge': policy.get('hedge', False) and hedging})
+                for stage, policy in table.items()}
+
+
+class CircuitBreaker:
+    """Opens when the failure rate over the last ``window`` seconds reaches
+    ``failure_rate`` (after at least ``min_calls`` calls).
+
+    While open every call is rejected. After ``cooldown`` seconds a single
+    probe call is let through (half-open): success closes the breaker,
+    failure opens it for another cooldown. Only upstream failures (timeouts,
+    connection errors, 429 and 5xx) count; a 400 is the caller's fault.
+    """
+
+    def __init__(self, name: str, failure_rate: float = 0.5, min_calls: int = 10,
+                 window: float = 30.0, cooldown: float = 30.0):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.window = window
+        self.cooldown = cooldown
+        self._calls: deque = deque()
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, name: str) -> "CircuitBreaker":
+        return cls(
+            name,
+            failure_rate=float(os.getenv('OPENAI_BREAKER_FAILURE_RATE', '0.5')),
+            min_calls=int(os.getenv('OPENAI_BREAKER_MIN_CALLS', '10')),
+            window=float(os.getenv('OPENAI_BREAKER_WINDOW_S', '30')),
+            cooldown=float(os.getenv('OPENAI_BREAKER_COOLDOWN_S', '30'))
+        )
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return 'closed'
+            if self._probing or time.monotonic() - self._opened_at >= self.cooldown:
+                return 'half_open'
+            return 'open'
+
+    def acquire(self) -> bool:
+        """Raise CircuitOpenError unless a call may go out now; True when that call is the probe."""
+        with self._lock:
+            if self._opened_at is None:
+                return False
+            remaining = self.cooldown - (time.monotonic() - self._opened_at)
+            if remaining <= 0 and not self._probing:
+                self._probing = True
+                logger.info(f"Circuit {self.name} half-open, sending a probe call")
+                return True
+        OPENAI_REJECTIONS.inc(api=self.name)
+        raise CircuitOpenError(self.name, max(0.0, remaining))
+
+    def record(self, ok: bool):
+        now = time.monotonic()
+        with self._lock:
+            if self._opened_at is not None:
+                if not self._probing:
+                    # A straggler that was sent before the breaker opened
+                    return
+                self._probing = False
+                if ok:
+                    logger.info(f"Circuit {self.name} closed")
+                    self._opened_at = None
+                    self._calls.clear()
+                    self._failures = 0
+                else:
+                    self._opened_at = now
+                return
+
+            self._calls.append((now, ok))
+            self._failures += not ok
+            while self._calls and self._calls[0][0] < now - self.window:
+                self._failures -= not self._calls.popleft()[1]
+            if len(self._calls) >= self.min_calls and self._failures / len(self._calls) >= self.failure_rate:
+                logger.warning(f"Circuit {self.name} opened: {self._failures}/{len(self._calls)} calls "
+                               f"failed in the last {self.window:.0f}s")
+                self._opened_at = now
+
+    def release(self):
+        """Give back the probe slot of a call that ended without a verdict (cancelled)."""
+        with self._lock:
+            self._probing = False
+
+
+class LatencyTracker:
+    """Recent successful attempt latencies per stage, for the hedging delay."""
+
+    def __init__(self, samples: int = 256):
+        self._samples: Dict[str, deque] = {}
+        self._size = samples
+        self._lock = threading.Lock()
+
+    def observe(self, stage: str, seconds: float):
+        with self._lock:
+            self._samples.setdefault(stage, deque(maxlen=self._size)).append(seconds)
+
+    def hedge_delay(self, stage: str) -> float:
+        with self._lock:
+            samples = sorted(self._samples.get(stage, ()))
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return HEDGE_DEFAULT_DELAY
+        return max(HEDGE_MIN_DELAY, samples[int(0.95 * (len(samples) - 1))])
+
+
+class _ResilientBase:
+    """Shared policy lookup for the sync and async wrappers."""
+
+    def __init__(self, client, breakers: Optional[Dict[str, CircuitBreaker]] = None,
+                 latency: Optional[LatencyTracker] = None,
+                 policies: Optional[Dict[str, CallPolicy]] = None,
+                 scheduler: Optional[RateLimitScheduler] = None):
+        self._client = client
+        self.scheduler = scheduler or RateLimitScheduler.from_env()
+        self.breakers = breakers if breakers is not None else {
+            'chat': CircuitBreaker.from_env('chat'),
+            'images': CircuitBreaker.from_env('images'),
+        }
+        self.latency = latency or LatencyTracker()
+        self.policies = policies or CallPolicy.table_from_env()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(
+            create=lambda **kwargs: self._call('chat', self._client.chat.completions.create, kwargs)
+        ))
+        self.images = SimpleNamespace(
+            generate=lambda **kwargs: self._call('images', self._client.images.generate, kwargs)
+        )
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def _policy(self, stage: str) -> CallPolicy:
+        return (self.policies.get(stage) or self.policies.get(stage.split(':')[0])
+                or self.policies['default'])
+
+    @staticmethod
+    def _cost(kwargs: Dict[str, Any]) -> int:
+        """Estimated tokens charged against the model's TPM budget (images only count as requests)."""
+        return estimate_tokens(kwargs) if 'messages' in kwargs else 0
+
+    def _call(self, api: str, create: Callable, kwargs: Dict[str, Any]):
+        raise NotImplementedError
+
+
+class ResilientOpenAI(_ResilientBase):
+    """Wraps an OpenAI client with per-call deadlines, jittered retries,
+    hedged requests and a circuit breaker per API.
+
+    ``chat.completions.create`` and ``images.generate`` are intercepted;
+    their policy comes from the ``timed`` stage they run under. Every
+    attempt first waits for its model's rate-limit budget in ``scheduler``;
+    that wait counts against the deadline but not the attempt timeout.
+    Build the wrapped client with ``max_retries=0`` so the SDK does not
+    retry too.
+
+    A hedged call's primary attempt runs on its own thread, started at
+    once; only duplicates use the ``hedge_workers`` pool, and a duplicate
+    is skipped when every pool worker is busy.
+    """
+
+    def __init__(self, client, breakers: Optional[Dict[str, CircuitBreaker]] = None,
+                 latency: Optional[LatencyTracker] = None,
+                 policies: Optional[Dict[str, CallPolicy]] = None,
+                 scheduler: Optional[RateLimitScheduler] = None, hedge_workers: int = 8):
+        super().__init__(client, breakers, latency, policies, scheduler)
+        self._hedge_workers = hedge_workers
+        self._hedge_slots = threading.BoundedSemaphore(hedge_workers)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+
+    def _call(self, api: str, create: Callable, kwargs: Dict[str, Any]):
+        stage = current_stage() or api
+        policy = self._policy(stage)
+        breaker = self.breakers[api]
+        deadline = time.monotonic() + policy.deadline
+
+        for attempt in range(policy.retries + 1):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f"{stage} exceeded its {policy.deadline:.0f}s deadline")
+            timeout = min(policy.timeout, remaining)
+            try:
+                if policy.hedge and not kwargs.get('stream'):
+                    return self._hedged(stage, breaker, create, kwargs, timeout, deadline)
+                return self._attempt(stage, breaker, create, kwargs, timeout, deadline)
+            except Exception as e:
+                reason = retry_reason(e)
+                delay = _backoff(attempt, e)
+                if reason is None or attempt == policy.retries or time.monotonic() + delay >= deadline:
+                    raise
+                OPENAI_RETRIES.inc(stage=stage, reason=reason)
+                logger.warning(f"{stage} attempt {attempt + 1} failed ({reason}: {e or type(e).__name__}), retrying in {delay:.2f}s")
+                time.sleep(delay)
+
+    def _attempt(self, stage: str, breaker: CircuitBreaker, create: Callable,
+                 kwargs: Dict[str, Any], timeout: float, deadline: float, queue: bool = True):
+        if queue:
+            self.scheduler.acquire(kwargs.get('model'), self._cost(kwargs), timeout=deadline - time.monotonic())
+            timeout = min(timeout, deadline - time.monotonic())
+        breaker.acquire()
+        started = time.monotonic()
+        try:
+            result = create(**{**kwargs, 'timeout': timeout})
+        except Exception as e:
+            breaker.record(retry_reason(e) is None)
+            raise
+        breaker.record(True)
+        # A stream returns once its headers arrive; that would drag the stage's hedge delay down
+        if not kwargs.get('stream'):
+            self.latency.observe(stage, time.monotonic() - started)
+        return result
+
+    def _hedged(self, stage: str, breaker: CircuitBreaker, create: Callable,
+                kwargs: Dict[str, Any], timeout: float, deadline: float):
+        """Run one attempt; if it is still running after the stage's p95, race a duplicate.
+
+        The primary gets a thread of its own rather than a pool slot, so it
+        starts immediately and the hedge delay runs from its start; the
+        caller only waits. The duplicate is only sent when a pool worker
+        and its rate-limit budget are free right now, so hedging never
+        queues behind (or delays) other calls.
+        """
+        context = contextvars.copy_context()
+        primary = Future()
+
+        def run_primary():
+            try:
+                primary.set_result(context.copy().run(self._attempt, stage, breaker, create, kwargs,
+                                                      timeout, deadline))
+            except BaseException as e:
+                primary.set_exception(e)
+
+        threading.Thread(target=run_primary, name='openai-primary', daemon=True).start()
+        done, _ = wait([primary], timeout=min(self.latency.hedge_delay(stage), timeout))
+        if done:
+            return primary.result()
+
+        if breaker.state != 'closed' or not self._hedge_slots.acquire(blocking=False):
+            return primary.result()
+        if not self.scheduler.try_acquire(kwargs.get('model'), self._cost(kwargs)):
+            self._hedge_slots.release()
+            return primary.result()
+        hedge = self._hedge_executor().submit(context.copy().run, self._hedge_attempt, stage, breaker, create,
+                                              kwargs, timeout, deadline)
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    OPENAI_HEDGES.inc(stage=stage, winner='hedge' if future is hedge else 'primary')
+                    # The other copy cannot be cancelled mid-request; its per-attempt
+                    # timeout bounds how long it keeps a worker busy
+                    return future.result()
+                error = error or future.exception()
+        raise error
+
+    def _hedge_attempt(self, stage: str, breaker: CircuitBreaker, create: Callable,
+                       kwargs: Dict[str, Any], timeout: float, deadline: float):
+        try:
+            return self._attempt(stage, breaker, create, kwargs, timeout, deadline, False)
+        finally:
+            self._hedge_slots.release()
+
+    def _hedge_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self._hedge_workers,
+                                                        thread_name_prefix='openai-hedge')
+        return self._executor
+
+
+class AsyncResilientOpenAI(_ResilientBase):
+    """Async counterpart of :class:`ResilientOpenAI`; pass the sync wrapper's
+    ``breakers``, ``latency`` and ``scheduler`` so both paths see the same
+    upstream health and share one rate-limit budget."""
+
+    async def _call(self, api: str, create: Callable, kwargs: Dict[str, Any]):
+        stage = current_stage() or api
+        policy = self._policy(stage)
+        breaker = self.breakers[api]
+        deadline = time.monotonic() + policy.deadline
+
+        for attempt in range(policy.retries + 1):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f"{stage} exceeded its {policy.deadline:.0f}s deadline")
+            timeout = min(policy.timeout, remaining)
+            try:
+                if policy.hedge and not kwargs.get('stream'):
+                    return await self._hedged(stage, breaker, create, kwargs, timeout, deadline)
+                return await self._attempt(stage, breaker, create, kwargs, timeout, deadline)
+            except Exception as e:
+                reason = retry_reason(e)
+                delay = _backoff(attempt, e)
+                if reason is None or attempt == policy.retries or time.monotonic() + delay >= deadline:
+                    raise
+                OPENAI_RETRIES.inc(stage=stage, reason=reason)
+                logger.warning(f"{stage} attempt {attempt + 1} failed ({reason}: {e or type(e).__name__}), retrying in {delay:.2f}s")
+                await asyncio.sleep(delay)
+
+    async def _attempt(self, stage: str, breaker: CircuitBreaker, create: Callable,
+                       kwargs: Dict[str, Any], timeout: float, deadline: float, queue: bool = True):
+        if queue:
+            await self.scheduler.acquire_async(kwargs.get('model'), self._cost(kwargs),
+                                               timeout=deadline - time.monotonic())
+            timeout = min(timeout, deadline - time.monotonic())
+        probe = breaker.acquire()
+        started = time.monotonic()
+        try:
+            # The SDK timeout covers each HTTP read; wait_for also bounds the total
+            result = await asyncio.wait_for(create(**{**kwargs, 'timeout': timeout}), timeout)
+        except asyncio.CancelledError:
+            if probe:
+                breaker.release()
+            raise
+        except Exception as e:
+            breaker.record(retry_reason(e) is None)
+            raise
+        breaker.record(True)
+        # A stream returns once its headers arrive; that would drag the stage's hedge delay down
+        if not kwargs.get('stream'):
+            self.latency.observe(stage, time.monotonic() - started)
+        return result
+
+    async def _hedged(self, stage: str, breaker: CircuitBreaker, create: Callable,
+                      kwargs: Dict[str, Any], timeout: float, deadline: float):
+        primary = asyncio.ensure_future(self._attempt(stage, breaker, create, kwargs, timeout, deadline))
+        done, _ = await asyncio.wait([primary], timeout=min(self.latency.hedge_delay(stage), timeout))
+        if done:
+            return primary.result()
+
+        if breaker.state != 'closed' or not self.scheduler.try_acquire(kwargs.get('model'), self._cost(kwargs)):
+            return await primary
+        hedge = asyncio.ensure_future(self._attempt(stage, breaker, create, kwargs, timeout, deadline, False))
+        pending = {primary, hedge}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        OPENAI_HEDGES.inc(stage=stage, winner='hedge' if task is hedge else 'primary')
+                        return task.result()
+                    error = error or task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
@@ -0,0 +1,160 @@
+import contextlib
+import logging
+import os
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Settings per SD_CPU_PROFILE; each key can be overridden by its own variable
+CPU_PROFILES: Dict[str, Dict[str, Any]] = {
+    # Torch defaults and the implicit CPU autocast the pipeline always used
+    'baseline': {'threads': 0, 'interop_threads': 0, 'channels_last': False, 'bf16': None, 'compile_unet': False},
+    'optimized': {'threads': -1, 'interop_threads': 1, 'channels_last': True, 'bf16': True, 'compile_unet': False},
+    'compiled': {'threads': -1, 'interop_threads': 1, 'channels_last': True, 'bf16': True, 'compile_unet': True},
+}
+
+_ENV_OVERRIDES = {
+    'threads': 'SD_CPU_THREADS',
+    'interop_threads': 'SD_CPU_INTEROP_THREADS',
+    'channels_last': 'SD_CPU_CHANNELS_LAST',
+    'bf16': 'SD_CPU_BF16',
+    'compile_unet': 'SD_CPU_COMPILE',
+}
+
+
+def _available_cpus() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def bf16_supported() -> bool:
+    """Whether this CPU has native bfloat16 kernels (AVX512-BF16 / AMX)."""
+    import torch
+
+    check = getattr(torch.ops.mkldnn, '_is_mkldnn_bf16_supported', None)
+    try:
+        return bool(check()) if check is not None else False
+    except Exception:
+        return False
+
+
+class CPUProfile:
+    """How the Stable Diffusion pipeline is set up when CUDA is not available.
+
+    ``threads`` / ``interop_threads``: 0 keeps the torch default, -1 uses
+    every CPU this process may run on. ``bf16``: True autocasts to bfloat16
+    when the CPU supports it, False runs float32, None keeps the plain
+    ``torch.autocast("cpu")`` of the baseline. ``compile_unet`` wraps the
+    UNet in ``torch.compile``; compiled graphs are cached in
+    ``compile_cache_dir`` so later processes skip most of the compilation.
+    """
+
+    def __init__(self, name: str = 'optimized', threads: int = -1, interop_threads: int = 1,
+                 channels_last: bool = True, bf16: Optional[bool] = True, compile_unet: bool = False,
+                 compile_cache_dir: Optional[str] = None):
+        self.name = name
+        self.threads = threads
+        self.interop_threads = interop_threads
+        self.channels_last = channels_last
+        self.bf16 = bf16
+        self.compile_unet = compile_unet
+        self.compile_cache_dir = compile_cache_dir
+        self._bf16_active: Optional[bool] = None
+
+    @classmethod
+    def from_env(cls) -> "CPUProfile":
+        name = os.getenv('SD_CPU_PROFILE', 'optimized')
+        if name not in CPU_PROFILES:
+            logger.warning(f"Unknown SD_CPU_PROFILE {name}, using optimized")
+            name = 'optimized'
+
+        settings = dict(CPU_PROFILES[name])
+        for field, variable in _ENV_OVERRIDES.items():
+            value = os.getenv(variable)
+            if value is None or value == '':
+                continue
+            if field in ('threads', 'interop_threads'):
+                settings[field] = int(value)
+            elif field == 'bf16' and value.lower() == 'default':
+                settings[field] = None
+            else:
+                settings[field] = value.lower() in ('1', 'true', 'yes', 'on')
+
+        return cls(
+            name=name,
+            compile_cache_dir=os.getenv('SD_COMPILE_CACHE_DIR'),
+            **settings
+        )
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            'profile': self.name,
+            'threads': self.threads,
+            'interop_threads': self.interop_threads,
+            'channels_last': self.channels_last,
+            'bf16': self.bf16_active if self.bf16 else self.bf16,
+            'compile_unet': self.compile_unet
+        }
+
+    @property
+    def bf16_active(self) -> bool:
+        if self._bf16_active is None:
+            self._bf16_active = bool(self.bf16) and bf16_supported()
+            if self.bf16 and not self._bf16_active:
+                logger.info("bfloat16 requested but not supported by this CPU, running float32")
+        return self._bf16_active
+
+    def configure_threads(self):
+        """Apply the torch thread pools; process-wide, so call it once before inference."""
+        import torch
+
+        if self.threads:
+            threads = _available_cpus() if self.threads < 0 else self.threads
+            torch.set_num_threads(threads)
+            logger.info(f"torch intra-op threads: {threads}")
+
+        if self.interop_threads:
+            threads = _available_cpus() if self.interop_threads < 0 else self.interop_threads
+            try:
+                torch.set_num_interop_threads(threads)
+                logger.info(f"torch inter-op threads: {threads}")
+            except RuntimeError as e:
+                # Only allowed before the first parallel op in the process
+                logger.info(f"Could not set inter-op threads: {e}")
+
+    def apply(self, pipeline):
+        """Configure ``pipeline`` for CPU inference and return it."""
+        import torch
+
+        self.configure_threads()
+
+        if self.channels_last:
+            pipeline.unet.to(memory_format=torch.channels_last)
+            pipeline.vae.to(memory_format=torch.channels_last)
+            logger.info("channels_last memory format enabled")
+
+        if self.compile_unet:
+            if self.compile_cache_dir:
+                os.makedirs(self.compile_cache_dir, exist_ok=True)
+                os.environ.setdefault('TORCHINDUCTOR_CACHE_DIR', self.compile_cache_dir)
+            os.environ.setdefault('TORCHINDUCTOR_FX_GRAPH_CACHE', '1')
+            try:
+                pipeline.unet = torch.compile(pipeline.unet)
+                logger.info("UNet wrapped with torch.compile (compiles on first generation)")
+            except Exception as e:
+                logger.warning(f"torch.compile unavailable, running eager: {e}")
+
+        logger.info(f"Stable Diffusion CPU profile: {self.describe()}")
+        return pipeline
+
+    def autocast(self):
+        """Context manager for one CPU pipeline call."""
+        import torch
+
+        if self.bf16 is None:
+            return torch.autocast("cpu")
+        if self.bf16_active:
+            return torch.autocast("cpu", dtype=torch.bfloat16)
+        return contextlib.nullcontext()
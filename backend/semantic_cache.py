@@ -0,0 +1,105 @@
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class SemanticImageCache:
+    """Recent generations keyed by the CLIP text embedding of their prompt.
+
+    ``lookup`` returns a stored image when a previous prompt rendered with
+    the same model, size and quality is at least ``threshold`` cosine
+    similar to the new one, so rewordings such as "a red fox in snow" and
+    "red fox standing in the snow" cost one generation instead of two.
+
+    Entries live in a ring of ``capacity`` rows: one float32 matrix that is
+    scored with a single matrix-vector product per lookup. Entries older
+    than ``ttl`` seconds are ignored, because DALL-E URLs expire.
+    """
+
+    def __init__(self, capacity: int = 256, threshold: float = 0.95, ttl: float = 3600.0):
+        self.capacity = capacity
+        self.threshold = threshold
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._vectors: Optional[np.ndarray] = None
+        self._keys = np.full(capacity, -1, dtype=np.int32)
+        self._stored_at = np.zeros(capacity, dtype=np.float64)
+        self._entries: List[Optional[Dict[str, Any]]] = [None] * capacity
+        self._key_codes: Dict[Tuple[str, str, str], int] = {}
+        self._next = 0
+
+    @classmethod
+    def from_env(cls) -> Optional["SemanticImageCache"]:
+        """SEMANTIC_CACHE_SIZE (0, the default, disables the cache), SEMANTIC_CACHE_THRESHOLD
+        and SEMANTIC_CACHE_TTL_S."""
+        capacity = int(os.getenv('SEMANTIC_CACHE_SIZE', '0'))
+        if capacity <= 0:
+            return None
+        return cls(
+            capacity=capacity,
+            threshold=float(os.getenv('SEMANTIC_CACHE_THRESHOLD', '0.95')),
+            ttl=float(os.getenv('SEMANTIC_CACHE_TTL_S', '3600'))
+        )
+
+    def lookup(self, embedding, model: str, size: str,
+               quality: str) -> Optional[Tuple[Dict[str, Any], float]]:
+        """Best stored entry for ``embedding`` and its similarity, or None below the threshold."""
+        query = self._normalized(embedding)
+        with self._lock:
+            code = self._key_codes.get((model, size, quality))
+            best, similarity = None, -1.0
+            if code is not None and self._vectors is not None:
+                live = (self._keys == code) & (self._stored_at >= time.time() - self.ttl)
+                if live.any():
+                    scores = np.where(live, self._vectors @ query, -np.inf)
+                    row = int(np.argmax(scores))
+                    if scores[row] >= self.threshold:
+                        best, similarity = self._entries[row], float(scores[row])
+
+            if best is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return dict(best), similarity
+
+    def put(self, embedding, model: str, size: str, quality: str, url: str, prompt: str,
+            seed: Optional[int] = None):
+        vector = self._normalized(embedding)
+        with self._lock:
+            if self._vectors is None:
+                self._vectors = np.zeros((self.capacity, vector.shape[0]), dtype=np.float32)
+            elif vector.shape[0] != self._vectors.shape[1]:
+                logger.warning(f"Ignoring {vector.shape[0]}-d embedding in a {self._vectors.shape[1]}-d cache")
+                return
+
+            row = self._next
+            self._next = (self._next + 1) % self.capacity
+            self._vectors[row] = vector
+            self._keys[row] = self._key_codes.setdefault((model, size, quality), len(self._key_codes))
+            self._stored_at[row] = time.time()
+            self._entries[row] = {'url': url, 'prompt': prompt, 'seed': seed}
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': int(np.sum(self._keys >= 0)),
+                'capacity': self.capacity,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0
+            }
+
+    @staticmethod
+    def _normalized(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
@@ -19,8 +19,10 @@ class ApiService {
                 throw new Error(`HTTP error! status: ${response.status}`);
             }
 
-            const data = await response.json();
-            return data;
+            // The proxy returns the raw image with its real content type
+            const blob = await response.blob();
+            const data = await this._blobToDataUrl(blob);
+            return { success: true, data, blob };
 
         } catch (error) {
             console.error('Image proxy error:', error);
@@ -28,6 +30,45 @@ class ApiService {
         }
     }
 
+    // Data URL for any image the canvas shows: data URLs pass through,
+    // images served by this backend are read directly, remote ones via the proxy
+    async imageToDataUrl(imageUrl) {
+        if (imageUrl.startsWith('data:image')) {
+            return imageUrl;
+        }
+        if (imageUrl.startsWith('/')) {
+            const response = await fetch(imageUrl);
+            if (!response.ok) {
+                throw new Error(`Failed to fetch image: ${response.status}`);
+            }
+            return await this._blobToDataUrl(await response.blob());
+        }
+        const result = await this.proxyImage(imageUrl);
+        return result.data;
+    }
+
+    // Raw image bytes for any image the canvas shows, for multipart uploads
+    async imageToBlob(imageUrl) {
+        if (imageUrl.startsWith('data:image') || imageUrl.startsWith('/')) {
+            const response = await fetch(imageUrl);
+            if (!response.ok) {
+                throw new Error(`Failed to fetch image: ${response.status}`);
+            }
+            return await response.blob();
+        }
+        const result = await this.proxyImage(imageUrl);
+        return result.blob;
+    }
+
+    _blobToDataUrl(blob) {
+        return new Promise((resolve, reject) => {
+            const reader = new FileReader();
+            reader.onload = () => resolve(reader.result);
+            reader.onerror = () => reject(reader.error);
+            reader.readAsDataURL(blob);
+        });
+    }
+
     async generateImage(prompt, options = {}) {
     try {
         console.log('Generating image with prompt:', prompt);
@@ -101,16 +142,26 @@ class ApiService {
             const cachedResult = this._getFromCache(cacheKey);
             if (cachedResult) return cachedResult;
 
-            const response = await fetch(`${this.baseUrl}/analyze`, {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json'
-                },
-                body: JSON.stringify({
-                    prompt,
-                    image_data: imageData
-                })
-            });
+            // Blobs go up as multipart/form-data: no base64 inflation or JSON parsing
+            let options;
+            if (imageData instanceof Blob) {
+                const form = new FormData();
+                form.append('prompt', prompt);
+                form.append('image', imageData, 'image');
+                options = { method: 'POST', body: form };
+            } else {
+                options = {
+                    method: 'POST',
+                    headers: {
+                        'Content-Type': 'application/json'
+                    },
+                    body: JSON.stringify({
+                        prompt,
+                        image_data: imageData
+                    })
+                };
+            }
+            const response = await fetch(`${this.baseUrl}/analyze`, options);
 
             if (!response.ok) {
                 throw new Error(`HTTP error! status: ${response.status}`);
@@ -170,6 +221,65 @@ class ApiService {
         }
     }
 
+    // POST to a Server-Sent Events endpoint; onEvent(name, data) is awaited for
+    // each event in order. Resolves with the `done` payload, rejects on `error`.
+    // FormData bodies are sent as multipart, anything else as JSON.
+    async streamEvents(endpoint, data, onEvent) {
+        const isForm = data instanceof FormData;
+        const headers = { 'Accept': 'text/event-stream' };
+        if (!isForm) headers['Content-Type'] = 'application/json';
+        const response = await fetch(`${this.baseUrl}/${endpoint}`, {
+            method: 'POST',
+            headers,
+            body: isForm ? data : JSON.stringify(data)
+        });
+
+        if (!response.ok) {
+            let message = `HTTP error! status: ${response.status}`;
+            try {
+                const errorData = await response.json();
+                message = errorData.error || message;
+            } catch (e) {}
+            throw new Error(message);
+        }
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const frame = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+
+                let event = 'message';
+                const dataLines = [];
+                for (const line of frame.split('\n')) {
+                    if (line.startsWith('event:')) event = line.slice(6).trim();
+                    else if (line.startsWith('data:')) dataLines.push(line.slice(5).trim());
+                }
+                if (!dataLines.length) continue;
+
+                const payload = JSON.parse(dataLines.join('\n'));
+                if (event === 'error') {
+                    throw new Error(payload.error || 'Operation failed');
+                }
+                if (event === 'done') {
+                    reader.cancel();
+                    return payload;
+                }
+                if (onEvent) await onEvent(event, payload);
+            }
+        }
+
+        throw new Error('Stream ended unexpectedly');
+    }
+
     async _request(endpoint, data = {}, method = 'POST') {
         const options = {
             method,
@@ -2686,33 +2686,38 @@ class Node {
 
         console.log(`Using model: ${currentModel}, size: ${currentSize} for interpolation`);
 
-        const response = await fetch('/api/interpolate', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json'
-            },
-            body: JSON.stringify({
-                features,
-                model: currentModel,
-                size: currentSize,
-                quality: 'standard'
-            })
+        // Render the image as soon as it is ready; the analysis may arrive later
+        let streamedPrompt = null;
+        let streamedAnalysis = null;
+        let imageShown = false;
+
+        const result = await apiService.streamEvents('interpolate/stream', {
+            features,
+            model: currentModel,
+            size: currentSize,
+            quality: 'standard'
+        }, async (event, data) => {
+            if (event === 'refined') {
+                streamedPrompt = data.prompt;
+            } else if (event === 'image') {
+                imageShown = true;
+                await this.convertToImageNode(data.url, streamedPrompt, streamedAnalysis || {});
+            } else if (event === 'analysis') {
+                streamedAnalysis = data.analysis;
+                if (imageShown) {
+                    this.featureAnalysis = data.analysis;
+                    await this.updateAttributesDisplay();
+                }
+            }
         });
 
-        if (!response.ok) {
-            throw new Error(`Server error: ${response.status}`);
-        }
-
-        const result = await response.json();
-        if (!result.success) {
-            throw new Error(result.error || 'Generation failed');
+        if (!imageShown) {
+            await this.convertToImageNode(
+                result.url,
+                result.prompt,
+                result.analysis
+            );
         }
-
-        await this.convertToImageNode(
-            result.url,
-            result.prompt,
-            result.analysis
-        );
     } catch (error) {
         console.error('Generate image error:', error);
         this.showError(error.message);
@@ -2747,28 +2752,12 @@ class Node {
         });
         return prompt;
     }
-    async getImageData() {
+    async getImageBlob() {
         try {
             if (!this.imageUrl) {
                 return null;
             }
-            if (this.imageUrl.startsWith('data:image')) {
-                return this.imageUrl;
-            }
-            const response = await fetch('/api/proxy-image', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json'
-                },
-                body: JSON.stringify({
-                    url: this.imageUrl
-                })
-            });
-            if (!response.ok) {
-                throw new Error(`Failed to fetch image: ${response.status}`);
-            }
-            const result = await response.json();
-            return result.data;
+            return await apiService.imageToBlob(this.imageUrl);
         } catch (error) {
             console.error('Error getting image data:', error);
             throw error;
@@ -2783,32 +2772,30 @@ class Node {
         this.setAnalysisStatus('Analyzing features...');
         this.isAnalyzing = true;
 
-        let imageData = null;
+        // The image is uploaded as a multipart file rather than base64 JSON
+        const form = new FormData();
+        form.append('prompt', this.prompt || '');
         if (this.imageUrl) {
             try {
-                imageData = await this.getImageData();
+                const imageBlob = await this.getImageBlob();
+                if (imageBlob) {
+                    form.append('image', imageBlob, 'image');
+                }
             } catch (error) {
                 console.warn('Image processing failed:', error);
                 this.setAnalysisStatus('Warning: Image processing failed, analyzing prompt only...', true);
             }
         }
 
-        const response = await fetch('/api/analyze', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json'
-            },
-            body: JSON.stringify({
-                prompt: this.prompt,
-                image_data: imageData
-            })
+        // Categories are shown as soon as the server has analyzed each one
+        const partial = {};
+        const result = await apiService.streamEvents('analyze/stream', form, async (event, data) => {
+            if (event !== 'category') return;
+            partial[data.category] = data.terms;
+            this.featureAnalysis = { features: { ...partial } };
+            this.setAnalysisStatus(`Analyzing features... (${Object.keys(partial).length} categories)`);
+            await this.updateAttributesDisplay();
         });
-
-        if (!response.ok) {
-            throw new Error(`Analysis request failed: ${response.status}`);
-        }
-
-        const result = await response.json();
         if (!result.success) {
             throw new Error(result.error || 'Analysis failed');
         }
@@ -4066,7 +4053,7 @@ class Node {
             childrenCount: newElement.children.length
         });
 
-        if (imageUrl && (imageUrl.startsWith('http') || imageUrl.startsWith('data:image'))) {
+        if (imageUrl && (imageUrl.startsWith('http') || imageUrl.startsWith('data:image') || imageUrl.startsWith('/'))) {
             console.log('🖼️ [convertToImageNode] Waiting for image to load...');
             await new Promise(resolve => {
                 const img = newElement.querySelector('img');